@@ -1,5 +1,7 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 
+from .database.post_index import NotCompiledError
 from .routers import index, config, archive
 
 app = FastAPI()
@@ -7,3 +9,8 @@ app = FastAPI()
 app.include_router(index.router)
 app.include_router(config.router)
 app.include_router(archive.router)
+
+
+@app.exception_handler(NotCompiledError)
+async def not_compiled_handler(request: Request, error: NotCompiledError):
+    return JSONResponse(status_code=404, content={"detail": str(error)})
@@ -0,0 +1,155 @@
+import os
+import sqlite3
+from operator import itemgetter
+from typing import List
+
+from loguru import logger
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app.database.models import (
+    Base,
+    Tag,
+    QuestionPost,
+    AnswerPost,
+    TagToPost,
+    ConfigValues,
+)
+
+QUESTION_COLUMNS = (
+    "id",
+    "start",
+    "length",
+    "score",
+    "accepted_answer_id",
+    "row_hash",
+)
+ANSWER_COLUMNS = ("id", "start", "length", "score", "question_post_id", "row_hash")
+TAG_TO_POST_COLUMNS = ("tag_id", "post_id")
+TAG_COLUMNS = ("id", "name", "count_usage")
+
+
+def _insert_sql(table_name: str, columns: tuple) -> str:
+    return (
+        f"INSERT INTO {table_name} ({', '.join(columns)})"
+        f" VALUES ({', '.join('?' * len(columns))})"
+    )
+
+
+class BulkLoader:
+    """Fill new archive database with relaxed durability
+
+    Rows go to `<database>.bulk` without journal and secondary indexes,
+    indexes and foreign keys are done once in `finish`, then the file
+    replace archive database. Crash during load leave old database as is.
+    """
+
+    def __init__(self, database_path: str, cache_size_mb: int = 512):
+        self.database_path = database_path
+        self.bulk_path = f"{database_path}.bulk"
+        self.cache_size_mb = cache_size_mb
+        self.connection: sqlite3.Connection = None
+        self.rows_count = 0
+
+    def open(self, copy_tables: List[str] = ()):
+        """Create empty tables, `copy_tables` are copied from archive database"""
+        if os.path.exists(self.bulk_path):
+            os.remove(self.bulk_path)
+        self.connection = sqlite3.connect(
+            self.bulk_path, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=OFF")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        # only bulk file, attached archive database stay readable by requests
+        self.connection.execute("PRAGMA main.locking_mode=EXCLUSIVE")
+        self.connection.execute(f"PRAGMA cache_size=-{self.cache_size_mb * 1024}")
+
+        dialect = sqlite.dialect()
+        for table in Base.metadata.sorted_tables:
+            self.connection.execute(str(CreateTable(table).compile(dialect=dialect)))
+
+        if copy_tables and os.path.exists(self.database_path):
+            self.connection.execute(
+                "ATTACH DATABASE ? AS source", (self.database_path,)
+            )
+            for table_name in copy_tables:
+                self.connection.execute(
+                    f"INSERT INTO {table_name} SELECT * FROM source.{table_name}"
+                )
+            self.connection.execute("DETACH DATABASE source")
+        self.connection.execute("BEGIN")
+
+    def insert_tags(self, tags: List[dict]):
+        self.connection.executemany(
+            _insert_sql(Tag.__tablename__, TAG_COLUMNS),
+            map(itemgetter(*TAG_COLUMNS), tags),
+        )
+        self.rows_count += len(tags)
+
+    def insert_post_data(
+        self, question_posts: List[dict], answers_posts: List[dict], tags_to_post
+    ):
+        self.connection.executemany(
+            _insert_sql(QuestionPost.__tablename__, QUESTION_COLUMNS),
+            map(itemgetter(*QUESTION_COLUMNS), question_posts),
+        )
+        self.connection.executemany(
+            _insert_sql(AnswerPost.__tablename__, ANSWER_COLUMNS),
+            map(itemgetter(*ANSWER_COLUMNS), answers_posts),
+        )
+        self.connection.executemany(
+            _insert_sql(TagToPost.__tablename__, TAG_TO_POST_COLUMNS),
+            map(itemgetter(*TAG_TO_POST_COLUMNS), tags_to_post),
+        )
+        self.rows_count += len(question_posts) + len(answers_posts)
+
+    def set_index(self, name: str, hash_file: str, index=False):
+        self.clear_index(name)
+        self.connection.execute(
+            f"INSERT INTO {ConfigValues.__tablename__} (name, hash_file, index_done)"
+            " VALUES (?, ?, ?)",
+            (name, hash_file, index),
+        )
+
+    def clear_index(self, name: str):
+        self.connection.execute(
+            f"DELETE FROM {ConfigValues.__tablename__} WHERE name = ?", (name,)
+        )
+
+    def finish(self):
+        """Create indexes, check foreign keys and close bulk database"""
+        self.connection.execute("COMMIT")
+        dialect = sqlite.dialect()
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                self.connection.execute(
+                    str(CreateIndex(index).compile(dialect=dialect))
+                )
+        broken_keys = self.connection.execute("PRAGMA foreign_key_check").fetchall()
+        if broken_keys:
+            logger.warning(
+                f"{len(broken_keys)} rows with broken foreign keys: {self.database_path}"
+            )
+        self.connection.execute("PRAGMA locking_mode=NORMAL")
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.close()
+        self.connection = None
+
+    def replace(self):
+        """Replace archive database by bulk database
+
+        All connections of archive database must be closed before.
+        """
+        # wal of old database must not be applied to new file
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(f"{self.database_path}{suffix}"):
+                os.remove(f"{self.database_path}{suffix}")
+        os.replace(self.bulk_path, self.database_path)
+        logger.info(f"bulk load {self.rows_count} rows: {self.database_path}")
+
+    def abort(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+        if os.path.exists(self.bulk_path):
+            os.remove(self.bulk_path)
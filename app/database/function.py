@@ -1,8 +1,64 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from sqlalchemy import AsyncAdaptedQueuePool, inspect
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 from app.database.models import Base
 
 database_session_makers = {}
+read_session_makers = {}
+read_gates = {}
+
+
+class ReadGate:
+    """Count of read sessions of database, closed while its file is replaced"""
+
+    def __init__(self):
+        self.active = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.opened = asyncio.Event()
+        self.opened.set()
+
+    async def enter(self):
+        while not self.opened.is_set():
+            await self.opened.wait()
+        self.active += 1
+        self.idle.clear()
+
+    def leave(self):
+        self.active -= 1
+        if not self.active:
+            self.idle.set()
+
+    @asynccontextmanager
+    async def closed(self):
+        """New sessions wait, active sessions are finished before body"""
+        self.opened.clear()
+        try:
+            await self.idle.wait()
+            yield
+        finally:
+            self.opened.set()
+
+
+def get_read_gate(path: str) -> ReadGate:
+    return read_gates.setdefault(path, ReadGate())
+
+
+def _add_missing_columns(connection):
+    """Add nullable columns added to models after database was created"""
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        names = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in names:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(
+                f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+            )
 
 
 async def get_database_session(path: str):
@@ -11,8 +67,41 @@ async def get_database_session(path: str):
     engine = create_async_engine(f"sqlite+aiosqlite:///{path}", echo=False)
     async_sessionmaker_obj = async_sessionmaker(engine)
     async with engine.begin() as conn:
+        # readers don't block writer and see last commit
+        await conn.exec_driver_sql("PRAGMA journal_mode=WAL")
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        # indexes added after database was created
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                await conn.run_sync(index.create, checkfirst=True)
 
     database_session_makers.update({path: async_sessionmaker_obj})
 
     return async_sessionmaker_obj
+
+
+async def get_read_database_session(path: str, pool_size: int = 8):
+    """Read only sessions from pooled connections, one session per request"""
+    if path in read_session_makers:
+        return read_session_makers.get(path)
+    # create tables before open read only
+    await get_database_session(path)
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///file:{path}?mode=ro&uri=true",
+        echo=False,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=pool_size,
+        max_overflow=pool_size * 2,
+    )
+    async_sessionmaker_obj = async_sessionmaker(engine, expire_on_commit=False)
+    read_session_makers.update({path: async_sessionmaker_obj})
+    return async_sessionmaker_obj
+
+
+async def dispose_database_session(path: str):
+    """Close pooled connections of database, used before file is replaced"""
+    for session_makers in (database_session_makers, read_session_makers):
+        async_sessionmaker_obj = session_makers.pop(path, None)
+        if async_sessionmaker_obj:
+            await async_sessionmaker_obj.kw["bind"].dispose()
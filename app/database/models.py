@@ -4,7 +4,7 @@ from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase, relationship
 from sqlalchemy.orm import mapped_column
 from sqlalchemy.orm import Mapped
-from sqlalchemy import String, Integer, ForeignKey, Column, Table
+from sqlalchemy import String, Integer, ForeignKey, Column, Table, Index, desc
 from sqlalchemy.schema import MetaData
 
 
@@ -14,6 +14,9 @@ class Base(AsyncAttrs, DeclarativeBase):
 
 class TagToPost(Base):
     __tablename__ = "post_tags"
+    # sorted post ids of every tag for tag filters
+    __table_args__ = (Index("ix_post_tags_tag_id_post_id", "tag_id", "post_id"),)
+
     post_id: Mapped[int] = mapped_column(
         ForeignKey("question_posts.id", ondelete="CASCADE"), primary_key=True
     )
@@ -29,11 +32,15 @@ class Tag(Base):
 
 class QuestionPost(Base):
     __tablename__ = "question_posts"
+    # best questions first for `order_by=score`
+    __table_args__ = (Index("ix_question_posts_score_id", desc("score"), "id"),)
     id: Mapped[int] = mapped_column(primary_key=True)
     start: Mapped[int]
     length: Mapped[int]
     score: Mapped[int]
     accepted_answer_id: Mapped[Optional[int]]
+    # hash of indexed attributes for incremental index, see `index_row_hash`
+    row_hash: Mapped[Optional[int]]
 
     answer_posts: Mapped[List["AnswerPost"]] = relationship()
     tags: Mapped[List[Tag]] = relationship(secondary="post_tags")
@@ -41,6 +48,8 @@ class QuestionPost(Base):
 
 class AnswerPost(Base):
     __tablename__ = "answer_posts"
+    # answers of question for post reads and export
+    __table_args__ = (Index("ix_answer_posts_question_post_id", "question_post_id"),)
     id: Mapped[int] = mapped_column(primary_key=True)
     start: Mapped[int]
     length: Mapped[int]
@@ -48,6 +57,7 @@ class AnswerPost(Base):
     question_post_id: Mapped[int] = mapped_column(
         ForeignKey("question_posts.id", ondelete="CASCADE"),
     )
+    row_hash: Mapped[Optional[int]]
 
 
 class ConfigValues(Base):
@@ -58,3 +68,17 @@ class ConfigValues(Base):
     name: Mapped[str] = mapped_column(unique=True)
     hash_file: Mapped[str]
     index_done: Mapped[bool]
+
+
+class IndexCheckpoint(Base):
+    """Position after last committed rows, saved in same transaction as rows"""
+
+    __tablename__ = "index_checkpoints"
+    name: Mapped[str] = mapped_column(primary_key=True)
+    hash_file: Mapped[str]
+    # bzip2 block with next line (bits in compressed stream), None for 7z
+    block_offset: Mapped[Optional[int]]
+    # decompressed offset of next line
+    byte_offset: Mapped[int]
+    rows_count: Mapped[int]
+    done: Mapped[bool] = mapped_column(default=False)
@@ -0,0 +1,413 @@
+import bisect
+import heapq
+import itertools
+import json
+import mmap
+import os
+import shutil
+import sqlite3
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from loguru import logger
+
+QUESTION_TYPE = 1
+ANSWER_TYPE = 2
+# byte of type column -> 1 for questions, for itertools.compress
+QUESTION_SELECTOR = bytes(int(value == QUESTION_TYPE) for value in range(256))
+# posts of type column read at once when questions of offset are skipped
+TYPE_CHUNK = 1 << 20
+
+# column name -> array typecode, one value per post id (0 for missing ids)
+POST_COLUMNS = {
+    "start": "q",
+    "length": "i",
+    "score": "i",
+    "type": "b",
+    "accepted": "i",
+    "parent": "i",
+}
+WRITE_BATCH = 1 << 16
+
+
+class NotCompiledError(LookupError):
+    """Post index of archive is missing or built for other archive file"""
+
+
+class PostRecord(NamedTuple):
+    id: int
+    start: int
+    length: int
+    score: int
+    type: int
+    accepted_answer_id: Optional[int]
+    parent_id: Optional[int]
+
+
+class _ColumnWriter:
+    """Write dense by id column with zero filled gaps"""
+
+    def __init__(self, path: str, typecode: str):
+        self.file = open(path, "wb")
+        self.typecode = typecode
+        self.buffer = array(typecode)
+
+    def append(self, value: int):
+        self.buffer.append(value)
+        if len(self.buffer) >= WRITE_BATCH:
+            self.flush()
+
+    def extend(self, values: Iterable[int]):
+        self.buffer.extend(values)
+        if len(self.buffer) >= WRITE_BATCH:
+            self.flush()
+
+    def extend_zeros(self, count: int):
+        while count > 0:
+            step = min(count, WRITE_BATCH)
+            self.buffer.frombytes(bytes(step * self.buffer.itemsize))
+            if len(self.buffer) >= WRITE_BATCH:
+                self.flush()
+            count -= step
+
+    def flush(self):
+        self.buffer.tofile(self.file)
+        self.buffer = array(self.typecode)
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def _write_csr(
+    pairs: Iterable[Tuple[int, int]], max_id: int, indptr_path: str, values_path: str
+):
+    """Write sorted (key, value) pairs as CSR: values[indptr[key]:indptr[key+1]]"""
+    indptr = _ColumnWriter(indptr_path, "q")
+    values = _ColumnWriter(values_path, "i")
+    count = 0
+    next_key = 0
+    for key, value in pairs:
+        if key is None or key > max_id:
+            continue
+        while next_key <= key:
+            indptr.append(count)
+            next_key += 1
+        values.append(value)
+        count += 1
+    while next_key <= max_id + 1:
+        indptr.append(count)
+        next_key += 1
+    indptr.close()
+    values.close()
+
+
+def replace_directory(temp_path: str, index_path: str):
+    """Swap built index directory in place of old one
+
+    Directory can't be replaced by rename, so old one is renamed aside
+    first, index path is missing only between two renames.
+    """
+    old_path = f"{index_path}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(index_path):
+        os.replace(index_path, old_path)
+    os.replace(temp_path, index_path)
+    # memory maps of opened old index stay valid after remove
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def build_post_index(database_path: str, index_path: str, hashes: dict = None):
+    """Build memory mapped post index from archive database
+
+    Written to temporary folder and renamed, so readers never see half index.
+    `hashes` are md5 of archive files the index is built from.
+    """
+    temp_path = f"{index_path}.tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+
+    connection = sqlite3.connect(database_path)
+    answers_connection = sqlite3.connect(database_path)
+    try:
+        max_id = connection.execute(
+            "SELECT max(id) FROM (SELECT max(id) AS id FROM question_posts"
+            " UNION ALL SELECT max(id) FROM answer_posts)"
+        ).fetchone()[0]
+        max_id = max_id or 0
+
+        writers = {
+            name: _ColumnWriter(f"{temp_path}/{name}.bin", typecode)
+            for name, typecode in POST_COLUMNS.items()
+        }
+        questions = connection.execute(
+            "SELECT id, start, length, score, 1, accepted_answer_id, 0"
+            " FROM question_posts ORDER BY id"
+        )
+        answers = answers_connection.execute(
+            "SELECT id, start, length, score, 2, 0, question_post_id"
+            " FROM answer_posts ORDER BY id"
+        )
+        next_id = 0
+        for row in heapq.merge(questions, answers):
+            post_id = row[0]
+            if post_id < next_id:
+                continue
+            for writer in writers.values():
+                writer.extend_zeros(post_id - next_id)
+            for writer, value in zip(writers.values(), row[1:]):
+                writer.append(value or 0)
+            next_id = post_id + 1
+        for writer in writers.values():
+            writer.extend_zeros(max_id + 1 - next_id)
+            writer.close()
+
+        _write_csr(
+            connection.execute(
+                "SELECT question_post_id, id FROM answer_posts"
+                " ORDER BY question_post_id, id"
+            ),
+            max_id,
+            f"{temp_path}/answers_indptr.bin",
+            f"{temp_path}/answers.bin",
+        )
+        _write_csr(
+            connection.execute(
+                "SELECT post_id, tag_id FROM post_tags ORDER BY post_id, tag_id"
+            ),
+            max_id,
+            f"{temp_path}/tags_indptr.bin",
+            f"{temp_path}/tags.bin",
+        )
+        tags = connection.execute(
+            "SELECT id, name, count_usage FROM tags ORDER BY id"
+        ).fetchall()
+        _write_csr(
+            connection.execute(
+                "SELECT tag_id, post_id FROM post_tags ORDER BY tag_id, post_id"
+            ),
+            max((row[0] for row in tags), default=0),
+            f"{temp_path}/tag_posts_indptr.bin",
+            f"{temp_path}/tag_posts.bin",
+        )
+    finally:
+        connection.close()
+        answers_connection.close()
+
+    with open(f"{temp_path}/tags.json", "w", encoding="utf-8") as tags_file:
+        json.dump(tags, tags_file, ensure_ascii=False)
+    with open(f"{temp_path}/meta.json", "w", encoding="utf-8") as meta_file:
+        json.dump(
+            {"max_id": max_id, "columns": POST_COLUMNS, "hashes": hashes or {}},
+            meta_file,
+        )
+
+    replace_directory(temp_path, index_path)
+    logger.info(f"post index saved: {index_path} max id {max_id}")
+
+
+class PostIndex:
+    """Read only post index, arrays are memory mapped and read without ORM"""
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        with open(f"{index_path}/meta.json", encoding="utf-8") as meta_file:
+            self.meta: dict = json.load(meta_file)
+        self.max_id: int = self.meta["max_id"]
+        self._maps = []
+        self._views = []
+
+        self.columns = {
+            name: self._map(f"{name}.bin", typecode)
+            for name, typecode in POST_COLUMNS.items()
+        }
+        self.answers_indptr = self._map("answers_indptr.bin", "q")
+        self.answers = self._map("answers.bin", "i")
+        self.tags_indptr = self._map("tags_indptr.bin", "q")
+        self.tags = self._map("tags.bin", "i")
+        self.tag_posts_indptr = self._map("tag_posts_indptr.bin", "q")
+        self.tag_posts = self._map("tag_posts.bin", "i")
+
+        with open(f"{index_path}/tags.json", encoding="utf-8") as tags_file:
+            self.tag_rows: List[list] = json.load(tags_file)
+        self.tag_names = {tag_id: name for tag_id, name, _ in self.tag_rows}
+        self.tag_ids = {name: tag_id for tag_id, name, _ in self.tag_rows}
+
+    def _map(self, filename: str, typecode: str):
+        path = f"{self.index_path}/{filename}"
+        if os.path.getsize(path) == 0:
+            return memoryview(array(typecode))
+        with open(path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        view = memoryview(mapped)
+        cast_view = view.cast(typecode)
+        self._views.extend([view, cast_view])
+        return cast_view
+
+    def get(self, post_id: int) -> Optional[PostRecord]:
+        if not 0 < post_id <= self.max_id:
+            return None
+        columns = self.columns
+        post_type = columns["type"][post_id]
+        if not post_type:
+            return None
+        return PostRecord(
+            post_id,
+            columns["start"][post_id],
+            columns["length"][post_id],
+            columns["score"][post_id],
+            post_type,
+            columns["accepted"][post_id] or None,
+            columns["parent"][post_id] or None,
+        )
+
+    def get_answer_ids(self, post_id: int) -> List[int]:
+        if not 0 < post_id <= self.max_id:
+            return []
+        return self.answers[
+            self.answers_indptr[post_id] : self.answers_indptr[post_id + 1]
+        ].tolist()
+
+    def get_tag_ids(self, post_id: int) -> List[int]:
+        if not 0 < post_id <= self.max_id:
+            return []
+        return self.tags[
+            self.tags_indptr[post_id] : self.tags_indptr[post_id + 1]
+        ].tolist()
+
+    def get_tag_names(self, post_id: int) -> List[str]:
+        return [self.tag_names[tag_id] for tag_id in self.get_tag_ids(post_id)]
+
+    def get_tag_post_ids(self, tag_id: int) -> memoryview:
+        """Sorted question ids with tag"""
+        if not 0 <= tag_id < len(self.tag_posts_indptr) - 1:
+            return self.tag_posts[0:0]
+        return self.tag_posts[
+            self.tag_posts_indptr[tag_id] : self.tag_posts_indptr[tag_id + 1]
+        ]
+
+    def query_question_ids(
+        self, offset: int, limit: int, tags: List[str], after_id: int = None
+    ) -> List[int]:
+        """Question ids in id order, tags filter by sorted lists intersection"""
+        first_id = after_id + 1 if after_id is not None else 1
+        skip = offset if after_id is None else 0
+        result = []
+        if not tags:
+            post_types = self.columns["type"]
+            position = max(first_id, 1)
+            while position <= self.max_id and len(result) < limit:
+                chunk = post_types[position : position + TYPE_CHUNK].tobytes()
+                if skip:
+                    count = chunk.count(QUESTION_TYPE)
+                    if skip >= count:
+                        skip -= count
+                        position += len(chunk)
+                        continue
+                post_ids = itertools.compress(
+                    range(position, position + len(chunk)),
+                    chunk.translate(QUESTION_SELECTOR),
+                )
+                result.extend(
+                    itertools.islice(post_ids, skip, skip + limit - len(result))
+                )
+                skip = 0
+                position += len(chunk)
+            return result
+
+        if any(name not in self.tag_ids for name in tags):
+            return []
+        post_lists = sorted(
+            (self.get_tag_post_ids(self.tag_ids[name]) for name in set(tags)),
+            key=len,
+        )
+        # walk shortest list, other lists searched forward from last position
+        positions = [0] * len(post_lists)
+        driver = post_lists[0]
+        for post_id in driver[bisect.bisect_left(driver, first_id) :]:
+            for number in range(1, len(post_lists)):
+                post_list = post_lists[number]
+                position = bisect.bisect_left(
+                    post_list, post_id, positions[number], len(post_list)
+                )
+                positions[number] = position
+                if position == len(post_list) or post_list[position] != post_id:
+                    break
+            else:
+                if skip:
+                    skip -= 1
+                    continue
+                result.append(post_id)
+                if len(result) >= limit:
+                    break
+        return result
+
+    def question_ids(self, tags: List[str]) -> Sequence[int]:
+        """All question ids with tags in id order"""
+        if not tags:
+            return array(
+                "i",
+                itertools.compress(
+                    range(self.max_id + 1),
+                    self.columns["type"].tobytes().translate(QUESTION_SELECTOR),
+                ),
+            )
+        if len(set(tags)) == 1:
+            tag_id = self.tag_ids.get(tags[0])
+            return self.get_tag_post_ids(tag_id) if tag_id is not None else []
+        return self.query_question_ids(0, self.max_id, tags)
+
+    def query_question_ids_by_score(
+        self, offset: int, limit: int, tags: List[str]
+    ) -> List[int]:
+        """Question ids by score, best first, same scores by id
+
+        Lowest score of page is found by counts of scores, so only ids above
+        it are sorted, ids of that score are taken in id order.
+        """
+        wanted = offset + limit
+        if wanted <= 0:
+            return []
+        scores = self.columns["score"]
+        if tags:
+            post_ids = self.question_ids(tags)
+            post_scores = array("i", map(scores.__getitem__, post_ids))
+        else:
+            selector = self.columns["type"].tobytes().translate(QUESTION_SELECTOR)
+            post_ids = array("i", itertools.compress(range(self.max_id + 1), selector))
+            post_scores = array("i", itertools.compress(scores, selector))
+        if not post_ids:
+            return []
+
+        score_counts = Counter(post_scores)
+        count_above = 0
+        for last_score in sorted(score_counts, reverse=True):
+            if count_above + score_counts[last_score] >= wanted:
+                break
+            count_above += score_counts[last_score]
+        better_ids = sorted(
+            itertools.compress(post_ids, map(last_score.__lt__, post_scores)),
+            key=lambda post_id: (-scores[post_id], post_id),
+        )
+        last_ids = itertools.islice(
+            itertools.compress(post_ids, map(last_score.__eq__, post_scores)),
+            wanted - len(better_ids),
+        )
+        better_ids.extend(last_ids)
+        return better_ids[offset:]
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        for mapped in self._maps:
+            mapped.close()
+        self._views, self._maps = [], []
+
+
+def open_post_index(index_path: str) -> Optional[PostIndex]:
+    if not Path(f"{index_path}/meta.json").exists():
+        return None
+    return PostIndex(index_path)
@@ -0,0 +1,367 @@
+import glob
+import heapq
+import itertools
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import struct
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from .post_index import _ColumnWriter, replace_directory
+
+# BM25 parameters, impacts are computed with them when index is merged
+BM25_K1 = 1.2
+BM25_B = 0.75
+# impact of (term, post) saved as one byte
+IMPACT_LEVELS = 255
+
+MAX_TOKEN_LENGTH = 32
+TOKEN_REGEX = re.compile(r"[^\W_]{2,}")
+HTML_TAG_REGEX = re.compile(r"<[^>]*>")
+STOP_WORDS = frozenset(
+    "an and are as at be but by do for from has have he how if in into is it its"
+    " me my no not of on or so that the their then there these they this to was"
+    " we what when which will with you your".split()
+)
+
+RUN_HEADER = struct.Struct("<HI")
+# lengths file: (first post id, count) and lengths of consecutive post ids
+LENGTHS_HEADER = struct.Struct("<iI")
+# smaller gap of post ids is kept in segment as zero lengths
+LENGTHS_MAX_GAP = 64
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lower case words of text without html tags and stop words"""
+    if not text:
+        return []
+    return [
+        token
+        for token in TOKEN_REGEX.findall(HTML_TAG_REGEX.sub(" ", text).lower())
+        if len(token) <= MAX_TOKEN_LENGTH and token not in STOP_WORDS
+    ]
+
+
+class SearchIndexWriter:
+    """Collect postings of posts in memory and write them to sorted run files
+
+    Several writers (one per index worker) can write runs to same folder,
+    `build_search_index` merges all runs of folder.
+    """
+
+    def __init__(
+        self, runs_path: str, prefix: str = "run", max_postings: int = 1 << 22
+    ):
+        self.runs_path = runs_path
+        self.prefix = prefix
+        self.max_postings = max_postings
+        os.makedirs(runs_path, exist_ok=True)
+        for path in glob.glob(f"{runs_path}/{prefix}-*"):
+            # runs of not finished pass
+            os.remove(path)
+        self.run_number = 0
+        self._reset()
+
+    def _reset(self):
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        # (first post id, lengths), ids in segment are consecutive
+        self.doc_lengths: List[Tuple[int, array]] = []
+        self.count_postings = 0
+
+    @property
+    def full(self) -> bool:
+        return self.count_postings >= self.max_postings
+
+    def add(self, post_id: int, title: Optional[str], body: Optional[str]):
+        """Add post text, title words are counted twice"""
+        title_tokens = tokenize(title)
+        terms = Counter(title_tokens)
+        terms.update(title_tokens)
+        terms.update(tokenize(body))
+        if not terms:
+            return
+        postings = self.postings
+        for term, term_frequency in terms.items():
+            term_postings = postings.get(term)
+            if term_postings is None:
+                term_postings = postings[term] = (array("i"), array("H"))
+            term_postings[0].append(post_id)
+            term_postings[1].append(min(term_frequency, 0xFFFF))
+        self._add_length(post_id, sum(terms.values()))
+        self.count_postings += len(terms)
+
+    def _add_length(self, post_id: int, length: int):
+        gap = -1
+        if self.doc_lengths:
+            first_id, lengths = self.doc_lengths[-1]
+            gap = post_id - first_id - len(lengths)
+        if not 0 <= gap <= LENGTHS_MAX_GAP:
+            # first post or post ids out of order
+            lengths = array("i")
+            self.doc_lengths.append((post_id, lengths))
+        elif gap:
+            lengths.frombytes(bytes(gap * lengths.itemsize))
+        lengths.append(length)
+
+    def flush(self):
+        """Write collected postings as run sorted by term"""
+        if not self.doc_lengths:
+            return
+        run_path = f"{self.runs_path}/{self.prefix}-{self.run_number:05}"
+        with open(f"{run_path}.run.tmp", "wb") as run_file:
+            for term in sorted(self.postings):
+                post_ids, term_frequencies = self.postings[term]
+                term_bytes = term.encode()
+                run_file.write(RUN_HEADER.pack(len(term_bytes), len(post_ids)))
+                run_file.write(term_bytes)
+                post_ids.tofile(run_file)
+                term_frequencies.tofile(run_file)
+        with open(f"{run_path}.lengths", "wb") as lengths_file:
+            for first_id, lengths in self.doc_lengths:
+                lengths_file.write(LENGTHS_HEADER.pack(first_id, len(lengths)))
+                lengths.tofile(lengths_file)
+        os.replace(f"{run_path}.run.tmp", f"{run_path}.run")
+        self.run_number += 1
+        self._reset()
+
+    close = flush
+
+
+def _read_run(path: str, number: int) -> Iterator[Tuple[bytes, int, array, array]]:
+    with open(path, "rb") as run_file:
+        while True:
+            header = run_file.read(RUN_HEADER.size)
+            if not header:
+                return
+            term_length, count = RUN_HEADER.unpack(header)
+            term = run_file.read(term_length)
+            post_ids, term_frequencies = array("i"), array("H")
+            post_ids.fromfile(run_file, count)
+            term_frequencies.fromfile(run_file, count)
+            yield term, number, post_ids, term_frequencies
+
+
+def _read_lengths(path: str, with_lengths=True) -> Iterator[Tuple[int, array]]:
+    """(first post id, lengths) segments of lengths file, count if not `with_lengths`"""
+    with open(path, "rb") as lengths_file:
+        while True:
+            header = lengths_file.read(LENGTHS_HEADER.size)
+            if not header:
+                return
+            first_id, count = LENGTHS_HEADER.unpack(header)
+            if not with_lengths:
+                lengths_file.seek(count * 4, os.SEEK_CUR)
+                yield first_id, count
+                continue
+            lengths = array("i")
+            lengths.fromfile(lengths_file, count)
+            yield first_id, lengths
+
+
+def _load_doc_lengths(runs_path: str) -> Tuple[array, int, int]:
+    """Dense by post id lengths, count of posts and sum of lengths
+
+    Array is sized once by headers of segments, segments are copied by slice.
+    """
+    paths = sorted(glob.glob(f"{runs_path}/*.lengths"))
+    size = 0
+    for path in paths:
+        for first_id, count in _read_lengths(path, with_lengths=False):
+            size = max(size, first_id + count)
+    doc_lengths = array("i", bytes(size * 4))
+    count_docs = total_length = 0
+    # ids below it may be written, gaps of segment are not copied over them
+    written_end = 0
+    for path in paths:
+        for first_id, lengths in _read_lengths(path):
+            # posts have at least one term, zero is gap
+            count_docs += len(lengths) - lengths.count(0)
+            total_length += sum(lengths)
+            end = first_id + len(lengths)
+            if first_id >= written_end:
+                doc_lengths[first_id:end] = lengths
+            else:
+                for post_id, length in zip(range(first_id, end), lengths):
+                    if length:
+                        doc_lengths[post_id] = length
+            written_end = max(written_end, end)
+    return doc_lengths, count_docs, total_length
+
+
+def build_search_index(runs_path: str, index_path: str):
+    """Merge runs to memory mapped index, postings of term sorted by impact
+
+    Impact is BM25 term part quantized to one byte, so query reads only
+    best postings of term. Written to temporary folder and renamed.
+    """
+    doc_lengths, count_docs, total_length = _load_doc_lengths(runs_path)
+    average_length = total_length / count_docs if count_docs else 1.0
+
+    temp_path = f"{index_path}.tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    term_indptr = _ColumnWriter(f"{temp_path}/term_indptr.bin", "q")
+    postings_indptr = _ColumnWriter(f"{temp_path}/postings_indptr.bin", "q")
+    post_ids_writer = _ColumnWriter(f"{temp_path}/post_ids.bin", "i")
+    impacts_writer = _ColumnWriter(f"{temp_path}/impacts.bin", "B")
+
+    runs = [
+        _read_run(path, number)
+        for number, path in enumerate(sorted(glob.glob(f"{runs_path}/*.run")))
+    ]
+    count_terms = count_postings = terms_offset = 0
+    term_indptr.append(0)
+    postings_indptr.append(0)
+    with open(f"{temp_path}/terms.bin", "wb") as terms_file:
+        merged = heapq.merge(*runs, key=lambda item: (item[0], item[1]))
+        current_term, buckets = None, {}
+        # empty item after last run item write last term
+        for term, _, post_ids, term_frequencies in itertools.chain(
+            merged, [(None, 0, (), ())]
+        ):
+            if term != current_term and current_term is not None:
+                for impact in sorted(buckets, reverse=True):
+                    bucket = buckets[impact]
+                    post_ids_writer.extend(bucket)
+                    impacts_writer.extend(itertools.repeat(impact, len(bucket)))
+                    count_postings += len(bucket)
+                terms_file.write(current_term)
+                terms_offset += len(current_term)
+                term_indptr.append(terms_offset)
+                postings_indptr.append(count_postings)
+                count_terms += 1
+                buckets = {}
+            current_term = term
+            for post_id, term_frequency in zip(post_ids, term_frequencies):
+                norm = BM25_K1 * (
+                    1 - BM25_B + BM25_B * doc_lengths[post_id] / average_length
+                )
+                impact = max(
+                    round(IMPACT_LEVELS * term_frequency / (term_frequency + norm)), 1
+                )
+                bucket = buckets.get(impact)
+                if bucket is None:
+                    bucket = buckets[impact] = array("i")
+                bucket.append(post_id)
+    for writer in (term_indptr, postings_indptr, post_ids_writer, impacts_writer):
+        writer.close()
+
+    with open(f"{temp_path}/meta.json", "w", encoding="utf-8") as meta_file:
+        json.dump(
+            {
+                "count_docs": count_docs,
+                "average_length": average_length,
+                "count_terms": count_terms,
+                "count_postings": count_postings,
+                "k1": BM25_K1,
+                "b": BM25_B,
+            },
+            meta_file,
+        )
+    replace_directory(temp_path, index_path)
+    logger.info(
+        f"search index saved: {index_path} {count_docs} posts {count_terms} terms"
+    )
+
+
+class SearchIndex:
+    """Read only BM25 index, arrays are memory mapped"""
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        with open(f"{index_path}/meta.json", encoding="utf-8") as meta_file:
+            self.meta = json.load(meta_file)
+        self.count_docs: int = self.meta["count_docs"]
+        self.k1: float = self.meta["k1"]
+        self._maps = []
+        self._views = []
+        self.terms = self._map("terms.bin", "B")
+        self.term_indptr = self._map("term_indptr.bin", "q")
+        self.postings_indptr = self._map("postings_indptr.bin", "q")
+        self.post_ids = self._map("post_ids.bin", "i")
+        self.impacts = self._map("impacts.bin", "B")
+
+    def _map(self, filename: str, typecode: str):
+        path = f"{self.index_path}/{filename}"
+        if os.path.getsize(path) == 0:
+            return memoryview(array(typecode))
+        with open(path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        view = memoryview(mapped)
+        cast_view = view.cast(typecode)
+        self._views.extend([view, cast_view])
+        return cast_view
+
+    def _term(self, number: int) -> bytes:
+        return self.terms[self.term_indptr[number] : self.term_indptr[number + 1]]
+
+    def find_term(self, term: str) -> Optional[int]:
+        term_bytes = term.encode()
+        low, high = 0, len(self.term_indptr) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle).tobytes() < term_bytes:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.term_indptr) - 1 and self._term(low) == term_bytes:
+            return low
+        return None
+
+    def scores(self, query: str, postings_limit: int) -> Dict[int, float]:
+        """BM25 score of posts from best `postings_limit` postings of query terms"""
+        term_ranges = []
+        for term in set(tokenize(query)):
+            number = self.find_term(term)
+            if number is None:
+                continue
+            start, end = self.postings_indptr[number], self.postings_indptr[number + 1]
+            document_frequency = end - start
+            idf = math.log(
+                1
+                + (self.count_docs - document_frequency + 0.5)
+                / (document_frequency + 0.5)
+            )
+            weight = idf * (self.k1 + 1) / IMPACT_LEVELS
+            term_ranges.append((start, min(end, start + postings_limit), weight))
+        # longest range is added by dict constructor, others by python loop
+        term_ranges.sort(key=lambda item: item[1] - item[0], reverse=True)
+        scores: Dict[int, float] = {}
+        for number, (start, end, weight) in enumerate(term_ranges):
+            term_scores = zip(
+                self.post_ids[start:end], map(weight.__mul__, self.impacts[start:end])
+            )
+            if number == 0:
+                scores = dict(term_scores)
+                continue
+            get = scores.get
+            for post_id, score in term_scores:
+                scores[post_id] = get(post_id, 0.0) + score
+        return scores
+
+    def search(self, query: str, postings_limit: int) -> List[Tuple[int, float]]:
+        """(post id, score) by score, best first, same scores by id"""
+        scores = self.scores(query, postings_limit)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        for mapped in self._maps:
+            mapped.close()
+        self._views, self._maps = [], []
+
+
+def open_search_index(index_path: str) -> Optional[SearchIndex]:
+    if not Path(f"{index_path}/meta.json").exists():
+        return None
+    return SearchIndex(index_path)
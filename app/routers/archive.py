@@ -3,13 +3,31 @@ import glob
 from pathlib import Path
 from typing import Annotated, List
 
-from ..utils.archive import get_archive_reader
+from loguru import logger
+
+from ..utils.archive import (
+    ArchiveLease,
+    archive_names,
+    archive_registry,
+    get_archive_reader,
+    lease_archive_reader,
+)
+from ..utils.archive_reader import thread_pools
+from ..utils.block_cache import block_cache
+from ..utils.decompression import decompression_scheduler
+from ..utils.export import PostExporter
+from ..utils.federated import FEDERATED_ORDERS, federated_posts
+from ..utils.sampling import PostSampler
+from ..utils.manifest import archive_manifest
 from ..utils.config import settings
-from fastapi import APIRouter, Depends, Query
-from ..utils.custom_types import DataArchiveReader
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from ..utils.custom_types import POST_ORDERS, DataArchiveReader
 
 router = APIRouter(prefix="/archive")
 
+
 @router.get("/list")
 async def file_list():
     """## list archive in folder"""
@@ -18,30 +36,64 @@ async def file_list():
     data_archives_list = [Path(path).name for path in archive_list]
     return data_archives_list
 
+
 @router.get("/load")
 async def load(
-    archive_reader: Annotated[DataArchiveReader, Depends(get_archive_reader)],
+    archive_reader: Annotated[DataArchiveReader, Depends(lease_archive_reader)],
 ):
     """## load archive in cache"""
+    await archive_reader.open()
     return
 
 
 @router.get("/load/all")
 async def load_all():
-    """## load archives in cache"""
+    """## check archives, files are opened on first use"""
     archive_list = glob.glob(f"{settings.archive_folder}/*.com.7z")
     archive_list.extend(glob.glob(f"{settings.archive_folder}/*-Posts.7z"))
     data_archives_list = [Path(path).name for path in archive_list]
-    for name in data_archives_list:
-        get_archive_reader(name)
+    archive_manifest.prune(
+        Path(path).name for path in glob.glob(f"{settings.archive_folder}/*.7z")
+    )
+
+    # archives missing in manifest read 7z headers, do it in parallel
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(
+        *[
+            loop.run_in_executor(thread_pools, get_archive_reader, name)
+            for name in data_archives_list
+        ],
+        return_exceptions=True,
+    )
+    for name, result in zip(data_archives_list, results):
+        if isinstance(result, Exception):
+            logger.warning(f"archive not loaded: {name} {result}")
     return
 
 
+@router.get("/cache")
+async def cache_stats():
+    """## decompressed blocks cache stats"""
+    return block_cache.stats()
+
+
+@router.get("/readers")
+async def readers_stats():
+    """## archive readers registry stats"""
+    return {**archive_registry.stats(), "manifest": archive_manifest.stats()}
+
+
+@router.get("/decompression")
+async def decompression_stats():
+    """## decompression workers budget stats"""
+    return decompression_scheduler.stats()
+
+
 @router.get("/tags")
 async def tags_list(
-    archive_reader: Annotated[DataArchiveReader, Depends(get_archive_reader)],
+    archive_reader: Annotated[DataArchiveReader, Depends(lease_archive_reader)],
     offset: int,
-    limit=100,
+    limit: int = 100,
 ):
     """## get tags for archive"""
     tag_list = await archive_reader.tags_list(offset, limit)
@@ -50,20 +102,162 @@ async def tags_list(
 
 @router.get("/get/post")
 async def get_post(
-    archive_reader: Annotated[DataArchiveReader, Depends(get_archive_reader)],
+    archive_reader: Annotated[DataArchiveReader, Depends(lease_archive_reader)],
     post_id: int,
 ):
     """## get post by id"""
-    post = await archive_reader.get_post(post_id)
-    return post
+    post = await archive_reader.get_post(post_id, as_json=True)
+    return Response(post, media_type="application/json")
 
 
 @router.get("/get/posts")
 async def get_posts(
-    archive_reader: Annotated[DataArchiveReader, Depends(get_archive_reader)],
-    offset: int,
+    archive_reader: Annotated[DataArchiveReader, Depends(lease_archive_reader)],
+    offset: int = 0,
     tags: List[str] = Query([]),
-    limit=100,
+    limit: int = 100,
+    after_id: int | None = None,
+    order_by: str = "id",
 ):
-    """## get post with filters"""
-    return await archive_reader.query_posts(offset, limit, tags)
+    """## get post with filters
+
+    use `after_id` (last post id of previous page) instead of `offset` for deep pages
+
+    `order_by=score` best score first, `after_id` is not used with it
+    """
+    if order_by not in POST_ORDERS:
+        raise HTTPException(status_code=422, detail=f"order_by is one of {POST_ORDERS}")
+    if order_by == "score" and after_id is not None:
+        raise HTTPException(
+            status_code=422, detail="after_id is used only with id order"
+        )
+    posts = await archive_reader.query_posts(
+        offset, limit, tags, after_id, as_json=True, order_by=order_by
+    )
+    return Response(posts, media_type="application/json")
+
+
+@router.get("/sample")
+async def sample_posts(
+    archive_reader: Annotated[DataArchiveReader, Depends(lease_archive_reader)],
+    count: int = 1000,
+    tags: List[str] = Query([]),
+    strata_tags: List[str] = Query([]),
+    score_bins: List[int] = Query([]),
+    seed: int | None = None,
+):
+    """## random questions with answers as NDJSON, uniform without repeats
+
+    `tags` questions with all tags
+
+    `strata_tags` count shared equally by questions of every tag,
+    `score_bins` bounds of score bins (`[-1, 10]` is `< -1`, `-1..9`, `>= 10`),
+    count shared equally by bins
+
+    same `seed` (returned in `X-Sample-Seed` header) give same sample
+    """
+    try:
+        sampler = PostSampler(
+            archive_reader, count, tags, strata_tags, score_bins, seed
+        )
+    except ValueError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+    # reader is used until stream is done or dropped by client
+    lease = ArchiveLease(archive_reader)
+    return StreamingResponse(
+        lease.stream(sampler.lines()),
+        media_type="application/x-ndjson",
+        headers={"X-Sample-Seed": str(sampler.seed)},
+        background=BackgroundTask(lease.release),
+    )
+
+
+@router.get("/federated/posts")
+async def get_federated_posts(
+    names: List[str] = Query([]),
+    tags: List[str] = Query([]),
+    limit: int = 100,
+    order_by: str = "id",
+    timeout: float | None = None,
+):
+    """## questions of many archives as NDJSON, archives are read concurrently
+
+    `names` archives to read, all archives in folder if not set
+
+    every archive return up to `limit` questions, merged by `order_by` (`id` or `score`),
+    `arrival` write posts of archive as soon as it is done
+
+    `timeout` seconds of one archive (`federated_timeout` if not set), archive out of time
+    is skipped, last line is `{"archives": {name: status}}` with status, count and seconds
+
+    archives not open (`/archive/load`) or not indexed are skipped, `id` and `score`
+    orders buffer posts of all archives before first line
+    """
+    if order_by not in FEDERATED_ORDERS:
+        raise HTTPException(
+            status_code=422, detail=f"order_by is one of {FEDERATED_ORDERS}"
+        )
+    return StreamingResponse(
+        federated_posts(
+            names or archive_names(),
+            tags,
+            limit,
+            order_by,
+            timeout if timeout is not None else settings.federated_timeout,
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.get("/search")
+async def search(
+    archive_reader: Annotated[DataArchiveReader, Depends(lease_archive_reader)],
+    q: str,
+    tags: List[str] = Query([]),
+    offset: int = 0,
+    limit: int = 10,
+):
+    """## full text search in titles and bodies, post ids by BM25 score
+
+    `tags` posts of questions with all tags, answers use tags of own question
+
+    read found posts by `/archive/get/post` with `question_id`
+    """
+    hits = await archive_reader.search(q, tags, offset, limit)
+    if hits is None:
+        raise HTTPException(status_code=404, detail="search index is not built")
+    return hits
+
+
+@router.get("/export")
+async def export_posts(
+    archive_reader: Annotated[DataArchiveReader, Depends(lease_archive_reader)],
+    tags: List[str] = Query([]),
+    min_score: int | None = None,
+    compress: bool = False,
+):
+    """## stream all questions with answers as NDJSON
+
+    `tags` questions with all tags, `min_score` questions with score not less
+
+    `compress` zstd compressed stream
+
+    answers are joined by posts index, 409 if archive is not indexed
+    """
+    exporter = PostExporter(archive_reader, tags, min_score)
+    try:
+        await exporter.check_indexed()
+    except ValueError as error:
+        raise HTTPException(status_code=409, detail=str(error))
+    filename = f"{archive_reader.name}.ndjson"
+    media_type = "application/x-ndjson"
+    if compress:
+        filename, media_type = f"{filename}.zst", "application/zstd"
+    # reader is used until stream is done or dropped by client
+    lease = ArchiveLease(archive_reader)
+    return StreamingResponse(
+        lease.stream(exporter.stream(compress)),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        background=BackgroundTask(lease.release),
+    )
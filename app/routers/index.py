@@ -5,44 +5,110 @@ from typing import Annotated
 
 from loguru import logger
 
-from ..utils.archive import get_archive_reader
+from ..utils.archive import get_archive_reader, lease_archive_reader
+from ..utils.archive_reader import thread_pools
 from ..utils.config import settings
-from fastapi import APIRouter, Depends
+from ..utils.jobs import IndexJob, index_scheduler
+from fastapi import APIRouter, Depends, HTTPException
 from ..utils.custom_types import DataArchiveReader
 
 router = APIRouter(prefix="/indexing")
 
 
+def check_not_static():
+    if settings.index_backend == "static":
+        raise HTTPException(
+            status_code=409, detail="indexing is disabled for static index backend"
+        )
 
 
-
-@router.put("/process")
+@router.put("/process", dependencies=[Depends(check_not_static)])
 async def send(
-    archive_reader: Annotated[DataArchiveReader, Depends(get_archive_reader)]
+    archive_reader: Annotated[DataArchiveReader, Depends(lease_archive_reader)],
+    parallel: bool = False,
+    bulk: bool = False,
+    incremental: bool = False,
+):
+    """## send archive to index
+
+    Index run in background job, returns job to follow in `/indexing/jobs`
+
+    `parallel` index posts by bzip2 block ranges in process pool
+
+    `bulk` fill new database file without journal and swap it at the end
+
+    `incremental` index new dump reusing index of previous dump by post ids
+    """
+    job = index_scheduler.submit(archive_reader, parallel, bulk, incremental)
+    logger.info(f"queue index {archive_reader.name} archive: job {job.id}")
+    return job.progress()
+
+
+@router.put("/process/all", dependencies=[Depends(check_not_static)])
+async def send_all(
+    parallel: bool = False, bulk: bool = False, incremental: bool = False
 ):
-    """## send archive to index"""
-    logger.info(f"start index {archive_reader.name} archive")
-    await archive_reader.index_tags()
-    await archive_reader.index_posts()
-    logger.info(f"end index {archive_reader.name} archive")
-    return True
-
-
-@router.put("/process/all")
-async def send_all():
-    """## send all archives to index"""
-    logger.info("start index all archives")
+    """## send all archives to index
+
+    Jobs are queued by archive size and run under cpu and memory budget
+    """
+    logger.info("queue index all archives")
     archive_list = glob.glob(f"{settings.archive_folder}/*.com.7z")
     archive_list.extend(glob.glob(f"{settings.archive_folder}/*-Posts.7z"))
-    logger.info("start index all tags")
 
-    data_archive_readers = [
-        get_archive_reader(Path(path).name) for path in archive_list
+    # readers only check manifest, archives are opened by jobs
+    loop = asyncio.get_running_loop()
+    archive_readers = await asyncio.gather(
+        *(
+            loop.run_in_executor(thread_pools, get_archive_reader, Path(path).name)
+            for path in archive_list
+        )
+    )
+    jobs = [
+        index_scheduler.submit(archive_reader, parallel, bulk, incremental)
+        for archive_reader in archive_readers
     ]
+    return [job.progress() for job in jobs]
+
+
+def get_job(job_id: str) -> IndexJob:
+    job = index_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"job {job_id} not found")
+    return job
+
+
+@router.get("/jobs")
+async def jobs_list():
+    """## index jobs and scheduler budget"""
+    return {
+        "scheduler": index_scheduler.stats(),
+        "jobs": [job.progress() for job in index_scheduler.jobs.values()],
+    }
+
+
+@router.get("/jobs/{job_id}")
+async def job_progress(job: Annotated[IndexJob, Depends(get_job)]):
+    """## progress of index job: rows/sec, bytes, eta"""
+    return job.progress()
+
+
+@router.put("/jobs/{job_id}/pause")
+async def job_pause(job: Annotated[IndexJob, Depends(get_job)]):
+    """## pause index job after current batch"""
+    job.pause()
+    return job.progress()
+
+
+@router.put("/jobs/{job_id}/resume")
+async def job_resume(job: Annotated[IndexJob, Depends(get_job)]):
+    """## resume paused index job"""
+    job.resume()
+    return job.progress()
+
 
-    async with asyncio.TaskGroup() as tg:
-        for data_archive in data_archive_readers:
-            tg.create_task(data_archive.index_tags())
-    async with asyncio.TaskGroup() as tg:
-        for data_archive in data_archive_readers:
-            tg.create_task(data_archive.index_posts())
+@router.put("/jobs/{job_id}/cancel")
+async def job_cancel(job: Annotated[IndexJob, Depends(get_job)]):
+    """## cancel index job, indexed rows are kept to continue later"""
+    index_scheduler.cancel(job)
+    return job.progress()
@@ -1,27 +1,210 @@
-import asyncio
+import glob
+import os
+import threading
+from collections import OrderedDict
 from pathlib import Path
+from typing import AsyncIterator, Dict, Iterator, List, Optional
 
-from py7zr import SevenZipFile
+from loguru import logger
 
 from .config import settings
-import glob
 
 from .custom_types import DataArchiveReader
 
 # from ..global_app import app
 
 
-archive_readers = {}
+class ArchiveRegistry:
+    """LRU of archive readers limited by `max_open_archives`
 
+    Readers open archive files lazily. Requests and jobs hold reader by
+    `acquire` (or `pin`) until `release`, evicted reader is closed when its
+    last use is released. Readers pinned by index jobs are not evicted, so
+    keep `max_open_archives` above count of archives read at once.
+    """
 
-def get_archive_reader(name: str) -> DataArchiveReader:
-    if name in archive_readers:
-        return archive_readers.get(name)
-    archive_list = glob.glob(f"{settings.archive_folder}/*.7z")
-    data_archives_set = set([Path(path).name for path in archive_list])
-    if name in data_archives_set:
-        archive_reader = DataArchiveReader(f"{settings.archive_folder}/{name}")
-        archive_readers.update({name: archive_reader})
+    def __init__(self, max_open: int):
+        self.max_open = max(max_open, 1)
+        self.readers: OrderedDict[str, DataArchiveReader] = OrderedDict()
+        self.lock = threading.Lock()
+        # registry name -> count of pins
+        self.pins: Dict[str, int] = {}
+        # reader -> count of requests and jobs using it
+        self.uses: Dict[DataArchiveReader, int] = {}
+        self.opens = 0
+        self.evictions = 0
+
+    def get(self, name: str) -> DataArchiveReader:
+        with self.lock:
+            archive_reader = self.readers.get(name)
+            if archive_reader is not None:
+                self.readers.move_to_end(name)
+                return archive_reader
+
+        path = f"{settings.archive_folder}/{name}"
+        if Path(name).name != name or not name.endswith(".7z"):
+            raise ValueError(f"{path} does exist")
+        if not os.path.isfile(path):
+            raise ValueError(f"{path} does exist")
+        archive_reader = DataArchiveReader(path)
+
+        with self.lock:
+            if name in self.readers:
+                # opened by other request at same time
+                self.readers.move_to_end(name)
+                return self.readers[name]
+            self.readers[name] = archive_reader
+            self.opens += 1
+            evicted = self._evict()
+        self._close(evicted)
         return archive_reader
-    else:
-        raise ValueError(f"{settings.archive_folder}/{name} does exist")
+
+    def acquire(self, name: str) -> DataArchiveReader:
+        """Reader used by request until `release`, it is not closed before"""
+        while True:
+            archive_reader = self.get(name)
+            with self.lock:
+                # evicted after get, next get open it again
+                if self.readers.get(name) is archive_reader:
+                    self._use(archive_reader)
+                    return archive_reader
+
+    def acquire_open(self, name: str) -> Optional[DataArchiveReader]:
+        """Like `acquire` for reader with opened files, None if it isn't open"""
+        with self.lock:
+            archive_reader = self.readers.get(name)
+            if archive_reader is None or not archive_reader.is_open():
+                return None
+            self.readers.move_to_end(name)
+            self._use(archive_reader)
+            return archive_reader
+
+    def use(self, archive_reader: DataArchiveReader):
+        """One more use of reader already acquired by caller"""
+        with self.lock:
+            self._use(archive_reader)
+
+    def release(self, archive_reader: DataArchiveReader):
+        with self.lock:
+            evicted = self._release(archive_reader)
+        self._close(evicted)
+
+    def pin(self, archive_reader: DataArchiveReader):
+        """Keep reader in registry until `unpin`, used by queued and running jobs"""
+        name = Path(archive_reader.post_archive_path).name
+        with self.lock:
+            self.pins[name] = self.pins.get(name, 0) + 1
+            self._use(archive_reader)
+            if name not in self.readers:
+                # evicted before pin, same reader is used by next requests
+                self.readers[name] = archive_reader
+            evicted = self._evict()
+        self._close(evicted)
+
+    def unpin(self, archive_reader: DataArchiveReader):
+        name = Path(archive_reader.post_archive_path).name
+        with self.lock:
+            count = self.pins.pop(name, 0) - 1
+            if count > 0:
+                self.pins[name] = count
+            evicted = self._release(archive_reader)
+            evicted.extend(self._evict())
+        self._close(evicted)
+
+    def _use(self, archive_reader: DataArchiveReader):
+        # called under lock
+        self.uses[archive_reader] = self.uses.get(archive_reader, 0) + 1
+
+    def _release(self, archive_reader: DataArchiveReader) -> List[DataArchiveReader]:
+        # called under lock, reader evicted while in use is closed by last use
+        count = self.uses.pop(archive_reader, 0) - 1
+        if count > 0:
+            self.uses[archive_reader] = count
+            return []
+        name = Path(archive_reader.post_archive_path).name
+        if self.readers.get(name) is archive_reader:
+            return []
+        return [archive_reader]
+
+    def _evict(self) -> List[DataArchiveReader]:
+        # called under lock, readers are closed by caller after lock
+        evicted = []
+        for name in list(self.readers):
+            if len(self.readers) <= self.max_open:
+                break
+            if name in self.pins:
+                continue
+            archive_reader = self.readers.pop(name)
+            self.evictions += 1
+            if archive_reader not in self.uses:
+                evicted.append(archive_reader)
+        return evicted
+
+    @staticmethod
+    def _close(archive_readers: List[DataArchiveReader]):
+        for archive_reader in archive_readers:
+            logger.info(f"close evicted archive reader: {archive_reader.name}")
+            archive_reader.close()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "open": len(self.readers),
+                "max_open": self.max_open,
+                "opens": self.opens,
+                "evictions": self.evictions,
+                "pinned": list(self.pins),
+                "in_use": sum(self.uses.values()),
+                "names": list(self.readers),
+            }
+
+
+archive_registry = ArchiveRegistry(settings.max_open_archives)
+
+
+def get_archive_reader(name: str) -> DataArchiveReader:
+    return archive_registry.get(name)
+
+
+def lease_archive_reader(name: str) -> Iterator[DataArchiveReader]:
+    """Reader of request, dependency keeps it open until request is done"""
+    archive_reader = archive_registry.acquire(name)
+    try:
+        yield archive_reader
+    finally:
+        archive_registry.release(archive_reader)
+
+
+class ArchiveLease:
+    """Use of acquired reader by streamed response, released once
+
+    Dependency is released before body is sent, stream hold own use.
+    """
+
+    def __init__(self, archive_reader: DataArchiveReader):
+        self.archive_reader = archive_reader
+        self.released = False
+        archive_registry.use(archive_reader)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            archive_registry.release(self.archive_reader)
+
+    async def stream(self, chunks: AsyncIterator) -> AsyncIterator:
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            try:
+                # dropped stream finish its reads before reader is released
+                await chunks.aclose()
+            finally:
+                self.release()
+
+
+def archive_names() -> List[str]:
+    """Names of posts archives in archive folder"""
+    archive_list = glob.glob(f"{settings.archive_folder}/*.com.7z")
+    archive_list.extend(glob.glob(f"{settings.archive_folder}/*-Posts.7z"))
+    return sorted(Path(path).name for path in archive_list)
@@ -1,21 +1,42 @@
 import asyncio
+import bisect
+import glob
 import hashlib
 import io
 import os
 import pickle
-import queue
-from asyncio import AbstractEventLoop
+import struct
+import threading
+import zlib
 from concurrent.futures.thread import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import IO
+from typing import IO, List, Optional
 
 import indexed_bzip2 as ibz2
+import pyzstd
 from py7zr import SevenZipFile, is_7zfile
+from py7zr.helpers import MemIO
 
 from app.utils import config
+from .block_cache import block_cache
+from .decompression import decompression_scheduler
 from indexed_bzip2 import IndexedBzip2File
 from loguru import logger
 
+# zstd seekable format (zstd contrib/seekable_format): frames and seek table
+# in skippable frame at the end of file
+SKIPPABLE_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+SEEK_TABLE_FOOTER = struct.Struct("<IBI")
+SEEK_TABLE_CHECKSUM_FLAG = 0x80
+# 48 bit magics of bzip2 block and end of stream
+BZIP2_BLOCK_MAGIC = 0x314159265359
+BZIP2_END_MAGIC = 0x177245385090
+BZIP2_MAGIC_MASK = (1 << 48) - 1
+# scan waiting for decompression worker give back its thread after this time
+SCAN_WAIT_SECONDS = 0.5
+
 # thread pool
 thread_pools = ThreadPoolExecutor(max_workers=config.settings.count_threads)
 
@@ -54,106 +75,777 @@ class MagicStepIO(io.FileIO):
         return temp_bytes
 
 
+class ChunkedFileReader(io.RawIOBase):
+    """Seekable reader for 7z entry saved as independent zlib chunks
+
+    Only one decompressed chunk is kept in memory, any offset is read by
+    decompressing the nearest chunk (checkpoint).
+    """
+
+    def __init__(self, path: str, chunks_index: dict):
+        self.file = open(path, "rb")
+        self.chunk_size: int = chunks_index["chunk_size"]
+        self.offsets: List[int] = chunks_index["offsets"]
+        self.length: int = chunks_index["size"]
+        self.position = 0
+        self.chunk_number = -1
+        self.chunk = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def size(self) -> int:
+        return self.length
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, __offset: int, __whence: int = 0) -> int:
+        if __whence == 1:
+            __offset += self.position
+        elif __whence == 2:
+            __offset += self.length
+        self.position = min(max(__offset, 0), self.length)
+        return self.position
+
+    def _load_chunk(self, chunk_number: int):
+        if chunk_number == self.chunk_number:
+            return
+        start, end = self.offsets[chunk_number], self.offsets[chunk_number + 1]
+        self.file.seek(start)
+        self.chunk = zlib.decompress(self.file.read(end - start))
+        self.chunk_number = chunk_number
+
+    def read(self, __size: int = -1) -> bytes:
+        if __size is None or __size < 0:
+            __size = self.length - self.position
+        end = min(self.position + __size, self.length)
+        parts = []
+        while self.position < end:
+            chunk_number, chunk_start = divmod(self.position, self.chunk_size)
+            self._load_chunk(chunk_number)
+            part = self.chunk[chunk_start : chunk_start + end - self.position]
+            parts.append(part)
+            self.position += len(part)
+        if len(parts) == 1:
+            return parts[0]
+        return b"".join(parts)
+
+    def close(self):
+        self.file.close()
+        self.chunk = b""
+        super().close()
+
+
+class SeekableZstdReader(io.RawIOBase):
+    """Reader for seekable zstd file of independent frames
+
+    Frames begin on rows, so row is read by decompressing one small frame.
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        try:
+            self.frame_offsets, self.frame_starts = read_seek_table(self.file)
+        except ValueError:
+            self.file.close()
+            raise
+        self.length = self.frame_starts[-1]
+        self.position = 0
+        self.frame_number = -1
+        self.frame = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def size(self) -> int:
+        return self.length
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, __offset: int, __whence: int = 0) -> int:
+        if __whence == 1:
+            __offset += self.position
+        elif __whence == 2:
+            __offset += self.length
+        self.position = min(max(__offset, 0), self.length)
+        return self.position
+
+    def _load_frame(self, frame_number: int):
+        if frame_number == self.frame_number:
+            return
+        start = self.frame_offsets[frame_number]
+        self.file.seek(start)
+        self.frame = pyzstd.decompress(
+            self.file.read(self.frame_offsets[frame_number + 1] - start)
+        )
+        self.frame_number = frame_number
+
+    def read(self, __size: int = -1) -> bytes:
+        if __size is None or __size < 0:
+            __size = self.length - self.position
+        end = min(self.position + __size, self.length)
+        parts = []
+        while self.position < end:
+            frame_number = bisect.bisect_right(self.frame_starts, self.position) - 1
+            self._load_frame(frame_number)
+            frame_start = self.position - self.frame_starts[frame_number]
+            part = self.frame[frame_start : frame_start + end - self.position]
+            parts.append(part)
+            self.position += len(part)
+        if len(parts) == 1:
+            return parts[0]
+        return b"".join(parts)
+
+    def close(self):
+        self.file.close()
+        self.frame = b""
+        super().close()
+
+
 class ArchiveFileReader:
     """Async archive reader"""
 
-    def __init__(self, path, filename=None):
+    def __init__(
+        self, path, filename=None, archive_md5: str = None, entry_size: int = None
+    ):
         self.pool = thread_pools
-        self.loop: AbstractEventLoop = asyncio.new_event_loop()
-        self.bytes_queue: queue.Queue = queue.Queue(8192)
         self.path = path
         self.filename = filename
         self.size = 0
-        self.str_archive_md5 = self.archive_md5()
+        # md5 and entry_size from archive manifest, read from archive if not given
+        self.str_archive_md5 = archive_md5 or self.archive_md5()
+
+        self.block_offsets = None
+        self.block_offsets_index_path = None
+        # decompressed offsets of blocks cached by `get`
+        self.block_starts: List[int] = [0]
+        self.block_positions: Optional[List[tuple]] = None
+        self.chunks_path = None
+        self.chunks_index = None
+        # seekable zstd copy of entry, used for gets and scans if exists
+        self.zstd_path = None
+        self.lock = threading.Lock()
 
         if "-" in path:  # TODO regex detector
             logger.info(f"Take ibz2 for {path}")
             path_obj = Path(path)
-            block_offsets_index_path = f"{path_obj.parent}/{path_obj.name}-index.dat"
+            # md5 in name, offsets of replaced dump are not used for new one
+            block_offsets_index_path = (
+                f"{path_obj.parent}/{path_obj.name}-{self.str_archive_md5}-index.dat"
+            )
             file_custom_fileIO = MagicStepIO(path, "r")
 
-            if not os.path.exists(block_offsets_index_path):
-                # index to save blocks
-                reader = ibz2.open(file_custom_fileIO, parallelization=os.cpu_count())
-                block_offsets = reader.block_offsets()
-                with open(block_offsets_index_path, "wb") as offsets_file:
-                    pickle.dump(block_offsets, offsets_file)
-                reader.close()
+            if os.path.exists(block_offsets_index_path):
+                block_offsets = load_block_offsets(block_offsets_index_path)
             else:
-                with open(block_offsets_index_path, "rb") as offsets_file:
-                    block_offsets = pickle.load(offsets_file)
+                block_offsets = self._scan_block_offsets(
+                    file_custom_fileIO, block_offsets_index_path, entry_size
+                )
 
-            self.reader = ibz2.open(file_custom_fileIO, parallelization=os.cpu_count())
+            # random gets decode one block, scans open own parallel reader
+            self.reader = ibz2.open(file_custom_fileIO, parallelization=1)
             self.reader.set_block_offsets(block_offsets)
             self.size = self.reader.size()
+            self.block_offsets = block_offsets
+            self.block_offsets_index_path = block_offsets_index_path
+            self.block_starts = sorted(set(block_offsets.values()) | {0})
+            zstd_path = seekable_zstd_path(path, filename, self.str_archive_md5)
+            if os.path.exists(zstd_path):
+                self._use_seekable_zstd(zstd_path)
         else:
             if not filename:
                 raise ValueError("filename not set")
             logger.info(f"Take py7z for {path}")
-            zip_file = SevenZipFile(path, "r")
-            self.reader = zip_file.read(targets=[filename]).get(filename)
-            self.size = self.reader.seek(0, 2)
-
-    def _sync_readlines(self, start_bytes=0, whence=0):
-        """Custom sync reader form files"""
-        # TODO recheck default one ?
-        start_bytes = start_bytes if start_bytes > 0 else 0
-        self.reader.seek(start_bytes, whence)
-        data_buffer = self.reader.read(512 * 1024)
-        buffer_last = b""
-        while data_buffer != b"":
-            data_buffer = buffer_last + data_buffer
-            data_lines = data_buffer.rsplit(b"\r\n")
-            for line in data_lines:
-                if line.endswith(b">"):
-                    self.bytes_queue.put(line + b"\r\n")
-                else:
-                    buffer_last = line
-            data_buffer = self.reader.read(512 * 1024)
-        return
-
-    def _sync_get(self, start: int, length: int):
-        self.reader.seek(start)
-        return self.reader.read(length)
+            # seekable zstd copy is used without building chunks of entry
+            self.size = entry_size or get_archive_entry_size(path, filename)
+            self.reader = None
+            zstd_path = seekable_zstd_path(path, filename, self.str_archive_md5)
+            if os.path.exists(zstd_path):
+                self._use_seekable_zstd(zstd_path)
+            if not self.zstd_path:
+                self._open_chunked_file()
 
-    async def readlines(self, start_bytes=0, whence=0):
-        loop = asyncio.get_event_loop()
-        """async readlines """
-        if self.bytes_queue.qsize() > 0:
-            while self.bytes_queue.qsize():
-                self.bytes_queue.get_nowait()
-
-        cursor_pos = 0
-        sync_future = loop.run_in_executor(
-            self.pool, self._sync_readlines, start_bytes, whence
+    def _scan_block_offsets(
+        self, file_custom_fileIO: IO, block_offsets_index_path: str, entry_size: int
+    ) -> dict:
+        """Offsets of bzip2 blocks, saved to `block_offsets_index_path`"""
+        path_obj = Path(self.path)
+        # cache saved before md5 was added to its name
+        old_index_path = f"{path_obj.parent}/{path_obj.name}-index.dat"
+        if os.path.exists(old_index_path):
+            block_offsets = load_block_offsets(old_index_path)
+            if block_offsets_match(self.path, block_offsets, entry_size):
+                logger.info(f"rename block offsets cache: {old_index_path}")
+                os.replace(old_index_path, block_offsets_index_path)
+                return block_offsets
+        for old_index_path in glob.glob(f"{glob.escape(str(path_obj))}-*index.dat"):
+            os.remove(old_index_path)
+        # index to save blocks, busy budget is retried by caller
+        # without keeping pool thread, see `DataArchiveReader.open`
+        try:
+            with decompression_scheduler.scan(
+                os.cpu_count(), SCAN_WAIT_SECONDS
+            ) as workers:
+                reader = ibz2.open(file_custom_fileIO, parallelization=workers)
+                block_offsets = reader.block_offsets()
+                reader.close()
+        except BaseException:
+            file_custom_fileIO.close()
+            raise
+        with open(block_offsets_index_path, "wb") as offsets_file:
+            pickle.dump(block_offsets, offsets_file)
+        return block_offsets
+
+    def _open_chunked_file(self):
+        """Read entry from zlib chunks, built on first open"""
+        path_obj = Path(self.path)
+        chunks_path = f"{path_obj.parent}/{path_obj.name}-{self.filename}-chunks.dat"
+        chunks_index_path = (
+            f"{path_obj.parent}/{path_obj.name}-{self.filename}-index.dat"
         )
-        while (self.bytes_queue.qsize() != 0) or (not sync_future.done()):
-            if self.bytes_queue.qsize() == 0:
-                await asyncio.sleep(0)
-                continue
-            try:
-                value_temp: bytes = self.bytes_queue.get_nowait()
-                yield cursor_pos, value_temp
-                cursor_pos += len(value_temp)
-            except queue.Empty:
-                await asyncio.sleep(0)
+        chunks_index = None
+        if os.path.exists(chunks_index_path):
+            chunks_index = load_block_offsets(chunks_index_path)
+        if not chunks_index or chunks_index["md5"] != self.str_archive_md5:
+            # one streaming decode to save checkpoints
+            chunks_index = build_chunked_file(
+                self.path, self.filename, chunks_path, chunks_index_path
+            )
+            chunks_index["md5"] = self.str_archive_md5
+            with open(chunks_index_path, "wb") as offsets_file:
+                pickle.dump(chunks_index, offsets_file)
+
+        self.chunks_path = chunks_path
+        self.chunks_index = chunks_index
+        self.reader = ChunkedFileReader(chunks_path, chunks_index)
+        self.size = self.reader.size()
+        self.block_starts = list(range(0, self.size, self.reader.chunk_size))
+
+    def _use_seekable_zstd(self, zstd_path: str):
+        """Read entry from seekable zstd file, offsets are same as in archive"""
+        try:
+            reader = SeekableZstdReader(zstd_path)
+        except ValueError as error:
+            # truncated or broken file, keep reading archive
+            logger.warning(f"skip broken seekable zstd file: {error}")
+            return
+        if reader.size() != self.size:
+            reader.close()
+            logger.warning(f"skip seekable zstd file of other size: {zstd_path}")
+            return
+        logger.info(f"Take seekable zstd for {self.path}")
+        with self.lock:
+            archive_reader, self.reader = self.reader, reader
+            self.zstd_path = zstd_path
+            self.block_starts = reader.frame_starts[:-1] or [0]
+        if archive_reader is not None:
+            archive_reader.close()
+
+    def block_offset_at(self, byte_offset: int) -> Optional[int]:
+        """Compressed offset (bits) of bzip2 block with decompressed byte_offset"""
+        if not self.block_offsets:
+            return None
+        if self.block_positions is None:
+            self.block_positions = block_positions(self.block_offsets)
+        return find_block_offset(self.block_positions, byte_offset)
+
+    def _sync_get_block(self, block_number: int, blocks: dict = None) -> bytes:
+        if blocks is not None and block_number in blocks:
+            return blocks[block_number]
+        block_start = self.block_starts[block_number]
+        key = (self.path, self.filename, block_start)
+        block = block_cache.get(key)
+        if block is None:
+            if block_number + 1 < len(self.block_starts):
+                block_end = self.block_starts[block_number + 1]
+            else:
+                block_end = self.size
+            with self.lock, decompression_scheduler.get():
+                self.reader.seek(block_start)
+                block = self.reader.read(block_end - block_start)
+            block_cache.put(key, block)
+        if blocks is not None:
+            blocks[block_number] = block
+        return block
+
+    def _sync_get(self, start: int, length: int, blocks: dict = None):
+        end = min(start + length, self.size)
+        parts = []
+        while start < end:
+            block_number = bisect.bisect_right(self.block_starts, start) - 1
+            block_start = self.block_starts[block_number]
+            block = self._sync_get_block(block_number, blocks)
+            part = block[start - block_start : end - block_start]
+            if not part:
+                break
+            parts.append(part)
+            start += len(part)
+        if len(parts) == 1:
+            return parts[0]
+        return b"".join(parts)
+
+    def _sync_get_many(self, ranges: List[tuple]) -> List[bytes]:
+        """Read (start, length) ranges in offset order, every block read once"""
+        blocks = {}
+        result = [b""] * len(ranges)
+        for index in sorted(range(len(ranges)), key=lambda number: ranges[number][0]):
+            start, length = ranges[index]
+            # blocks before range are not needed by next ranges
+            first_block = bisect.bisect_right(self.block_starts, start) - 1
+            for block_number in [number for number in blocks if number < first_block]:
+                del blocks[block_number]
+            result[index] = self._sync_get(start, length, blocks)
+        return result
+
+    def _sync_open_scan(self) -> Optional[tuple]:
+        """Own reader for sequential scan, workers are leased from budget
+
+        None if no worker is free in `SCAN_WAIT_SECONDS`.
+        """
+        if self.zstd_path:
+            return SeekableZstdReader(self.zstd_path), 0
+        if not self.block_offsets:
+            return ChunkedFileReader(self.chunks_path, self.chunks_index), 0
+        workers = decompression_scheduler.acquire_scan(
+            config.settings.scan_decompression_threads, SCAN_WAIT_SECONDS
+        )
+        if not workers:
+            return None
+        try:
+            reader = open_bzip2_file(
+                self.path, self.block_offsets, parallelization=workers
+            )
+        except BaseException:
+            decompression_scheduler.release_scan(workers)
+            raise
+        return reader, workers
+
+    async def _open_scan(self) -> tuple:
+        """(reader, workers) of scan, wait while budget is used by other scans"""
+        loop = asyncio.get_running_loop()
+        while True:
+            # thread is not kept while waiting, running scans need pool to finish
+            scan = await loop.run_in_executor(self.pool, self._sync_open_scan)
+            if scan is not None:
+                return scan
+
+    @staticmethod
+    def _sync_close_scan(reader: IO, workers: int):
+        reader.close()
+        decompression_scheduler.release_scan(workers)
+
+    def _start_position(self, start_bytes=0, whence=0):
+        if whence == 2:
+            start_bytes += self.size
+        return max(start_bytes, 0)
+
+    async def readbatches(self, start_bytes=0, whence=0):
+        """async read lists of (offset, line), one list per decompressed chunk
+
+        Next chunk is read in thread pool while consumer handle current one,
+        no more than one chunk ahead. Scan use own reader, so gets and other
+        scans of same file don't move it.
+        """
+        loop = asyncio.get_running_loop()
+        reader, workers = await self._open_scan()
+        next_batch = None
+        try:
+            batches = iter_line_batches(
+                reader, self._start_position(start_bytes, whence)
+            )
+            next_batch = loop.run_in_executor(self.pool, next, batches, None)
+            while True:
+                batch = await next_batch
+                if batch is None:
+                    return
+                next_batch = loop.run_in_executor(self.pool, next, batches, None)
+                yield batch
+        finally:
+            if next_batch is not None:
+                # reader can be closed only after prefetch is done
+                await asyncio.wait([next_batch])
+            await loop.run_in_executor(
+                self.pool, self._sync_close_scan, reader, workers
+            )
+
+    async def readlines(self, start_bytes=0, whence=0):
+        """async readlines with offset of every line"""
+        async for batch in self.readbatches(start_bytes, whence):
+            for cursor, line in batch:
+                yield cursor, line
 
     async def get(self, start: int, length: int):
         loop = asyncio.get_event_loop()
         sync_future = loop.run_in_executor(self.pool, self._sync_get, start, length)
         return await sync_future
 
+    async def get_many(self, ranges: List[tuple]) -> List[bytes]:
+        """Read list of (start, length) ranges in one thread pool call"""
+        if not ranges:
+            return []
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.pool, self._sync_get_many, ranges)
+
+    async def optimize(self, frame_size: int, level: int):
+        """Transcode entry to seekable zstd file and read it from now on"""
+        if self.zstd_path:
+            return
+        zstd_path = seekable_zstd_path(self.path, self.filename, self.str_archive_md5)
+        for old_zstd_path in glob.glob(
+            f"{glob.escape(self.path)}-{glob.escape(self.filename)}-*.zst"
+        ):
+            os.remove(old_zstd_path)
+        logger.info(f"start seekable zstd transcode: {self.path} {self.filename}")
+        loop = asyncio.get_running_loop()
+        reader, workers = await self._open_scan()
+        try:
+            count = await loop.run_in_executor(
+                self.pool, build_seekable_zstd, reader, zstd_path, frame_size, level
+            )
+        finally:
+            await loop.run_in_executor(
+                self.pool, self._sync_close_scan, reader, workers
+            )
+        await loop.run_in_executor(self.pool, self._use_seekable_zstd, zstd_path)
+        logger.info(f"seekable zstd saved: {zstd_path} {count} frames")
+
+    def close(self):
+        self.reader.close()
+
     def archive_md5(self):
-        hash_md5 = hashlib.md5()
-        with open(self.path, "rb") as file:
-            file.seek(0)
-            hash_md5.update(file.read(512 * 1024))
-            file.seek((512 * 1024) * 4, 2)
-            hash_md5.update(file.read(512 * 1024))
-        return hash_md5.hexdigest()
+        return file_md5(self.path)
+
+
+@asynccontextmanager
+async def scan_workers(demand: int):
+    """Lease workers of scan decoding in worker process, waited out of event loop"""
+    loop = asyncio.get_running_loop()
+    workers = 0
+    while not workers:
+        # thread is not kept while waiting, running scans need pool to finish
+        workers = await loop.run_in_executor(
+            thread_pools,
+            decompression_scheduler.acquire_scan,
+            demand,
+            SCAN_WAIT_SECONDS,
+        )
+    try:
+        yield workers
+    finally:
+        decompression_scheduler.release_scan(workers)
+
+
+def file_md5(path: str) -> str:
+    """Hash of archive saved with its indexes"""
+    hash_md5 = hashlib.md5()
+    with open(path, "rb") as file:
+        file.seek(0)
+        hash_md5.update(file.read(512 * 1024))
+        file.seek((512 * 1024) * 4, 2)
+        hash_md5.update(file.read(512 * 1024))
+    return hash_md5.hexdigest()
+
+
+def load_block_offsets(block_offsets_index_path: str) -> dict:
+    with open(block_offsets_index_path, "rb") as offsets_file:
+        return pickle.load(offsets_file)
+
+
+def block_offsets_match(
+    path: str, block_offsets: dict, size: int = None, samples=64
+) -> bool:
+    """Offsets cache fit archive file: sampled blocks begin with bzip2 magic
+
+    Last offset is end of stream at decompressed `size` if it is known.
+    """
+    if not block_offsets:
+        return False
+    positions = block_positions(block_offsets)
+    if size is not None and positions[-1][0] != size:
+        return False
+    step = max(len(positions) // samples, 1)
+    checked = positions[::step] + [positions[-1]]
+    with MagicStepIO(path, "r") as file:
+        for _, bit_offset in checked:
+            file.seek(bit_offset // 8)
+            data = file.read(7)
+            if len(data) < 7:
+                return False
+            shift = 56 - 48 - bit_offset % 8
+            magic = (int.from_bytes(data, "big") >> shift) & BZIP2_MAGIC_MASK
+            if magic not in (BZIP2_BLOCK_MAGIC, BZIP2_END_MAGIC):
+                return False
+    return True
+
+
+def block_positions(block_offsets: dict) -> List[tuple]:
+    """Sorted (decompressed offset, compressed offset in bits) of blocks"""
+    return sorted(
+        (block_start, bit_offset) for bit_offset, block_start in block_offsets.items()
+    )
+
+
+def find_block_offset(positions: List[tuple], byte_offset: int) -> Optional[int]:
+    """Compressed offset of block with byte_offset from `block_positions` list"""
+    index = bisect.bisect_right(positions, (byte_offset, float("inf"))) - 1
+    if index < 0:
+        return None
+    block_start = positions[index][0]
+    # first of blocks with same start (end of stream marks)
+    index = bisect.bisect_left(positions, (block_start,))
+    return positions[index][1]
+
+
+def open_bzip2_file(path: str, block_offsets: dict, parallelization=1):
+    """Open split archive with known block offsets (usable in worker processes)"""
+    reader = ibz2.open(MagicStepIO(path, "r"), parallelization=parallelization)
+    reader.set_block_offsets(block_offsets)
+    return reader
+
+
+def split_block_ranges(block_offsets: dict, size: int, count: int) -> List[tuple]:
+    """Split decompressed stream to `count` (start, end) ranges on bzip2 blocks"""
+    block_starts = sorted(set(block_offsets.values()))
+    if count <= 1 or len(block_starts) <= 1:
+        return [(0, size)]
+
+    bounds = [0]
+    for part in range(1, count):
+        target = size * part // count
+        index = bisect.bisect_left(block_starts, target)
+        candidates = block_starts[max(index - 1, 0) : index + 1]
+        start = min(candidates, key=lambda offset: abs(offset - target))
+        if bounds[-1] < start < size:
+            bounds.append(start)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def iter_line_batches(reader: IO, start=0, end=None, chunk_size=512 * 1024):
+    """Yield list of (offset, line) for every read chunk
+
+    Only lines which begin in [start, end) are returned, a line that crosses
+    `start` belongs to the previous range, so ranges from `split_block_ranges`
+    cover every row exactly once. Lines are sliced from read chunk, only line
+    crossing chunks border is joined.
+    """
+    position = max(start - 1, 0)  # offset of data_chunk[0]
+    reader.seek(position)
+    skip_partial = start > 0
+    buffer_last = b""
+    while True:
+        data_chunk = reader.read(chunk_size)
+        if not data_chunk:
+            break
+        batch = []
+        line_start = 0
+        line_end = data_chunk.find(b"\n")
+        if buffer_last or skip_partial:
+            if line_end == -1:
+                if not skip_partial:
+                    buffer_last += data_chunk
+                position += len(data_chunk)
+                continue
+            if skip_partial:
+                skip_partial = False
+            else:
+                line_offset = position - len(buffer_last)
+                if end is not None and line_offset >= end:
+                    return
+                batch.append((line_offset, buffer_last + data_chunk[: line_end + 1]))
+            line_start = line_end + 1
+            line_end = data_chunk.find(b"\n", line_start)
+
+        while line_end != -1:
+            if end is not None and position + line_start >= end:
+                if batch:
+                    yield batch
+                return
+            batch.append((position + line_start, data_chunk[line_start : line_end + 1]))
+            line_start = line_end + 1
+            line_end = data_chunk.find(b"\n", line_start)
+
+        buffer_last = data_chunk[line_start:]
+        position += len(data_chunk)
+        if batch:
+            yield batch
+
+    line_offset = position - len(buffer_last)
+    if buffer_last and (end is None or line_offset < end):
+        yield [(line_offset, buffer_last)]
+
+
+def iter_lines(reader: IO, start=0, end=None, chunk_size=512 * 1024):
+    """Yield (offset, line) for every line which begins in [start, end)"""
+    for batch in iter_line_batches(reader, start, end, chunk_size):
+        yield from batch
+
+
+class ChunkWriter:
+    """Writable target of 7z decoder, saves written data as zlib chunks"""
+
+    def __init__(self, chunks_file: IO, chunk_size: int):
+        self.chunks_file = chunks_file
+        self.chunk_size = chunk_size
+        self.offsets = [0]
+        self.size = 0
+        self.pending = b""
+
+    def _write_chunk(self, data_chunk: bytes):
+        self.chunks_file.write(zlib.compress(data_chunk, 6))
+        self.offsets.append(self.chunks_file.tell())
+        self.size += len(data_chunk)
+
+    def write(self, data: bytes) -> int:
+        length = len(data)
+        data = self.pending + data
+        start = 0
+        while len(data) - start >= self.chunk_size:
+            self._write_chunk(data[start : start + self.chunk_size])
+            start += self.chunk_size
+        self.pending = data[start:]
+        return length
+
+    def seek(self, position: int):
+        # decoder rewinds written file after entry, nothing to do
+        pass
+
+    def finish(self):
+        if self.pending:
+            self._write_chunk(self.pending)
+            self.pending = b""
+
+
+def build_chunked_file(
+    archive_path: str,
+    filename: str,
+    chunks_path: str,
+    chunks_index_path: str,
+    chunk_size=1024 * 1024,
+) -> dict:
+    """Save archive entry as zlib chunks for `ChunkedFileReader`
+
+    LZMA decoder state can't be saved, so entry is decoded once and split
+    to chunks which decompress independently. Decoded data is written to
+    chunks as it comes, entry is not extracted to disk or memory.
+    """
+    logger.info(f"save {filename} chunks for {archive_path}")
+    with open(f"{chunks_path}.tmp", "wb") as chunks_file:
+        writer = ChunkWriter(chunks_file, chunk_size)
+        with SevenZipFile(archive_path, "r") as zip_file:
+            # py7zr has no public streaming extract, decoder worker write
+            # registered entry to file like object (py7zr 0.20)
+            for entry in zip_file.files:
+                if entry.filename == filename:
+                    zip_file.worker.register_filelike(entry.id, MemIO(writer))
+            zip_file.worker.extract(zip_file.fp, None, parallel=False)
+        writer.finish()
+    os.replace(f"{chunks_path}.tmp", chunks_path)
+    return {"chunk_size": chunk_size, "offsets": writer.offsets, "size": writer.size}
+
+
+def get_archive_entry_size(path: str, filename: str) -> int:
+    """Uncompressed size of archive entry from 7z header"""
+    with SevenZipFile(path, "r") as archive_read:
+        for info in archive_read.list():
+            if info.filename == filename:
+                return info.uncompressed
+    raise ValueError(f"{filename} not in {path}")
 
 
 def get_archive_filenames(path):
     with SevenZipFile(path, "r") as archive_read:
         all_archive_files = archive_read.getnames()
     return all_archive_files
+
+
+def read_seek_table(file: IO) -> tuple:
+    """Compressed and decompressed offsets of frames, last is end of file data
+
+    ValueError if file is not seekable zstd or frames don't fill it.
+    """
+    file_size = file.seek(0, 2)
+    if file_size < SEEK_TABLE_FOOTER.size + 8:
+        raise ValueError(f"not seekable zstd file: {file.name}")
+    file.seek(-SEEK_TABLE_FOOTER.size, 2)
+    count, descriptor, magic = SEEK_TABLE_FOOTER.unpack(
+        file.read(SEEK_TABLE_FOOTER.size)
+    )
+    if magic != SEEKABLE_MAGIC:
+        raise ValueError(f"not seekable zstd file: {file.name}")
+    entry_size = 12 if descriptor & SEEK_TABLE_CHECKSUM_FLAG else 8
+    # skippable frame header, entries and footer
+    table_size = 8 + count * entry_size + SEEK_TABLE_FOOTER.size
+    if table_size > file_size:
+        raise ValueError(f"seek table out of file: {file.name}")
+    file.seek(-(SEEK_TABLE_FOOTER.size + count * entry_size), 2)
+    table = file.read(count * entry_size)
+    frame_offsets, frame_starts = [0], [0]
+    for compressed_size, decompressed_size in struct.iter_unpack(
+        "<II" + "x" * (entry_size - 8), table
+    ):
+        frame_offsets.append(frame_offsets[-1] + compressed_size)
+        frame_starts.append(frame_starts[-1] + decompressed_size)
+    if frame_offsets[-1] + table_size != file_size:
+        raise ValueError(f"frames don't match file size: {file.name}")
+    return frame_offsets, frame_starts
+
+
+def seekable_zstd_path(archive_path: str, filename: str, archive_md5: str) -> str:
+    path_obj = Path(archive_path)
+    return f"{path_obj.parent}/{path_obj.name}-{filename}-{archive_md5}.zst"
+
+
+def build_seekable_zstd(
+    reader: IO, zstd_path: str, frame_size=64 * 1024, level=6
+) -> int:
+    """Save decompressed stream of reader as seekable zstd file
+
+    Frames end on line ends (row longer than `frame_size` is own frame),
+    offsets in decompressed stream stay same. Written to temporary file and
+    renamed, return count of frames.
+    """
+    sizes = []
+
+    def write_frame(data: bytes):
+        frame = pyzstd.compress(data, level)
+        zstd_file.write(frame)
+        sizes.extend((len(frame), len(data)))
+
+    with open(f"{zstd_path}.tmp", "wb") as zstd_file:
+        pending = b""
+        while True:
+            data_chunk = reader.read(frame_size * 16)
+            if not data_chunk:
+                break
+            data = pending + data_chunk
+            start = 0
+            while len(data) - start >= frame_size:
+                end = data.rfind(b"\n", start, start + frame_size) + 1
+                if end <= start:
+                    end = data.find(b"\n", start + frame_size) + 1
+                    if end <= 0:
+                        # end of long row is in next chunk
+                        break
+                write_frame(data[start:end])
+                start = end
+            pending = data[start:]
+        if pending:
+            write_frame(pending)
+
+        count = len(sizes) // 2
+        zstd_file.write(
+            struct.pack("<II", SKIPPABLE_MAGIC, count * 8 + SEEK_TABLE_FOOTER.size)
+        )
+        zstd_file.write(struct.pack(f"<{len(sizes)}I", *sizes))
+        zstd_file.write(SEEK_TABLE_FOOTER.pack(count, 0, SEEKABLE_MAGIC))
+    os.replace(f"{zstd_path}.tmp", zstd_path)
+    return count
@@ -0,0 +1,63 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from app.utils import config
+
+
+class BlockCache:
+    """Size bounded LRU cache of decompressed blocks shared by all readers"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.blocks: OrderedDict[Hashable, bytes] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is None:
+                self.misses += 1
+                return None
+            self.blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def put(self, key: Hashable, block: bytes):
+        if len(block) > self.max_bytes:
+            return
+        with self.lock:
+            old_block = self.blocks.pop(key, None)
+            if old_block is not None:
+                self.size_bytes -= len(old_block)
+            self.blocks[key] = block
+            self.size_bytes += len(block)
+            while self.size_bytes > self.max_bytes:
+                _, evicted_block = self.blocks.popitem(last=False)
+                self.size_bytes -= len(evicted_block)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.blocks.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "blocks": len(self.blocks),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
+
+
+block_cache = BlockCache(config.settings.block_cache_size)
@@ -0,0 +1,225 @@
+import asyncio
+import math
+import os
+import shutil
+from typing import List, Optional
+
+from loguru import logger
+
+from app.utils import config
+from .archive_reader import (
+    ChunkedFileReader,
+    SeekableZstdReader,
+    iter_line_batches,
+    load_block_offsets,
+    open_bzip2_file,
+    scan_workers,
+    split_block_ranges,
+)
+from .custom_types import DataArchiveReader
+from .indexer import process_pools
+from .row_parser import POST_CONTENT_ATTRIBUTES, RowParseError, RowScanner
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # optional, needed only for columnar export
+    pyarrow = None
+
+COLUMNAR_FORMATS = ("parquet", "arrow")
+
+columnar_row_scanner = RowScanner(
+    POST_CONTENT_ATTRIBUTES + ("Tags", "AcceptedAnswerId")
+)
+
+DATE_COLUMNS = {
+    "creation_date": "CreationDate",
+    "last_edit_date": "LastEditDate",
+    "last_activity_date": "LastActivityDate",
+}
+
+
+def posts_schema():
+    return pyarrow.schema(
+        [
+            ("id", pyarrow.int64()),
+            ("post_type", pyarrow.int8()),
+            ("parent_id", pyarrow.int64()),
+            ("accepted_answer_id", pyarrow.int64()),
+            ("score", pyarrow.int32()),
+            ("tags", pyarrow.list_(pyarrow.string())),
+            ("creation_date", pyarrow.timestamp("ms")),
+            ("last_edit_date", pyarrow.timestamp("ms")),
+            ("last_activity_date", pyarrow.timestamp("ms")),
+            ("title", pyarrow.string()),
+            ("body", pyarrow.string()),
+        ]
+    )
+
+
+def _optional_int(value: Optional[str]) -> Optional[int]:
+    return int(value) if value else None
+
+
+def build_posts_table(lines: List[bytes]):
+    """Arrow table of post rows in lines"""
+    columns = {name: [] for name in posts_schema().names}
+    for line in lines:
+        try:
+            row = columnar_row_scanner.parse(line)
+        except RowParseError as error:
+            logger.warning(f"skip row: {error}")
+            continue
+        if not row or not row["Id"]:
+            continue
+        columns["id"].append(int(row["Id"]))
+        columns["post_type"].append(_optional_int(row["PostTypeId"]))
+        columns["parent_id"].append(_optional_int(row["ParentId"]))
+        columns["accepted_answer_id"].append(_optional_int(row["AcceptedAnswerId"]))
+        columns["score"].append(int(row["Score"] or 0))
+        columns["tags"].append(row["Tags"][1:-1].split("><") if row["Tags"] else [])
+        for column, attribute in DATE_COLUMNS.items():
+            columns[column].append(row[attribute])
+        columns["title"].append(row["Title"])
+        columns["body"].append(row["Body"])
+
+    schema = posts_schema()
+    arrays = []
+    for field in schema:
+        if field.name in DATE_COLUMNS:
+            # ISO dates are cast by arrow, faster than datetime per row
+            array = pyarrow.array(columns[field.name], pyarrow.string())
+            arrays.append(array.cast(field.type))
+        else:
+            arrays.append(pyarrow.array(columns[field.name], field.type))
+    return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+
+def write_posts_part(
+    archive_path: str,
+    block_offsets_index_path: Optional[str],
+    chunks_path: Optional[str],
+    chunks_index: Optional[dict],
+    zstd_path: Optional[str],
+    part_path: str,
+    file_format: str,
+    start: int,
+    end: int,
+) -> int:
+    """Write rows of [start, end) range as one row group file
+
+    Run in worker process, return count of rows.
+    """
+    if zstd_path:
+        reader = SeekableZstdReader(zstd_path)
+    elif block_offsets_index_path:
+        reader = open_bzip2_file(
+            archive_path, load_block_offsets(block_offsets_index_path)
+        )
+    else:
+        reader = ChunkedFileReader(chunks_path, chunks_index)
+    try:
+        lines = [
+            line for batch in iter_line_batches(reader, start, end) for _, line in batch
+        ]
+    finally:
+        reader.close()
+
+    table = build_posts_table(lines)
+    del lines
+    if file_format == "parquet":
+        pyarrow.parquet.write_table(
+            table, part_path, row_group_size=max(table.num_rows, 1)
+        )
+    else:
+        with pyarrow.ipc.new_file(part_path, table.schema) as writer:
+            writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+    return table.num_rows
+
+
+def site_name(archive_reader: DataArchiveReader) -> str:
+    """Site of archive, `site.com-Posts` and `site.com` are same site"""
+    return archive_reader.name.split("-")[0]
+
+
+def row_group_ranges(archive_reader: DataArchiveReader) -> List[tuple]:
+    """(start, end) ranges of decompressed posts, one per row group
+
+    Ranges begin on bzip2 blocks (zlib chunks or zstd frames for small
+    archives).
+    """
+    post_archive_reader = archive_reader.post_archive_reader
+    size = post_archive_reader.size
+    count = max(math.ceil(size / config.settings.export_row_group_bytes), 1)
+    block_offsets = post_archive_reader.block_offsets
+    if not block_offsets:
+        block_offsets = dict(enumerate(post_archive_reader.block_starts))
+    return split_block_ranges(block_offsets, size, count)
+
+
+async def export_columnar(
+    archive_reader: DataArchiveReader, folder: str, file_format="parquet"
+) -> dict:
+    """Write posts of archive to `{folder}/site={site}/part-N.{format}`
+
+    Parts are built in worker processes, one part file is one row group.
+    Partition is written to hidden folder and replace old one at the end.
+    """
+    if pyarrow is None:
+        raise RuntimeError("columnar export require pyarrow: pip install pyarrow")
+    if file_format not in COLUMNAR_FORMATS:
+        raise ValueError(f"Unknown format: {file_format}")
+
+    loop = asyncio.get_running_loop()
+    await archive_reader.open()
+    post_archive_reader = archive_reader.post_archive_reader
+    site = site_name(archive_reader)
+    partition_path = f"{folder}/site={site}"
+    # names starting with "." are skipped by arrow dataset readers
+    temp_path = f"{folder}/.site={site}.tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+
+    ranges = row_group_ranges(archive_reader)
+    logger.info(
+        f"start {file_format} export: {archive_reader.name} {len(ranges)} parts"
+    )
+    block_offsets_index_path = (
+        post_archive_reader.block_offsets_index_path
+        if post_archive_reader.block_offsets
+        else None
+    )
+
+    async def write_part(number: int, start: int, end: int) -> int:
+        # part decode its range in worker process
+        async with scan_workers(1):
+            return await loop.run_in_executor(
+                process_pools,
+                write_posts_part,
+                post_archive_reader.path,
+                block_offsets_index_path,
+                post_archive_reader.chunks_path,
+                post_archive_reader.chunks_index,
+                post_archive_reader.zstd_path,
+                f"{temp_path}/part-{number:05}.{file_format}",
+                file_format,
+                start,
+                end,
+            )
+
+    try:
+        counts = await asyncio.gather(
+            *[
+                write_part(number, start, end)
+                for number, (start, end) in enumerate(ranges)
+            ]
+        )
+    except BaseException:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+
+    shutil.rmtree(partition_path, ignore_errors=True)
+    os.replace(temp_path, partition_path)
+    logger.info(f"{file_format} export {sum(counts)} rows: {partition_path}")
+    return {"path": partition_path, "parts": len(ranges), "rows": sum(counts)}
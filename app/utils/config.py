@@ -1,6 +1,6 @@
 import os
 import pathlib
-from typing import ClassVar
+from typing import ClassVar, Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -12,6 +12,42 @@ class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file="env_config", env_file_encoding="utf-8")
     host: str
     port: int
+    # decompressed blocks cache for random reads
+    block_cache_size: int = 256 * 1024 * 1024
+    # "sqlite", "mmap" (memory mapped post arrays for post reads)
+    # or "static" (only compiled post arrays, no database and no indexing)
+    index_backend: str = "sqlite"
+    # server processes, more than one only for "static" index backend
+    server_workers: int = 1
+    # background index jobs budget, cpu budget is count_threads
+    index_memory_budget: int = 4 * 1024 * 1024 * 1024
+    # memory of one index worker
+    index_job_memory: int = 512 * 1024 * 1024
+    # processes parsing rows and building post responses
+    response_workers: int = 2
+    # archive readers kept in registry, least recently used are dropped
+    max_open_archives: int = 32
+    # bzip2 decompression workers of all archive readers, at least 2
+    decompression_threads: int = os.cpu_count() or 1
+    # workers leased by one sequential scan
+    scan_decompression_threads: int = 4
+    # decompressed posts of one row group file in columnar export
+    export_row_group_bytes: int = 64 * 1024 * 1024
+    # full text search index built in posts pass
+    search_index: bool = False
+    # postings kept in memory by one index worker before run is written
+    search_run_postings: int = 4 * 1024 * 1024
+    # best postings of every query term read by search
+    search_postings_limit: int = 20000
+    # save hash of indexed attributes of post row, incremental index compare rows by it
+    index_row_hash: bool = False
+    # decompressed bytes of one frame in seekable zstd copy of posts
+    optimize_frame_size: int = 64 * 1024
+    optimize_zstd_level: int = 6
+    # archives read at once by federated query
+    federated_concurrency: int = 16
+    # seconds of one archive in federated query, None is no limit
+    federated_timeout: Optional[float] = 10.0
 
 
 settings = Settings()
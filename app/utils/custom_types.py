@@ -1,32 +1,86 @@
-import re
+import asyncio
+import os
+import shutil
+import threading
+from contextlib import asynccontextmanager
 import sys
-from typing import List
+from typing import Dict, List, Optional, Set
 from enum import Enum
 from pathlib import Path
 from types import ModuleType, FunctionType
-import xml.etree.ElementTree as XmlElementTree
 from concurrent.futures.thread import ThreadPoolExecutor
 
-from sqlalchemy import select, delete, insert, func, and_
+from sqlalchemy import select, delete, insert, func, and_, exists
+from sqlalchemy.orm import aliased
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .archive_reader import get_archive_filenames, ArchiveFileReader
-from ..database.function import get_database_session
+from .archive_reader import (
+    scan_workers,
+    split_block_ranges,
+    thread_pools,
+    ArchiveFileReader,
+)
+from .config import settings
+from .decompression import DecompressionBusy
+from .manifest import archive_manifest
+from .indexer import (
+    PreviousPosts,
+    collect_incremental_batch,
+    collect_post_row,
+    index_posts_range,
+    merge_posts_parts,
+    post_row_scanner,
+    process_pools,
+)
+from .post_builder import build_post, build_posts, response_pools
+from .row_parser import (
+    TAG_ATTRIBUTES,
+    RowParseError,
+    RowScanner,
+)
+from .tags_map import TagsMap
+from ..database.bulk import BulkLoader
+from ..database.function import (
+    dispose_database_session,
+    get_database_session,
+    get_read_database_session,
+    get_read_gate,
+)
+from ..database.search_index import (
+    SearchIndex,
+    SearchIndexWriter,
+    build_search_index,
+    open_search_index,
+)
+from ..database.post_index import (
+    QUESTION_TYPE,
+    NotCompiledError,
+    PostIndex,
+    PostRecord,
+    build_post_index,
+    open_post_index,
+)
 from ..database.models import (
     Tag,
     QuestionPost,
     AnswerPost,
     TagToPost,
     ConfigValues,
+    IndexCheckpoint,
 )
 
-from py7zr import SevenZipFile, is_7zfile
-
+import orjson
 from loguru import logger
 
 POSTS_FILENAME = "Posts.xml"
 TAGS_FILENAME = "Tags.xml"
 
+# orders of `query_posts`
+POST_ORDERS = ("id", "score")
+
+tag_row_scanner = RowScanner(TAG_ATTRIBUTES)
+search_row_scanner = RowScanner(("Id", "Title", "Body"))
+
 
 class DatabaseWorker:
     """Class for reed file index database"""
@@ -37,45 +91,84 @@ class DatabaseWorker:
         self.async_sessionmaker = None
         self.session: AsyncSession = None
 
+    @asynccontextmanager
+    async def read_session(self):
+        """Worker with own read only session for one request
+
+        Requests don't share `self.session` of indexing and don't wait for it.
+        """
+        # database file is not replaced while read session is open
+        read_gate = get_read_gate(self.database_path)
+        await read_gate.enter()
+        try:
+            read_sessionmaker = await get_read_database_session(self.database_path)
+            database_reader = DatabaseWorker(self.database_path)
+            database_reader.session = read_sessionmaker()
+            try:
+                yield database_reader
+            finally:
+                await database_reader.close()
+        finally:
+            read_gate.leave()
+
     async def init_session(self):
         if not self.async_sessionmaker:
             self.async_sessionmaker = await get_database_session(self.database_path)
 
         self.session = self.async_sessionmaker()
 
-    async def get_cursor_start(self):
-        quest_count = await self.session.scalar(
-            select(func.count()).select_from(QuestionPost)
-        )
-        if quest_count <= 100_000:
-            await self.clear_posts()
-            return 0, 0
-
-        quest_item = await self.session.scalar(
-            select(QuestionPost).order_by(QuestionPost.id.desc()).limit(1)
+    async def get_checkpoint(self, name: str, hash_file: str):
+        stmt = (
+            select(IndexCheckpoint)
+            .where(
+                and_(
+                    IndexCheckpoint.hash_file == hash_file,
+                    IndexCheckpoint.name == name,
+                )
+            )
+            .limit(1)
         )
-        answer_item = await self.session.scalar(
-            select(AnswerPost).order_by(AnswerPost.id.desc()).limit(1)
+        return await self.session.scalar(stmt)
+
+    async def set_checkpoint(
+        self,
+        name: str,
+        hash_file: str,
+        block_offset: int,
+        byte_offset: int,
+        rows_count: int,
+        done=False,
+    ):
+        """Save resume position, committed together with rows before it"""
+        stmt = (
+            insert(IndexCheckpoint)
+            .prefix_with("OR REPLACE")
+            .values(
+                name=name,
+                hash_file=hash_file,
+                block_offset=block_offset,
+                byte_offset=byte_offset,
+                rows_count=rows_count,
+                done=done,
+            )
         )
-
-        if quest_item.id > answer_item.id:
-            item_to_continue = quest_item
-        else:
-            item_to_continue = answer_item
-
-        return item_to_continue.id, item_to_continue.start + item_to_continue.length
+        await self.session.execute(stmt)
 
     async def insert_post_data(
         self, question_posts: list, answers_posts: list, tags_to_post: list
     ):
-        await self.session.execute(insert(QuestionPost).values(question_posts))
-        await self.session.execute(insert(AnswerPost).values(answers_posts))
-        await self.session.execute(insert(TagToPost).values(tags_to_post))
+        if question_posts:
+            await self.session.execute(insert(QuestionPost).values(question_posts))
+        if answers_posts:
+            await self.session.execute(insert(AnswerPost).values(answers_posts))
+        if tags_to_post:
+            await self.session.execute(insert(TagToPost).values(tags_to_post))
 
     async def clear_posts(self):
         await self.session.execute(delete(AnswerPost))
         await self.session.execute(delete(QuestionPost))
         await self.session.execute(delete(TagToPost))
+        await self.session.execute(delete(IndexCheckpoint))
         await self.session.commit()
 
     async def is_indexed(self, name: str, hash_file: str) -> [bool | None]:
@@ -94,20 +187,18 @@ class DatabaseWorker:
             return None
         return result.index_done
 
+    async def get_index(self, name: str) -> ConfigValues:
+        """Index state of any archive version"""
+        stmt = select(ConfigValues).where(ConfigValues.name == name).limit(1)
+        return await self.session.scalar(stmt)
+
     async def set_index(self, name: str, hash_file: str, index=False):
-        stmt = (
-            select(ConfigValues)
-            .where(
-                and_(
-                    ConfigValues.hash_file == hash_file,
-                    ConfigValues.name == name,
-                )
-            )
-            .limit(1)
-        )
+        stmt = select(ConfigValues).where(ConfigValues.name == name).limit(1)
         result = await self.session.scalar(stmt)
         if result:
-            result.index_done = True
+            # name is unique, index of new dump replace old one
+            result.hash_file = hash_file
+            result.index_done = index
             return
         stmt = insert(ConfigValues).values(
             [{"name": name, "hash_file": hash_file, "index_done": index}]
@@ -122,11 +213,9 @@ class DatabaseWorker:
     async def insert_tags(self, tags_list_to_add):
         await self.session.execute(insert(Tag).values(tags_list_to_add))
 
-    async def get_tags_ids(self, tags_list):
-        # TODO check performance
-        stmt = select(Tag).where(Tag.name.in_(tags_list))
-        result = await self.session.scalars(stmt)
-        return result
+    async def get_tags_map(self) -> TagsMap:
+        result = await self.session.execute(select(Tag.name, Tag.id))
+        return TagsMap(result.all())
 
     async def get_tags(self, offset: int, limit: int):
         stmt = select(Tag).offset(offset).limit(limit)
@@ -135,13 +224,137 @@ class DatabaseWorker:
     async def get_post(self, post_id: int):
         return await self.session.get(QuestionPost, post_id)
 
-    async def get_posts(self, offset: int, limit: int, tags: List[str]):
-        stmt = select(QuestionPost).offset(offset).limit(limit)
-        for tag in tags:
-            stmt = stmt.where(QuestionPost.tags.any(Tag.name == tag))
+    async def get_answer_ranges(self, question_ids: List[int]) -> List[tuple]:
+        """(question id, answer id, start, length) of answers of questions"""
+        result = await self.session.execute(
+            select(
+                AnswerPost.question_post_id,
+                AnswerPost.id,
+                AnswerPost.start,
+                AnswerPost.length,
+            ).where(AnswerPost.question_post_id.in_(question_ids))
+        )
+        return result.all()
+
+    async def get_question_ids(self, post_ids: List[int]) -> Dict[int, int]:
+        """post id -> id of its question, question is own question"""
+        question_ids = {}
+        result = await self.session.scalars(
+            select(QuestionPost.id).where(QuestionPost.id.in_(post_ids))
+        )
+        question_ids.update((post_id, post_id) for post_id in result)
+        result = await self.session.execute(
+            select(AnswerPost.id, AnswerPost.question_post_id).where(
+                AnswerPost.id.in_(post_ids)
+            )
+        )
+        question_ids.update(result.all())
+        return question_ids
+
+    async def get_tagged_question_ids(
+        self, question_ids: List[int], tags: List[str]
+    ) -> Set[int]:
+        """Questions of `question_ids` with all tags"""
+        stmt = (
+            select(TagToPost.post_id)
+            .join(Tag, Tag.id == TagToPost.tag_id)
+            .where(TagToPost.post_id.in_(question_ids), Tag.name.in_(set(tags)))
+            .group_by(TagToPost.post_id)
+            .having(func.count() == len(set(tags)))
+        )
+        return set(await self.session.scalars(stmt))
+
+    async def get_posts(
+        self,
+        offset: int,
+        limit: int,
+        tags: List[str],
+        after_id: int = None,
+        order_by: str = "id",
+    ):
+        stmt = select(QuestionPost).limit(limit)
+        if order_by == "score":
+            stmt = stmt.order_by(QuestionPost.score.desc(), QuestionPost.id)
+        else:
+            stmt = stmt.order_by(QuestionPost.id)
+        if after_id is not None:
+            stmt = stmt.where(QuestionPost.id > after_id)
+        else:
+            stmt = stmt.offset(offset)
+        if tags:
+            stmt = await self._filter_tags(stmt, tags)
+            if stmt is None:
+                return []
         res = await self.session.scalars(stmt)
         return list(res)
 
+    async def _filter_tags(self, stmt, tags: List[str]):
+        """Questions of `stmt` with all tags, None if some tag does not exist"""
+        tag_rows = (
+            await self.session.execute(
+                select(Tag.id, Tag.count_usage).where(Tag.name.in_(set(tags)))
+            )
+        ).all()
+        if len(tag_rows) < len(set(tags)):
+            return None
+        # walk (tag_id, post_id) index of rarest tag, check others by primary key
+        tag_rows.sort(key=lambda row: row.count_usage)
+        stmt = stmt.join(
+            TagToPost,
+            and_(
+                TagToPost.post_id == QuestionPost.id, TagToPost.tag_id == tag_rows[0].id
+            ),
+        )
+        for tag_row in tag_rows[1:]:
+            other_tag = aliased(TagToPost)
+            stmt = stmt.where(
+                exists().where(
+                    other_tag.post_id == QuestionPost.id,
+                    other_tag.tag_id == tag_row.id,
+                )
+            )
+        return stmt
+
+    async def get_tag_question_ids(self, tags: List[str]) -> List[int]:
+        """ids of questions with all tags by id order"""
+        stmt = select(QuestionPost.id).order_by(QuestionPost.id)
+        if tags:
+            stmt = await self._filter_tags(stmt, tags)
+            if stmt is None:
+                return []
+        return list(await self.session.scalars(stmt))
+
+    async def get_question_scores(self, tags: List[str]) -> List[tuple]:
+        """(id, score) of questions with all tags by id order"""
+        stmt = select(QuestionPost.id, QuestionPost.score).order_by(QuestionPost.id)
+        if tags:
+            stmt = await self._filter_tags(stmt, tags)
+            if stmt is None:
+                return []
+        return (await self.session.execute(stmt)).all()
+
+    async def get_question_ranges(self, question_ids: List[int]) -> List[tuple]:
+        """(id, start, length, accepted answer id) of questions"""
+        result = await self.session.execute(
+            select(
+                QuestionPost.id,
+                QuestionPost.start,
+                QuestionPost.length,
+                QuestionPost.accepted_answer_id,
+            ).where(QuestionPost.id.in_(question_ids))
+        )
+        return result.all()
+
+    async def get_tag_names(self, post_ids: List[int]) -> List[tuple]:
+        """(post id, tag name) of posts"""
+        result = await self.session.execute(
+            select(TagToPost.post_id, Tag.name)
+            .join(Tag, Tag.id == TagToPost.tag_id)
+            .where(TagToPost.post_id.in_(post_ids))
+            .order_by(TagToPost.post_id, TagToPost.tag_id)
+        )
+        return result.all()
+
     async def flush(self):
         return await self.session.flush()
 
@@ -160,18 +373,30 @@ class DataArchiveReader:
     name = None
     database_path = None
 
-    post_archive_reader = None
-    tags_archive_reader = None
+    # opened on first use, see `open`
+    _post_archive_reader: ArchiveFileReader = None
+    _tags_archive_reader: ArchiveFileReader = None
+    _post_index: PostIndex = None
+    _post_index_loaded = False
+    _search_index: SearchIndex = None
+    _search_index_loaded = False
+
+    # tag name -> id, built once by index_tags
+    tags_map: TagsMap = None
+    # background job running index of archive, see `app.utils.jobs`
+    job = None
 
     post_archive_path = None
     tags_archive_path = None
+    post_archive_md5 = None
+    tags_archive_md5 = None
+    posts_size = 0
+    tags_size = 0
 
     def __init__(self, archive_path: List[str] | str):
-        """Check file list in archive"""
-        if not is_7zfile(archive_path):
-            raise ValueError(f"Not a archvie: {archive_path}")
-
-        all_archive_files = get_archive_filenames(archive_path)
+        """Check file list in archive, archive files are opened on first use"""
+        post_entry = archive_manifest.get(archive_path)
+        all_archive_files = post_entry["entries"]
 
         obj_path = Path(archive_path)
         self.name = obj_path.name[:-3]
@@ -179,8 +404,10 @@ class DataArchiveReader:
         if (POSTS_FILENAME in all_archive_files) and (
             TAGS_FILENAME in all_archive_files
         ):
-            self.post_archive_reader = ArchiveFileReader(archive_path, POSTS_FILENAME)
-            self.tags_archive_reader = ArchiveFileReader(archive_path, TAGS_FILENAME)
+            self.post_archive_path = archive_path
+            self.tags_archive_path = archive_path
+            self.post_archive_md5 = self.tags_archive_md5 = post_entry["md5"]
+            self.tags_size = all_archive_files[TAGS_FILENAME]
 
         elif (POSTS_FILENAME in all_archive_files) and ("-" in obj_path.name):
             # TODO regex or grep
@@ -188,27 +415,313 @@ class DataArchiveReader:
             archive_name = obj_path.name.split("-")[0]
             tags_archive_path = f"{obj_path.parent}/{archive_name}-Tags.7z"
 
-            with SevenZipFile(tags_archive_path, "r") as temp_read:
-                temp_all_archive_files = temp_read.getnames()
+            tags_entry = archive_manifest.get(tags_archive_path)
+            temp_all_archive_files = tags_entry["entries"]
 
             if TAGS_FILENAME in temp_all_archive_files:
-                self.post_archive_reader = ArchiveFileReader(
-                    archive_path, POSTS_FILENAME
-                )
-                self.tags_archive_reader = ArchiveFileReader(
-                    tags_archive_path, TAGS_FILENAME
-                )
+                self.post_archive_path = archive_path
+                self.tags_archive_path = tags_archive_path
+                self.post_archive_md5 = post_entry["md5"]
+                self.tags_archive_md5 = tags_entry["md5"]
+                self.tags_size = temp_all_archive_files[TAGS_FILENAME]
             else:
                 raise ValueError(f"{tags_archive_path} not exist")
         else:
             raise ValueError(f"Not correct archive: {archive_path}")
+        # uncompressed sizes of entries, known without opening archive
+        self.posts_size = all_archive_files[POSTS_FILENAME]
 
         self.database_worker = DatabaseWorker(
             f"{Path(archive_path).parent}/{self.name}.db"
         )
+        self.post_index_path = f"{Path(archive_path).parent}/{self.name}.index"
+        self.search_index_path = f"{Path(archive_path).parent}/{self.name}.search"
+        self.search_runs_path = f"{self.search_index_path}.runs"
+        # lazy files are built by one thread, see `open`
+        self.open_lock = threading.Lock()
+
+    @property
+    def post_archive_reader(self) -> ArchiveFileReader:
+        if self._post_archive_reader is None:
+            with self.open_lock:
+                if self._post_archive_reader is None:
+                    self._post_archive_reader = ArchiveFileReader(
+                        self.post_archive_path,
+                        POSTS_FILENAME,
+                        self.post_archive_md5,
+                        self.posts_size,
+                    )
+        return self._post_archive_reader
+
+    @property
+    def tags_archive_reader(self) -> ArchiveFileReader:
+        if self._tags_archive_reader is None:
+            with self.open_lock:
+                if self._tags_archive_reader is None:
+                    self._tags_archive_reader = ArchiveFileReader(
+                        self.tags_archive_path,
+                        TAGS_FILENAME,
+                        self.tags_archive_md5,
+                        self.tags_size,
+                    )
+        return self._tags_archive_reader
+
+    @property
+    def post_index(self) -> PostIndex:
+        """Memory mapped posts, used instead of database for `mmap` and `static`"""
+        if not self._post_index_loaded:
+            with self.open_lock:
+                if not self._post_index_loaded:
+                    if settings.index_backend in ("mmap", "static"):
+                        self._post_index = self._open_post_index()
+                    self._post_index_loaded = True
+        return self._post_index
+
+    @post_index.setter
+    def post_index(self, post_index: PostIndex):
+        self._post_index_loaded = True
+        self._post_index = post_index
+
+    @property
+    def posts_splittable(self) -> bool:
+        """Posts are read by bzip2 reader with block offsets, see `ArchiveFileReader`"""
+        return "-" in self.post_archive_path
+
+    def archive_hashes(self) -> dict:
+        return {"posts": self.post_archive_md5, "tags": self.tags_archive_md5}
+
+    def _open_post_index(self) -> Optional[PostIndex]:
+        post_index = open_post_index(self.post_index_path)
+        if post_index is None:
+            return None
+        hashes = post_index.meta.get("hashes")
+        if hashes and hashes != self.archive_hashes():
+            logger.warning(f"post index is built for other archive file: {self.name}")
+            post_index.close()
+            return None
+        return post_index
+
+    def read_session(self):
+        """Database read session of request, `static` backend has no database"""
+        if settings.index_backend == "static":
+            raise NotCompiledError(f"archive is not compiled: {self.name}")
+        return self.database_worker.read_session()
+
+    @property
+    def search_index(self) -> SearchIndex:
+        """Memory mapped full text index, None if not built"""
+        if not self._search_index_loaded:
+            with self.open_lock:
+                if not self._search_index_loaded:
+                    self._search_index = open_search_index(self.search_index_path)
+                    self._search_index_loaded = True
+        return self._search_index
+
+    @search_index.setter
+    def search_index(self, search_index: SearchIndex):
+        self._search_index_loaded = True
+        self._search_index = search_index
+
+    def _sync_open(self):
+        return (
+            self.post_archive_reader,
+            self.tags_archive_reader,
+            self.post_index,
+            self.search_index,
+        )
+
+    def is_open(self) -> bool:
+        return (
+            self._post_archive_reader is not None
+            and self._tags_archive_reader is not None
+            and self._post_index_loaded
+            and self._search_index_loaded
+        )
+
+    async def open(self):
+        """Open archive files in thread pool
+
+        Reader build can scan whole bzip2 archive for block offsets, so
+        async methods open archive here before they use its files.
+        """
+        if self.is_open():
+            return
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(thread_pools, self._sync_open)
+                return
+            except DecompressionBusy:
+                # offsets scan wait for workers again, pool thread is given
+                # back to scans and gets holding them
+                continue
+
+    def close(self):
+        """Close archive files, they are opened again on next use"""
+        for archive_reader in (self._post_archive_reader, self._tags_archive_reader):
+            if archive_reader is not None:
+                archive_reader.close()
+        if self._post_index is not None:
+            self._post_index.close()
+        if self._search_index is not None:
+            self._search_index.close()
+        self._post_archive_reader = self._tags_archive_reader = None
+        self._post_index, self._post_index_loaded = None, False
+        self._search_index, self._search_index_loaded = None, False
+
+    async def build_post_index(self):
+        """Save memory mapped post index for `mmap` index backend"""
+        if settings.index_backend != "mmap":
+            return
+        await self._build_post_index()
+
+    async def _build_post_index(self):
+        if self._post_index is not None:
+            self._post_index.close()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            thread_pools,
+            build_post_index,
+            self.database_worker.database_path,
+            self.post_index_path,
+            self.archive_hashes(),
+        )
+        # opened again on next use if index backend read it
+        self.post_index = None
+        self._post_index_loaded = False
+
+    async def compile(self):
+        """Save static files of indexed archive for `static` index backend
+
+        Block offsets of archive and post index with ids, offsets, answers,
+        tags postings and tags table. Served later without database.
+        """
+        await self.open()
+        async with self.database_worker.read_session() as database_reader:
+            indexed = await database_reader.is_indexed(
+                "tags", self.tags_archive_md5
+            ) and await database_reader.is_indexed("posts", self.post_archive_md5)
+        if not indexed:
+            raise ValueError(f"archive is not indexed: {self.name}")
+        await self._build_post_index()
+        logger.info(f"archive compiled: {self.name}")
+
+    async def optimize(self):
+        """Transcode posts to seekable zstd file, random reads decode small frames
+
+        Reader of archive use the file when it exists, offsets are not changed.
+        """
+        await self.open()
+        await self.post_archive_reader.optimize(
+            settings.optimize_frame_size, settings.optimize_zstd_level
+        )
+
+    async def posts_indexed(self) -> bool:
+        """Posts can be queried from post index or finished database index"""
+        if self.post_index:
+            return True
+        if settings.index_backend == "static":
+            return False
+        async with self.read_session() as database_reader:
+            status = await database_reader.is_indexed("posts", self.post_archive_md5)
+        return bool(status)
+
+    async def search_needed(self) -> bool:
+        """True if search index is enabled and not built for posts archive"""
+        if not settings.search_index:
+            return False
+        async with self.database_worker.read_session() as database_reader:
+            status = await database_reader.is_indexed(
+                "search", self.post_archive_reader.str_archive_md5
+            )
+        return not (status and self.search_index is not None)
+
+    async def new_search_writer(self) -> SearchIndexWriter:
+        """Writer of search runs for posts pass, None if search is not needed"""
+        if not await self.search_needed():
+            return None
+        shutil.rmtree(self.search_runs_path, ignore_errors=True)
+        return SearchIndexWriter(
+            self.search_runs_path, "run", settings.search_run_postings
+        )
+
+    async def finish_search_index(self, search_writer: SearchIndexWriter = None):
+        """Merge runs written in posts pass, own pass if posts pass was resumed"""
+        if search_writer is None:
+            return await self.index_search()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(thread_pools, search_writer.close)
+        await self.merge_search_index()
+
+    async def merge_search_index(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            thread_pools,
+            build_search_index,
+            self.search_runs_path,
+            self.search_index_path,
+        )
+        shutil.rmtree(self.search_runs_path, ignore_errors=True)
+        await self.database_worker.init_session()
+        await self.database_worker.set_index(
+            "search", self.post_archive_reader.str_archive_md5, True
+        )
+        await self.database_worker.commit()
+        await self.database_worker.close()
+        # searches don't wait between reads of index, old one is closed safely
+        old_search_index = self._search_index
+        self.search_index = open_search_index(self.search_index_path)
+        if old_search_index is not None:
+            old_search_index.close()
+
+    async def index_search(self):
+        """Build search index in own pass over posts
+
+        Used when posts are already indexed or posts pass was resumed.
+        """
+        await self.open()
+        if not await self.search_needed():
+            return
+        logger.info(f"start index search: {self.name}")
+        loop = asyncio.get_running_loop()
+        search_writer = await self.new_search_writer()
+        count = 0
+        async for batch in self.post_archive_reader.readbatches():
+            for cursor, line in batch:
+                try:
+                    row = search_row_scanner.parse(line)
+                except RowParseError as error:
+                    logger.warning(f"skip row at {cursor}: {self.name} {error}")
+                    continue
+                if row and row["Id"]:
+                    search_writer.add(int(row["Id"]), row["Title"], row["Body"])
+                    count += 1
+            if search_writer.full:
+                await loop.run_in_executor(thread_pools, search_writer.flush)
+                await self.report_progress(cursor + len(line), count)
+        await self.finish_search_index(search_writer)
+        logger.info(f"end index search: {self.name} {count} posts")
+
+    async def report_progress(self, bytes_done: int, rows_done: int):
+        """Progress of job, job can pause indexing or stop it here"""
+        if self.job:
+            await self.job.step(bytes_done, rows_done)
+
+    async def save_posts_checkpoint(
+        self, byte_offset: int, rows_count: int, done=False
+    ):
+        await self.database_worker.set_checkpoint(
+            "posts",
+            self.post_archive_reader.str_archive_md5,
+            self.post_archive_reader.block_offset_at(byte_offset),
+            byte_offset,
+            rows_count,
+            done,
+        )
 
     async def index_posts(self):
         """Index post in archive file"""
+        await self.open()
         logger.info(f"start index posts: {self.name}")
         # clean table
         await self.database_worker.init_session()
@@ -223,9 +736,32 @@ class DataArchiveReader:
             await self.database_worker.commit()
         elif status is True:
             await self.database_worker.close()
+            if self.post_index is None:
+                await self.build_post_index()
+            await self.index_search()
             return
 
-        global_count, start_bytes = await self.database_worker.get_cursor_start()
+        if self.tags_map is None:
+            self.tags_map = await self.database_worker.get_tags_map()
+
+        checkpoint = await self.database_worker.get_checkpoint(
+            "posts", self.post_archive_reader.str_archive_md5
+        )
+        search_writer = None
+        if checkpoint:
+            global_count, start_bytes = checkpoint.rows_count, checkpoint.byte_offset
+            logger.info(
+                f"resume index posts: {self.name} {global_count} rows from {start_bytes}"
+            )
+        else:
+            # rows without checkpoint can't be continued
+            await self.database_worker.clear_posts()
+            global_count, start_bytes = 0, 0
+            # text of rows before checkpoint is lost, so only full pass is used
+            search_writer = await self.new_search_writer()
+        loop = asyncio.get_running_loop()
+        next_offset = start_bytes
+        await self.report_progress(start_bytes, global_count)
         post_count = 0
         last_id = 0
         temp_list_posts, temp_list_answers, temp_tags_to_post = [], [], []
@@ -234,76 +770,41 @@ class DataArchiveReader:
         async for cursor, line in self.post_archive_reader.readlines(
             self.post_archive_reader.size - (512 * 1024), 0
         ):
-            try:
-                xml_tag = XmlElementTree.fromstring(line)
-            except Exception:
-                continue
-            if xml_tag.tag == "row":
-                last_id = xml_tag.attrib.get("Id")
+            row = post_row_scanner.parse(line)
+            if row and row["Id"]:
+                last_id = row["Id"]
 
         # start index posts
         async for cursor, line in self.post_archive_reader.readlines(
             start_bytes=start_bytes
         ):
+            next_offset = cursor + len(line)
             try:
-                xml_tag = XmlElementTree.fromstring(line)
-                if xml_tag.tag != "row":
+                if not collect_post_row(
+                    line,
+                    cursor,
+                    self.tags_map,
+                    temp_list_posts,
+                    temp_list_answers,
+                    temp_tags_to_post,
+                    search_writer,
+                ):
                     continue
-            except Exception:
+            except RowParseError as error:
+                logger.warning(f"skip row at {cursor}: {self.name} {error}")
                 continue
-
-            line_length = len(line)  # take full length of content
-
-            post_template = {
-                "id": xml_tag.attrib["Id"],
-                "start": cursor,
-                "length": line_length,
-                "score": int(xml_tag.attrib.get("Score")),
-            }
-            # Question post
-            if xml_tag.attrib.get("PostTypeId") == "1":
-                if xml_tag.attrib.get("Tags"):
-                    tags = re.findall(r"<(.+?)>", xml_tag.attrib.get("Tags"))
-                    tags_ids = await self.database_worker.get_tags_ids(tags)
-                    temp_tags_to_post.extend(
-                        [
-                            {"tag_id": tag.id, "post_id": post_template.get("id")}
-                            for tag in tags_ids
-                        ]
-                    )
-
-                temp_accepted_answer_id = xml_tag.attrib.get("AcceptedAnswerId")
-                post_template.update(
-                    {
-                        "accepted_answer_id": (
-                            int(temp_accepted_answer_id)
-                            if temp_accepted_answer_id
-                            else None
-                        ),
-                    }
-                )
-                temp_list_posts.append(post_template)
-            # Answer post
-            elif xml_tag.attrib.get("PostTypeId") == "2":
-                temp_question_post_id = xml_tag.attrib.get("ParentId")
-                post_template.update(
-                    {
-                        "question_post_id": (
-                            int(temp_question_post_id)
-                            if temp_question_post_id
-                            else None
-                        ),
-                    }
-                )
-                temp_list_answers.append(post_template)
             post_count += 1
 
             if post_count >= 4096:
+                if search_writer is not None and search_writer.full:
+                    await loop.run_in_executor(thread_pools, search_writer.flush)
+                global_count += post_count
                 await self.database_worker.insert_post_data(
                     temp_list_posts, temp_list_answers, temp_tags_to_post
                 )
+                await self.save_posts_checkpoint(next_offset, global_count)
                 await self.database_worker.commit()
-                global_count += post_count
+                await self.report_progress(next_offset, global_count)
 
                 temp_list_posts, temp_list_answers, temp_tags_to_post = [], [], []
 
@@ -311,21 +812,163 @@ class DataArchiveReader:
                     f"index {post_count} posts: {self.name} {global_count}/{last_id}"
                 )
                 post_count = 0
-            # TODO make flush+commit system
 
+        global_count += post_count
         await self.database_worker.insert_post_data(
             temp_list_posts, temp_list_answers, temp_tags_to_post
         )
+        await self.save_posts_checkpoint(next_offset, global_count, True)
         await self.database_worker.set_index(
             "posts", self.post_archive_reader.str_archive_md5, True
         )
         await self.database_worker.commit()
         await self.database_worker.close()
-        global_count += post_count
+        await self.report_progress(self.post_archive_reader.size, global_count)
         logger.info(f"end index {self.name} {global_count}/{last_id} indexed")
+        await self.build_post_index()
+        await self.finish_search_index(search_writer)
+
+    async def _index_posts_ranges(
+        self, part_paths: List[str], block_ranges: List[tuple], search_runs_path: str
+    ) -> List[tuple]:
+        """(count of rows, search runs written) of every range from process pool
+
+        Progress is reported when range is done. Pause or cancel of job stop
+        ranges at their next checkpoint, resumed job start them again.
+        """
+        loop = asyncio.get_running_loop()
+        stop_path = f"{self.database_worker.database_path}.stop"
+        ranges = dict(zip(part_paths, block_ranges))
+        results = {}
+
+        def progress() -> tuple:
+            return (
+                sum(end - start for start, end in map(ranges.get, results)),
+                sum(count for count, _ in results.values()),
+            )
+
+        async def index_range(part_path: str, start: int, end: int) -> tuple:
+            # range decode one bzip2 stream in worker process
+            async with scan_workers(1):
+                return await loop.run_in_executor(
+                    process_pools,
+                    index_posts_range,
+                    self.post_archive_reader.path,
+                    self.post_archive_reader.block_offsets_index_path,
+                    self.tags_map,
+                    part_path,
+                    start,
+                    end,
+                    self.post_archive_reader.str_archive_md5,
+                    search_runs_path,
+                    stop_path,
+                )
+
+        while len(results) < len(ranges):
+            if os.path.exists(stop_path):
+                os.remove(stop_path)
+            futures = {
+                asyncio.ensure_future(index_range(part_path, start, end)): part_path
+                for part_path, (start, end) in ranges.items()
+                if part_path not in results
+            }
+            pending = set(futures)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=1.0, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    count, searched, finished = future.result()
+                    if finished:
+                        results[futures[future]] = (count, searched)
+                if self.job is not None and self.job.stop_requested:
+                    if not os.path.exists(stop_path):
+                        open(stop_path, "wb").close()
+                elif done:
+                    await self.report_progress(*progress())
+            # all ranges are stopped or done, paused job wait for resume here
+            await self.report_progress(*progress())
+        if os.path.exists(stop_path):
+            os.remove(stop_path)
+        return [results[part_path] for part_path in part_paths]
+
+    async def index_posts_parallel(self, count_workers: int = None):
+        """Index post in archive file by bzip2 block ranges in process pool"""
+        await self.open()
+        if not self.post_archive_reader.block_offsets:
+            logger.info(f"no block offsets, index posts in one pass: {self.name}")
+            return await self.index_posts()
+
+        logger.info(f"start parallel index posts: {self.name}")
+        await self.database_worker.init_session()
+        status = await self.database_worker.is_indexed(
+            "posts", self.post_archive_reader.str_archive_md5
+        )
+        if status is True:
+            await self.database_worker.close()
+            if self.post_index is None:
+                await self.build_post_index()
+            await self.index_search()
+            return
+        # finished ranges are kept in part databases and merged again
+        await self.database_worker.clear_posts()
+        await self.database_worker.set_index(
+            "posts", self.post_archive_reader.str_archive_md5, False
+        )
+        await self.database_worker.commit()
+        if self.tags_map is None:
+            self.tags_map = await self.database_worker.get_tags_map()
+        await self.database_worker.close()
+
+        count_workers = min(
+            count_workers or os.cpu_count(), settings.count_threads, os.cpu_count()
+        )
+        block_ranges = split_block_ranges(
+            self.post_archive_reader.block_offsets,
+            self.post_archive_reader.size,
+            count_workers,
+        )
+        search_runs_path = None
+        if await self.search_needed():
+            search_runs_path = self.search_runs_path
+            shutil.rmtree(search_runs_path, ignore_errors=True)
+        database_path = self.database_worker.database_path
+        part_paths = [
+            f"{database_path}.part{number}" for number in range(len(block_ranges))
+        ]
+
+        results = await self._index_posts_ranges(
+            part_paths, block_ranges, search_runs_path
+        )
+        counts = [count for count, _ in results]
+        logger.info(
+            f"index {sum(counts)} posts in {len(block_ranges)} ranges: {self.name}"
+        )
+        await self.report_progress(self.post_archive_reader.size, sum(counts))
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            thread_pools, merge_posts_parts, database_path, part_paths
+        )
+
+        await self.database_worker.init_session()
+        await self.database_worker.set_index(
+            "posts", self.post_archive_reader.str_archive_md5, True
+        )
+        await self.database_worker.commit()
+        await self.database_worker.close()
+        for part_path in part_paths:
+            os.remove(part_path)
+        logger.info(f"end parallel index {self.name} {sum(counts)} indexed")
+        await self.build_post_index()
+        if search_runs_path and all(searched for _, searched in results):
+            await self.merge_search_index()
+        else:
+            # resumed ranges have no runs of rows before checkpoint
+            await self.index_search()
 
     async def index_tags(self):
         """Index all tags in posts"""
+        await self.open()
         logger.info(f"start index tags: {self.name}")
         await self.database_worker.init_session()
 
@@ -336,28 +979,32 @@ class DataArchiveReader:
             await self.database_worker.clear_posts()
             await self.database_worker.commit()
         else:
+            if self.tags_map is None:
+                self.tags_map = await self.database_worker.get_tags_map()
             await self.database_worker.close()
             logger.info(f"tags already indexed : {self.name}")
             return
 
         count = 0
         insert_items = []
+        tags_items = []
         async for cursor, line in self.tags_archive_reader.readlines():
             try:
-                xml_tag = XmlElementTree.fromstring(line)
-            except Exception:
+                row = tag_row_scanner.parse(line)
+            except RowParseError as error:
+                logger.warning(f"skip tag row at {cursor}: {self.name} {error}")
                 continue
-
-            if xml_tag.tag != "row":
+            if not row:
                 continue
 
             insert_items.append(
                 {
-                    "id": xml_tag.attrib["Id"],
-                    "name": xml_tag.attrib["TagName"],
-                    "count_usage": xml_tag.attrib["Count"],
+                    "id": row["Id"],
+                    "name": row["TagName"],
+                    "count_usage": row["Count"],
                 }
             )
+            tags_items.append((row["TagName"], row["Id"]))
             count += 1
 
             if count >= 1000:
@@ -370,134 +1017,460 @@ class DataArchiveReader:
             "tags", self.tags_archive_reader.str_archive_md5, True
         )
         await self.database_worker.commit()
+        self.tags_map = TagsMap(tags_items)
 
         logger.info(f"end index tags: {self.name}")
 
         return True
 
-    async def tags_list(self, offset=0, limit=100):
+    async def _read_tag_items(self) -> List[dict]:
+        insert_items = []
+        async for cursor, line in self.tags_archive_reader.readlines():
+            try:
+                row = tag_row_scanner.parse(line)
+            except RowParseError as error:
+                logger.warning(f"skip tag row at {cursor}: {self.name} {error}")
+                continue
+            if row:
+                insert_items.append(
+                    {
+                        "id": row["Id"],
+                        "name": row["TagName"],
+                        "count_usage": row["Count"],
+                    }
+                )
+        return insert_items
+
+    async def index_tags_bulk(self):
+        """Index all tags to new database file in bulk load mode"""
+        await self.open()
+        logger.info(f"start bulk index tags: {self.name}")
         await self.database_worker.init_session()
-        items = await self.database_worker.get_tags(offset, limit)
-        tag_list = {tag.name: {"count_usage": tag.count_usage} for tag in items}
+        if await self.database_worker.is_indexed(
+            "tags", self.tags_archive_reader.str_archive_md5
+        ):
+            if self.tags_map is None:
+                self.tags_map = await self.database_worker.get_tags_map()
+            await self.database_worker.close()
+            logger.info(f"tags already indexed : {self.name}")
+            return
         await self.database_worker.close()
-        return tag_list
 
-    async def get_post(self, post_id: int):
-        # TODO remade on upper level?
+        loop = asyncio.get_running_loop()
+        bulk_loader = BulkLoader(self.database_worker.database_path)
+        try:
+            # posts of old tags are not copied
+            await loop.run_in_executor(
+                thread_pools, bulk_loader.open, [ConfigValues.__tablename__]
+            )
+            bulk_loader.clear_index("posts")
+            insert_items = await self._read_tag_items()
+            await loop.run_in_executor(
+                thread_pools, bulk_loader.insert_tags, insert_items
+            )
+            bulk_loader.set_index(
+                "tags", self.tags_archive_reader.str_archive_md5, True
+            )
+            await self.swap_database(bulk_loader)
+        except BaseException:
+            bulk_loader.abort()
+            raise
+        self.tags_map = TagsMap((item["name"], item["id"]) for item in insert_items)
+        logger.info(f"end bulk index tags: {self.name}")
+        return True
+
+    async def index_posts_bulk(self):
+        """Index posts to new database file in bulk load mode"""
+        await self.open()
+        logger.info(f"start bulk index posts: {self.name}")
         await self.database_worker.init_session()
-        post_item = await self.database_worker.get_post(post_id)
-        if not post_item:
-            await self.database_worker.close()
-            return None
-        answer_item_list: List[AnswerPost] = (
-            await post_item.awaitable_attrs.answer_posts
+        status = await self.database_worker.is_indexed(
+            "posts", self.post_archive_reader.str_archive_md5
         )
-        tags: List[Tag] = await post_item.awaitable_attrs.tags
+        if status is True:
+            await self.database_worker.close()
+            if self.post_index is None:
+                await self.build_post_index()
+            await self.index_search()
+            return
+        if self.tags_map is None:
+            self.tags_map = await self.database_worker.get_tags_map()
         await self.database_worker.close()
 
-        question_text = await self.post_archive_reader.get(
-            post_item.start, post_item.length
+        loop = asyncio.get_running_loop()
+        search_writer = await self.new_search_writer()
+        bulk_loader = BulkLoader(self.database_worker.database_path)
+        try:
+            await loop.run_in_executor(
+                thread_pools,
+                bulk_loader.open,
+                [Tag.__tablename__, ConfigValues.__tablename__],
+            )
+            temp_list_posts, temp_list_answers, temp_tags_to_post = [], [], []
+            async for batch in self.post_archive_reader.readbatches():
+                for cursor, line in batch:
+                    try:
+                        collect_post_row(
+                            line,
+                            cursor,
+                            self.tags_map,
+                            temp_list_posts,
+                            temp_list_answers,
+                            temp_tags_to_post,
+                            search_writer,
+                        )
+                    except RowParseError as error:
+                        logger.warning(f"skip row at {cursor}: {self.name} {error}")
+
+                if search_writer is not None and search_writer.full:
+                    await loop.run_in_executor(thread_pools, search_writer.flush)
+                if len(temp_list_posts) + len(temp_list_answers) >= 65536:
+                    await loop.run_in_executor(
+                        thread_pools,
+                        bulk_loader.insert_post_data,
+                        temp_list_posts,
+                        temp_list_answers,
+                        temp_tags_to_post,
+                    )
+                    temp_list_posts, temp_list_answers, temp_tags_to_post = [], [], []
+                    logger.info(f"index {bulk_loader.rows_count} posts: {self.name}")
+                if batch:
+                    # pause and cancel don't wait for next insert
+                    await self.report_progress(
+                        cursor + len(line),
+                        bulk_loader.rows_count
+                        + len(temp_list_posts)
+                        + len(temp_list_answers),
+                    )
+
+            await loop.run_in_executor(
+                thread_pools,
+                bulk_loader.insert_post_data,
+                temp_list_posts,
+                temp_list_answers,
+                temp_tags_to_post,
+            )
+            bulk_loader.set_index(
+                "posts", self.post_archive_reader.str_archive_md5, True
+            )
+            await self.swap_database(bulk_loader)
+        except BaseException:
+            bulk_loader.abort()
+            raise
+        await self.report_progress(
+            self.post_archive_reader.size, bulk_loader.rows_count
         )
-        answer_texts = [
-            await self.post_archive_reader.get(answer_item.start, answer_item.length)
-            for answer_item in answer_item_list
-        ]
+        logger.info(f"end bulk index {self.name} {bulk_loader.rows_count} indexed")
+        await self.build_post_index()
+        await self.finish_search_index(search_writer)
+
+    async def index_posts_incremental(self):
+        """Index new dump of archive reusing index of previous dump
+
+        With `index_row_hash` posts with known id and same hash of indexed
+        attributes keep values of previous index and get new offsets, other
+        rows take values from new dump, removed posts are dropped. Tags and
+        posts go to new database file, it replace old one at the end.
+        """
+        await self.open()
+        post_md5 = self.post_archive_reader.str_archive_md5
+        tags_md5 = self.tags_archive_reader.str_archive_md5
+        await self.database_worker.init_session()
+        previous_index = await self.database_worker.get_index("posts")
+        await self.database_worker.close()
+        if previous_index is None or not previous_index.index_done:
+            logger.info(f"no previous index, index all posts: {self.name}")
+            await self.index_tags_bulk()
+            return await self.index_posts_bulk()
+        if previous_index.hash_file == post_md5:
+            if self.post_index is None:
+                await self.build_post_index()
+            await self.index_search()
+            return
 
-        # Not need try become we use index tables
+        logger.info(f"start incremental index posts: {self.name}")
+        loop = asyncio.get_running_loop()
+        search_writer = await self.new_search_writer()
+        previous_posts = await loop.run_in_executor(
+            thread_pools, PreviousPosts, self.database_worker.database_path
+        )
+        bulk_loader = BulkLoader(self.database_worker.database_path)
+        try:
+            await loop.run_in_executor(thread_pools, bulk_loader.open)
+            tag_items = await self._read_tag_items()
+            await loop.run_in_executor(thread_pools, bulk_loader.insert_tags, tag_items)
+            bulk_loader.set_index("tags", tags_md5, True)
+            tags_map = TagsMap((item["name"], item["id"]) for item in tag_items)
+            tag_ids = {int(item["id"]) for item in tag_items}
+
+            temp_list_posts, temp_list_answers, temp_tags_to_post = [], [], []
+            async for batch in self.post_archive_reader.readbatches():
+                # previous index is read by cursors, out of event loop
+                await loop.run_in_executor(
+                    thread_pools,
+                    collect_incremental_batch,
+                    batch,
+                    tags_map,
+                    tag_ids,
+                    previous_posts,
+                    temp_list_posts,
+                    temp_list_answers,
+                    temp_tags_to_post,
+                    search_writer,
+                )
+                if search_writer is not None and search_writer.full:
+                    await loop.run_in_executor(thread_pools, search_writer.flush)
+                if len(temp_list_posts) + len(temp_list_answers) >= 65536:
+                    await loop.run_in_executor(
+                        thread_pools,
+                        bulk_loader.insert_post_data,
+                        temp_list_posts,
+                        temp_list_answers,
+                        temp_tags_to_post,
+                    )
+                    temp_list_posts, temp_list_answers, temp_tags_to_post = [], [], []
+                    cursor, line = batch[-1]
+                    await self.report_progress(
+                        cursor + len(line), bulk_loader.rows_count - len(tag_items)
+                    )
 
-        question_xml_tag = XmlElementTree.fromstring(question_text).attrib
-        temp_xml_answers: List[dict] = [
-            XmlElementTree.fromstring(answer_text).attrib
-            for answer_text in answer_texts
-        ]
+            await loop.run_in_executor(
+                thread_pools,
+                bulk_loader.insert_post_data,
+                temp_list_posts,
+                temp_list_answers,
+                temp_tags_to_post,
+            )
+            bulk_loader.set_index("posts", post_md5, True)
+            previous_posts.close()
+            await self.swap_database(bulk_loader)
+        except BaseException:
+            previous_posts.close()
+            bulk_loader.abort()
+            raise
+        self.tags_map = tags_map
+        rows_count = previous_posts.reused + previous_posts.parsed
+        await self.report_progress(self.post_archive_reader.size, rows_count)
+        logger.info(
+            f"end incremental index {self.name}: {previous_posts.reused} reused,"
+            f" {previous_posts.parsed} new or changed,"
+            f" {previous_posts.count - previous_posts.reused} removed or changed"
+        )
+        await self.build_post_index()
+        await self.finish_search_index(search_writer)
+
+    async def swap_database(self, bulk_loader: BulkLoader):
+        """Replace database by bulk loaded file after its readers are finished"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(thread_pools, bulk_loader.finish)
+        database_path = self.database_worker.database_path
+        async with get_read_gate(database_path).closed():
+            await self.database_worker.close()
+            await dispose_database_session(database_path)
+            self.database_worker.async_sessionmaker = None
+            await loop.run_in_executor(thread_pools, bulk_loader.replace)
 
-        dict_answers = {
-            int(xml_answer.get("Id")): {
-                "creation_date": xml_answer.get("CreationDate"),
-                "score": xml_answer.get("Score"),
-                "last_activity_date": xml_answer.get("LastActivityDate"),
-                "body": xml_answer.get("Body"),
+    async def tags_list(self, offset=0, limit=100):
+        await self.open()
+        if self.post_index:
+            return {
+                name: {"count_usage": count_usage}
+                for _, name, count_usage in self.post_index.tag_rows[
+                    offset : offset + limit
+                ]
             }
-            for xml_answer in temp_xml_answers
-        }
-
-        fetched_post = {
-            "id": question_xml_tag.get("Id"),
-            "creation_date": question_xml_tag.get("CreationDate"),
-            "last_edit_date": question_xml_tag.get("LastEditDate"),
-            "last_activity_date": question_xml_tag.get("LastActivityDate"),
-            "title": question_xml_tag.get("Title"),
-            "body": question_xml_tag.get("Body"),
-            "tags": [tag.name for tag in tags],
-            "score": question_xml_tag.get("Score"),
-            "answers": dict_answers,
-        }
-
-        if post_item.accepted_answer_id:
-            answer = fetched_post["answers"].pop(post_item.accepted_answer_id)
-            fetched_post.update({"accepted_answer": answer})
-
-        return fetched_post
-
-    async def query_posts(self, offset=0, limit=10, tags: List[str] = []):
-        # TODO make custom types
-        fetched_posts = {}
-        answers_items = []
-        await self.database_worker.init_session()
-        post_items = await self.database_worker.get_posts(offset, limit, tags)
-        if not post_items:
-            await self.database_worker.close()
-            return None
-        for post_item in post_items:
-            tags: List[Tag] = await post_item.awaitable_attrs.tags
-            fetched_posts.update(
-                {post_item.id: {"tags": [tag.name for tag in tags], "answers": {}}}
-            )
-            answers_items.extend(await post_item.awaitable_attrs.answer_posts)
-        await self.database_worker.close()
+        async with self.read_session() as database_reader:
+            items = await database_reader.get_tags(offset, limit)
+            tag_list = {tag.name: {"count_usage": tag.count_usage} for tag in items}
+        return tag_list
 
-        queue_list: List[QuestionPost | AnswerPost] = []
-        queue_list.extend(post_items)
-        queue_list.extend(answers_items)
-        queue_list.sort(key=lambda item: item.start)
+    async def get_post(self, post_id: int, as_json=False):
+        """Post with answers, JSON bytes if `as_json`"""
+        await self.open()
+        # TODO remade on upper level?
+        if self.post_index:
+            post_item = self.post_index.get(post_id)
+            if not post_item or post_item.type != QUESTION_TYPE:
+                return orjson.dumps(None) if as_json else None
+            answer_item_list: List[PostRecord] = [
+                self.post_index.get(answer_id)
+                for answer_id in self.post_index.get_answer_ids(post_id)
+            ]
+            tag_names = self.post_index.get_tag_names(post_id)
+        else:
+            async with self.read_session() as database_reader:
+                post_item = await database_reader.get_post(post_id)
+                if not post_item:
+                    return orjson.dumps(None) if as_json else None
+                answer_item_list: List[AnswerPost] = (
+                    await post_item.awaitable_attrs.answer_posts
+                )
+                tags: List[Tag] = await post_item.awaitable_attrs.tags
+                tag_names = [tag.name for tag in tags]
+
+        question_text, *answer_texts = await self.post_archive_reader.get_many(
+            [(post_item.start, post_item.length)]
+            + [
+                (answer_item.start, answer_item.length)
+                for answer_item in answer_item_list
+            ]
+        )
 
-        for item in queue_list:
-            line_text = await self.post_archive_reader.get(item.start, item.length)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            response_pools,
+            build_post,
+            question_text,
+            answer_texts,
+            tag_names,
+            post_item.accepted_answer_id,
+            as_json,
+        )
 
-            dict_item: dict = XmlElementTree.fromstring(line_text).attrib
-            type_id = int(dict_item.get("PostTypeId"))
-            if type_id == 1:
-                post_id = int(dict_item.get("Id"))
-                fetched_posts[post_id].update(
-                    {
-                        "creation_date": dict_item.get("CreationDate"),
-                        "last_edit_date": dict_item.get("LastEditDate"),
-                        "last_activity_date": dict_item.get("LastActivityDate"),
-                        "title": dict_item.get("Title"),
-                        "body": dict_item.get("Body"),
-                        "score": dict_item.get("Score"),
-                    }
-                )
-            elif type_id == 2:
-                post_id = int(dict_item.get("ParentId"))
-                answer_id = int(dict_item.get("Id"))
-                fetched_posts[post_id]["answers"].update(
-                    {
-                        answer_id: {
-                            "creation_date": dict_item.get("CreationDate"),
-                            "score": dict_item.get("Score"),
-                            "last_activity_date": dict_item.get("LastActivityDate"),
-                            "body": dict_item.get("Body"),
-                        }
-                    }
+    async def query_posts(
+        self,
+        offset=0,
+        limit=10,
+        tags: List[str] = [],
+        after_id: int = None,
+        as_json=False,
+        order_by: str = "id",
+    ):
+        """Question posts by id order, `after_id` for keyset pagination
+
+        `order_by="score"` best score first (same scores by id), without
+        keyset pagination. JSON bytes if `as_json`
+        """
+        await self.open()
+        if order_by not in POST_ORDERS:
+            raise ValueError(f"Unknown order: {order_by}")
+        if order_by == "score" and after_id is not None:
+            raise ValueError("after_id is used only with id order")
+        loop = asyncio.get_running_loop()
+        post_tags = {}
+        answers_items = []
+        if self.post_index:
+            if order_by == "score":
+                post_ids = await loop.run_in_executor(
+                    thread_pools,
+                    self.post_index.query_question_ids_by_score,
+                    offset,
+                    limit,
+                    tags,
                 )
             else:
-                continue
-        for post_item in post_items:
-            if post_item.accepted_answer_id:
-                answer = fetched_posts[post_item.id]["answers"].pop(
-                    post_item.accepted_answer_id
+                post_ids = await loop.run_in_executor(
+                    thread_pools,
+                    self.post_index.query_question_ids,
+                    offset,
+                    limit,
+                    tags,
+                    after_id,
+                )
+            post_items = [self.post_index.get(post_id) for post_id in post_ids]
+            if not post_items:
+                return orjson.dumps(None) if as_json else None
+            for post_item in post_items:
+                answers_items.extend(
+                    self.post_index.get(answer_id)
+                    for answer_id in self.post_index.get_answer_ids(post_item.id)
+                )
+                post_tags.update(
+                    {post_item.id: self.post_index.get_tag_names(post_item.id)}
+                )
+        else:
+            async with self.read_session() as database_reader:
+                post_items = await database_reader.get_posts(
+                    offset, limit, tags, after_id, order_by
                 )
-                fetched_posts[post_item.id].update({"accepted_answer": answer})
+                if not post_items:
+                    return orjson.dumps(None) if as_json else None
+                for post_item in post_items:
+                    tags: List[Tag] = await post_item.awaitable_attrs.tags
+                    post_tags.update({post_item.id: [tag.name for tag in tags]})
+                    answers_items.extend(await post_item.awaitable_attrs.answer_posts)
+
+        queue_list: List[QuestionPost | AnswerPost | PostRecord] = []
+        queue_list.extend(post_items)
+        queue_list.extend(answers_items)
+        queue_list.sort(key=lambda item: item.start)
+
+        line_texts = await self.post_archive_reader.get_many(
+            [(item.start, item.length) for item in queue_list]
+        )
+
+        return await loop.run_in_executor(
+            response_pools,
+            build_posts,
+            line_texts,
+            post_tags,
+            {post_item.id: post_item.accepted_answer_id for post_item in post_items},
+            as_json,
+        )
 
-        return fetched_posts
+    async def _question_ids(self, post_ids: List[int]) -> Dict[int, int]:
+        if self.post_index:
+            question_ids = {}
+            for post_id in post_ids:
+                post_item = self.post_index.get(post_id)
+                if post_item is None:
+                    continue
+                if post_item.type == QUESTION_TYPE:
+                    question_ids[post_id] = post_id
+                else:
+                    question_ids[post_id] = post_item.parent_id
+            return question_ids
+        async with self.read_session() as database_reader:
+            return await database_reader.get_question_ids(post_ids)
+
+    async def _tagged_question_ids(
+        self, question_ids: List[int], tags: List[str]
+    ) -> Set[int]:
+        if self.post_index:
+            return {
+                question_id
+                for question_id in question_ids
+                if set(tags).issubset(self.post_index.get_tag_names(question_id))
+            }
+        async with self.read_session() as database_reader:
+            return await database_reader.get_tagged_question_ids(question_ids, tags)
+
+    async def search(
+        self, query: str, tags: List[str] = [], offset=0, limit=10
+    ) -> List[dict]:
+        """Posts by BM25 score of query, None if search index is not built
+
+        Answers are filtered by tags of own question. Text of found posts is
+        read by `get_post` of `question_id`.
+        """
+        await self.open()
+        if self.search_index is None:
+            return None
+        loop = asyncio.get_running_loop()
+        ranked = await loop.run_in_executor(
+            thread_pools,
+            self.search_index.search,
+            query,
+            settings.search_postings_limit,
+        )
+        wanted = offset + limit
+        # with tags many posts are dropped, check them in bigger batches
+        batch_size = max(wanted, 1000) if tags else wanted
+        hits = []
+        for number in range(0, len(ranked), max(batch_size, 1)):
+            batch = ranked[number : number + batch_size]
+            question_ids = await self._question_ids([post_id for post_id, _ in batch])
+            if tags:
+                tagged_ids = await self._tagged_question_ids(
+                    list(set(question_ids.values()) - {None}), tags
+                )
+            for post_id, score in batch:
+                question_id = question_ids.get(post_id)
+                if question_id is None:
+                    continue
+                if tags and question_id not in tagged_ids:
+                    continue
+                hits.append({"id": post_id, "question_id": question_id, "score": score})
+            if len(hits) >= wanted:
+                break
+        return hits[offset:wanted]
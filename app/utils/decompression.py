@@ -0,0 +1,128 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from app.utils import config
+
+SCAN = "scan"
+GET = "get"
+
+
+class DecompressionBusy(Exception):
+    """No decompression worker is free for scan in given time"""
+
+
+class DecompressionScheduler:
+    """Limit of decompression workers shared by all archive readers
+
+    Sequential scans lease several workers for parallel bzip2 reader, at
+    least one, and never take `get_reserve` workers, random gets decode one
+    block in one worker.
+    """
+
+    def __init__(self, max_workers: int, get_reserve: int):
+        # scan reading missing rows by gets need one worker of each kind
+        self.max_workers = max(max_workers, 2)
+        # gets always have a worker, at least half of workers can go to scans
+        self.get_reserve = min(max(get_reserve, 1), max(self.max_workers // 2, 1))
+        self.in_use = {SCAN: 0, GET: 0}
+        self.peak = 0
+        self.scans = 0
+        self.scans_reduced = 0
+        self.scan_waits = 0
+        self.gets = 0
+        self.get_waits = 0
+        self.condition = threading.Condition()
+        self._busy_time = 0.0
+        self._start_time = self._change_time = time.monotonic()
+
+    @property
+    def used(self) -> int:
+        return self.in_use[SCAN] + self.in_use[GET]
+
+    def _update(self, kind: str, count: int):
+        # called under condition lock
+        now = time.monotonic()
+        self._busy_time += self.used * (now - self._change_time)
+        self._change_time = now
+        self.in_use[kind] += count
+        self.peak = max(self.peak, self.used)
+
+    def _free_scan(self) -> int:
+        return self.max_workers - self.get_reserve - self.used
+
+    def acquire_scan(self, demand: int, timeout: float = None) -> int:
+        """Lease 1 to `demand` workers for scan, wait for free worker
+
+        0 if no worker is free in `timeout` seconds.
+        """
+        with self.condition:
+            if self._free_scan() < 1:
+                self.scan_waits += 1
+                if not self.condition.wait_for(lambda: self._free_scan() >= 1, timeout):
+                    return 0
+            count = max(min(demand, self._free_scan()), 1)
+            self.scans += 1
+            if count < demand:
+                self.scans_reduced += 1
+            self._update(SCAN, count)
+            return count
+
+    def release_scan(self, count: int):
+        with self.condition:
+            self._update(SCAN, -count)
+            self.condition.notify_all()
+
+    @contextmanager
+    def scan(self, demand: int, timeout: float = None):
+        """Lease workers for scan, DecompressionBusy if none is free in `timeout`"""
+        count = self.acquire_scan(demand, timeout)
+        if not count:
+            raise DecompressionBusy(f"no decompression worker in {timeout}s")
+        try:
+            yield count
+        finally:
+            self.release_scan(count)
+
+    @contextmanager
+    def get(self):
+        """One worker for random block read, wait if budget is used"""
+        with self.condition:
+            self.gets += 1
+            if self.used >= self.max_workers:
+                self.get_waits += 1
+                self.condition.wait_for(lambda: self.used < self.max_workers)
+            self._update(GET, 1)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self._update(GET, -1)
+                self.condition.notify_all()
+
+    def stats(self) -> dict:
+        with self.condition:
+            now = time.monotonic()
+            busy_time = self._busy_time + self.used * (now - self._change_time)
+            elapsed = now - self._start_time
+            return {
+                "max_workers": self.max_workers,
+                "get_reserve": self.get_reserve,
+                "in_use": self.used,
+                "in_use_scan": self.in_use[SCAN],
+                "in_use_get": self.in_use[GET],
+                "peak": self.peak,
+                "scans": self.scans,
+                "scans_reduced": self.scans_reduced,
+                "scan_waits": self.scan_waits,
+                "gets": self.gets,
+                "get_waits": self.get_waits,
+                "utilisation": (
+                    busy_time / (elapsed * self.max_workers) if elapsed else 0.0
+                ),
+            }
+
+
+decompression_scheduler = DecompressionScheduler(
+    config.settings.decompression_threads, config.settings.count_threads
+)
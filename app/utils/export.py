@@ -0,0 +1,224 @@
+import asyncio
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import orjson
+import pyzstd
+from loguru import logger
+
+from .post_builder import response_pools
+from .row_parser import POST_CONTENT_ATTRIBUTES, RowParseError, RowScanner
+from .custom_types import DataArchiveReader
+
+export_row_scanner = RowScanner(POST_CONTENT_ATTRIBUTES + ("Tags", "AcceptedAnswerId"))
+
+# questions waiting for answers before they are written with missing answers
+MAX_PENDING = 10_000
+
+
+def _question_record(row: dict, tag_names: List[str]) -> dict:
+    return {
+        "id": int(row["Id"]),
+        "title": row["Title"],
+        "body": row["Body"],
+        "tags": tag_names,
+        "score": int(row["Score"] or 0),
+        "creation_date": row["CreationDate"],
+        "last_edit_date": row["LastEditDate"],
+        "last_activity_date": row["LastActivityDate"],
+        "accepted_answer_id": (
+            int(row["AcceptedAnswerId"]) if row["AcceptedAnswerId"] else None
+        ),
+        "answers": [],
+    }
+
+
+def _answer_record(row: dict) -> dict:
+    return {
+        "id": int(row["Id"]),
+        "body": row["Body"],
+        "score": int(row["Score"] or 0),
+        "creation_date": row["CreationDate"],
+        "last_activity_date": row["LastActivityDate"],
+    }
+
+
+def parse_export_batch(
+    lines: List[bytes],
+    tags: List[str],
+    min_score: Optional[int],
+    pending_ids: Set[int],
+) -> Tuple[List[dict], List[Tuple[int, dict]]]:
+    """Questions passing filters and (question id, answer) of wanted questions
+
+    Run in worker process, answers of other questions are not sent back.
+    """
+    questions, answers = [], []
+    for line in lines:
+        try:
+            row = export_row_scanner.parse(line)
+        except RowParseError:
+            continue
+        if not row or not row["Id"]:
+            continue
+        if row["PostTypeId"] == "1":
+            tag_names = row["Tags"][1:-1].split("><") if row["Tags"] else []
+            if tags and not set(tags).issubset(tag_names):
+                continue
+            if min_score is not None and int(row["Score"] or 0) < min_score:
+                continue
+            questions.append(_question_record(row, tag_names))
+            pending_ids.add(int(row["Id"]))
+        elif row["PostTypeId"] == "2" and row["ParentId"]:
+            parent_id = int(row["ParentId"])
+            if parent_id in pending_ids:
+                answers.append((parent_id, _answer_record(row)))
+    return questions, answers
+
+
+class PostExporter:
+    """One sequential pass over posts joined with answers from index
+
+    Question is written when all its answers known from index are read.
+    Answers written far from their question are read by `get_many`, so
+    no more than `max_pending` questions are kept in memory.
+    """
+
+    def __init__(
+        self,
+        archive_reader: DataArchiveReader,
+        tags: List[str] = (),
+        min_score: int = None,
+        max_pending: int = MAX_PENDING,
+    ):
+        self.archive_reader = archive_reader
+        self.tags = list(tags)
+        self.min_score = min_score
+        self.max_pending = max_pending
+        self.pending: OrderedDict[int, dict] = OrderedDict()
+        # question id -> answer id -> (start, length) of answers not read yet
+        self.waiting: Dict[int, Dict[int, tuple]] = {}
+        self.count = 0
+
+    async def check_indexed(self):
+        """Answers are joined by index, ValueError if posts are not indexed"""
+        await self.archive_reader.open()
+        if self.archive_reader.post_index:
+            return
+        async with self.archive_reader.read_session() as database_reader:
+            indexed = await database_reader.is_indexed(
+                "posts", self.archive_reader.post_archive_md5
+            )
+        if not indexed:
+            raise ValueError(f"archive is not indexed: {self.archive_reader.name}")
+
+    async def _answer_ranges(self, question_ids: List[int]) -> Dict[int, dict]:
+        answer_ranges = {question_id: {} for question_id in question_ids}
+        post_index = self.archive_reader.post_index
+        if post_index:
+            for question_id in question_ids:
+                for answer_id in post_index.get_answer_ids(question_id):
+                    answer = post_index.get(answer_id)
+                    answer_ranges[question_id][answer_id] = (
+                        answer.start,
+                        answer.length,
+                    )
+            return answer_ranges
+        async with self.archive_reader.read_session() as database_reader:
+            for number in range(0, len(question_ids), 500):
+                rows = await database_reader.get_answer_ranges(
+                    question_ids[number : number + 500]
+                )
+                for question_id, answer_id, start, length in rows:
+                    answer_ranges[question_id][answer_id] = (start, length)
+        return answer_ranges
+
+    async def _read_missing(self, question_ids: List[int]):
+        """Read answers not met in scan by random reads"""
+        wanted = [
+            (question_id, answer_id, answer_range)
+            for question_id in question_ids
+            for answer_id, answer_range in self.waiting[question_id].items()
+        ]
+        if not wanted:
+            return
+        lines = await self.archive_reader.post_archive_reader.get_many(
+            [answer_range for _, _, answer_range in wanted]
+        )
+        for (question_id, answer_id, _), line in zip(wanted, lines):
+            try:
+                row = export_row_scanner.parse(line)
+            except RowParseError as error:
+                logger.warning(f"skip answer {answer_id}: {error}")
+                continue
+            if row and row["Id"] and int(row["Id"]) == answer_id:
+                self.pending[question_id]["answers"].append(_answer_record(row))
+            self.waiting[question_id].pop(answer_id, None)
+
+    def _dump(self, question_id: int) -> bytes:
+        record = self.pending.pop(question_id)
+        del self.waiting[question_id]
+        record["answers"].sort(key=lambda answer: answer["id"])
+        self.count += 1
+        return orjson.dumps(record) + b"\n"
+
+    async def _flush(self, force=False) -> bytes:
+        """NDJSON of ready questions from front, all questions if `force`"""
+        parts = []
+        while self.pending:
+            question_id = next(iter(self.pending))
+            if self.waiting[question_id]:
+                if not force and len(self.pending) <= self.max_pending:
+                    break
+                # read missing answers of front questions at once
+                front_ids = list(self.pending)[: max(len(self.pending) // 4, 1)]
+                if force:
+                    front_ids = list(self.pending)
+                await self._read_missing(front_ids)
+            parts.append(self._dump(question_id))
+        return b"".join(parts)
+
+    async def lines(self) -> AsyncIterator[bytes]:
+        """NDJSON chunks, next chunk is read when consumer take previous"""
+        loop = asyncio.get_running_loop()
+        await self.check_indexed()
+        async for batch in self.archive_reader.post_archive_reader.readbatches():
+            questions, answers = await loop.run_in_executor(
+                response_pools,
+                parse_export_batch,
+                [line for _, line in batch],
+                self.tags,
+                self.min_score,
+                set(self.pending),
+            )
+            if questions:
+                answer_ranges = await self._answer_ranges(
+                    [question["id"] for question in questions]
+                )
+                for question in questions:
+                    self.pending[question["id"]] = question
+                    self.waiting[question["id"]] = answer_ranges[question["id"]]
+            for question_id, answer in answers:
+                if self.waiting[question_id].pop(answer["id"], None) is not None:
+                    self.pending[question_id]["answers"].append(answer)
+
+            chunk = await self._flush()
+            if chunk:
+                yield chunk
+        chunk = await self._flush(force=True)
+        if chunk:
+            yield chunk
+        logger.info(f"exported {self.count} posts: {self.archive_reader.name}")
+
+    async def stream(self, compress=False) -> AsyncIterator[bytes]:
+        """`lines` compressed to one zstd frame if `compress`"""
+        if not compress:
+            async for chunk in self.lines():
+                yield chunk
+            return
+        compressor = pyzstd.ZstdCompressor()
+        async for chunk in self.lines():
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
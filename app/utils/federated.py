@@ -0,0 +1,137 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import AsyncIterator, List, Optional, Tuple
+
+import orjson
+from loguru import logger
+
+from app.utils import config
+from .archive import archive_registry
+
+# "arrival" stream posts of archive when it is done, others merge all archives
+FEDERATED_ORDERS = ("arrival", "id", "score")
+
+
+def _sort_key(order_by: str):
+    if order_by == "score":
+        return lambda item: (-int(item[2].get("score") or 0), item[1], item[0])
+    return lambda item: (item[1], item[0])
+
+
+async def _query_posts(
+    name: str, tags: List[str], limit: int, order_by: str
+) -> Optional[dict]:
+    """Posts of archive which is open and indexed, None for other archives"""
+    # archive is not opened here, cold open can scan whole archive
+    archive_reader = archive_registry.acquire_open(name)
+    if archive_reader is None:
+        return None
+    try:
+        if not await archive_reader.posts_indexed():
+            return None
+        return await archive_reader.query_posts(
+            0, limit, tags, order_by="score" if order_by == "score" else "id"
+        )
+    finally:
+        archive_registry.release(archive_reader)
+
+
+async def _query_archive(
+    name: str,
+    semaphore: asyncio.Semaphore,
+    tags: List[str],
+    limit: int,
+    order_by: str,
+    timeout: Optional[float],
+) -> Tuple[str, list, dict]:
+    """(name, [(name, post id, post)], status) of one archive
+
+    Time budget start when archive get place under concurrency limit,
+    reader lookup and query run in it.
+    """
+    async with semaphore:
+        begin = time.perf_counter()
+        posts, status = [], {"status": "ok"}
+        try:
+            result = await asyncio.wait_for(
+                _query_posts(name, tags, limit, order_by), timeout
+            )
+            if result is None:
+                status = {
+                    "status": "skipped",
+                    "detail": "archive is not open or indexed",
+                }
+            posts = [(name, post_id, post) for post_id, post in (result or {}).items()]
+        except asyncio.TimeoutError:
+            logger.warning(f"federated query timeout: {name}")
+            status = {"status": "timeout"}
+        except Exception as error:
+            # one broken archive doesn't stop others
+            logger.warning(f"federated query error: {name} {error}")
+            status = {"status": "error", "detail": str(error)}
+        status.update(
+            {"count": len(posts), "seconds": round(time.perf_counter() - begin, 3)}
+        )
+        return name, posts, status
+
+
+def _lines(posts: list) -> bytes:
+    return b"".join(
+        orjson.dumps(
+            {"archive": name, "id": post_id, **post}, option=orjson.OPT_NON_STR_KEYS
+        )
+        + b"\n"
+        for name, post_id, post in posts
+    )
+
+
+async def federated_posts(
+    names: List[str],
+    tags: List[str] = (),
+    limit: int = 100,
+    order_by: str = "id",
+    timeout: Optional[float] = None,
+) -> AsyncIterator[bytes]:
+    """NDJSON questions of many archives, archives are queried concurrently
+
+    Every archive return up to `limit` questions within `timeout` seconds,
+    no more than `federated_concurrency` archives are read at once. Only
+    open and indexed archives are read, others are skipped. Posts are
+    merged by id or score of all archives, so these orders buffer posts of
+    every archive before first line, or written when archive is done for
+    "arrival" order. Last line is `{"archives": {name: status}}`.
+    """
+    if order_by not in FEDERATED_ORDERS:
+        raise ValueError(f"Unknown order: {order_by}")
+    semaphore = asyncio.Semaphore(max(config.settings.federated_concurrency, 1))
+    tasks = [
+        asyncio.create_task(
+            _query_archive(name, semaphore, list(tags), limit, order_by, timeout)
+        )
+        for name in dict.fromkeys(names)
+    ]
+    statuses = {}
+    try:
+        if order_by == "arrival":
+            for task in asyncio.as_completed(tasks):
+                name, posts, statuses[name] = await task
+                if posts:
+                    yield _lines(posts)
+        else:
+            results = await asyncio.gather(*tasks)
+            key = _sort_key(order_by)
+            for name, _, status in results:
+                statuses[name] = status
+            merged = heapq.merge(*[posts for _, posts, _ in results], key=key)
+            while True:
+                chunk = _lines(list(itertools.islice(merged, 1000)))
+                if not chunk:
+                    break
+                yield chunk
+        yield orjson.dumps({"archives": statuses}) + b"\n"
+    finally:
+        # client gone, archives not done are not needed
+        for task in tasks:
+            task.cancel()
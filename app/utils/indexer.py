@@ -0,0 +1,443 @@
+import hashlib
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import create_engine, delete, insert, select
+
+from app.utils import config
+from .archive_reader import (
+    block_positions,
+    find_block_offset,
+    load_block_offsets,
+    open_bzip2_file,
+    iter_lines,
+)
+from .row_parser import POST_INDEX_ATTRIBUTES, RowParseError, RowScanner
+from .tags_map import TagsMap
+from ..database.search_index import SearchIndexWriter
+from ..database.models import (
+    Base,
+    QuestionPost,
+    AnswerPost,
+    TagToPost,
+    IndexCheckpoint,
+)
+
+# process pool for parallel indexing
+process_pools = ProcessPoolExecutor(max_workers=config.settings.count_threads)
+
+post_row_scanner = RowScanner(POST_INDEX_ATTRIBUTES)
+# same pass also collect text for search index
+post_search_row_scanner = RowScanner(POST_INDEX_ATTRIBUTES + ("Title", "Body"))
+# attributes saved in index, hash of row is taken from them
+ROW_HASH_ATTRIBUTES = ("PostTypeId", "ParentId", "Score", "AcceptedAnswerId", "Tags")
+
+POSTS_TABLES = [
+    QuestionPost.__tablename__,
+    AnswerPost.__tablename__,
+    TagToPost.__tablename__,
+]
+
+
+def _insert_rows(connection, question_posts, answers_posts, tags_to_post):
+    if question_posts:
+        connection.execute(insert(QuestionPost), question_posts)
+    if answers_posts:
+        connection.execute(insert(AnswerPost), answers_posts)
+    if tags_to_post:
+        connection.execute(insert(TagToPost), tags_to_post)
+
+
+def row_hash(row: dict) -> int:
+    """64 bit hash of indexed attributes of row
+
+    Views, activity date and text don't change it, so most rows of next
+    dump keep their hash.
+    """
+    values = "\0".join(row[name] or "" for name in ROW_HASH_ATTRIBUTES)
+    return int.from_bytes(
+        hashlib.blake2b(values.encode(), digest_size=8).digest(), "little", signed=True
+    )
+
+
+def collect_post_row(
+    line: bytes,
+    cursor: int,
+    tags_map: TagsMap,
+    question_posts: list,
+    answers_posts: list,
+    tags_to_post: list,
+    search_writer: SearchIndexWriter = None,
+) -> bool:
+    """Add row line to insert lists, False if line is not a row
+
+    Title and Body are parsed only when text is added to `search_writer`.
+    """
+    if search_writer is None:
+        row = post_row_scanner.parse(line)
+    else:
+        row = post_search_row_scanner.parse(line)
+    if not row:
+        return False
+    if not row["Id"]:
+        raise RowParseError(f"row without Id: {line[:128]!r}")
+    _collect_row(
+        row,
+        line,
+        cursor,
+        tags_map,
+        question_posts,
+        answers_posts,
+        tags_to_post,
+        search_writer,
+    )
+    return True
+
+
+def _collect_row(
+    row: dict,
+    line: bytes,
+    cursor: int,
+    tags_map: TagsMap,
+    question_posts: list,
+    answers_posts: list,
+    tags_to_post: list,
+    search_writer: SearchIndexWriter = None,
+):
+    post_template = {
+        "id": int(row["Id"]),
+        "start": cursor,
+        "length": len(line),  # take full length of content
+        "score": int(row["Score"] or 0),
+        "row_hash": row_hash(row) if config.settings.index_row_hash else None,
+    }
+    # Question post
+    if row["PostTypeId"] == "1":
+        tags_to_post.extend(
+            [
+                {"tag_id": tag_id, "post_id": post_template["id"]}
+                for tag_id in tags_map.get_ids(row["Tags"])
+            ]
+        )
+        post_template["accepted_answer_id"] = (
+            int(row["AcceptedAnswerId"]) if row["AcceptedAnswerId"] else None
+        )
+        question_posts.append(post_template)
+    # Answer post
+    elif row["PostTypeId"] == "2":
+        post_template["question_post_id"] = (
+            int(row["ParentId"]) if row["ParentId"] else None
+        )
+        answers_posts.append(post_template)
+    if search_writer is not None:
+        search_writer.add(post_template["id"], row["Title"], row["Body"])
+
+
+def _save_checkpoint(
+    connection, name, hash_file, positions, byte_offset, rows_count, done=False
+):
+    connection.execute(
+        insert(IndexCheckpoint)
+        .prefix_with("OR REPLACE")
+        .values(
+            name=name,
+            hash_file=hash_file,
+            block_offset=find_block_offset(positions, byte_offset),
+            byte_offset=byte_offset,
+            rows_count=rows_count,
+            done=done,
+        )
+    )
+
+
+def index_posts_range(
+    archive_path: str,
+    block_offsets_index_path: str,
+    tags_map: TagsMap,
+    part_path: str,
+    start: int,
+    end: int,
+    hash_file: str = "",
+    search_runs_path: str = None,
+    stop_path: str = None,
+) -> tuple:
+    """Index rows of [start, end) range to separate part database
+
+    Run in worker process, result merged by `merge_posts_parts`.
+    Part keeps checkpoint of its range, so restarted indexing continue it.
+    Search runs are written to `search_runs_path` only when range is read
+    from start. Range stop at next checkpoint when `stop_path` file exists.
+    Return (count of rows, True if search runs are written, True if done).
+    """
+    checkpoint_name = f"posts:{start}:{end}"
+    part_engine = create_engine(f"sqlite:///{part_path}")
+    Base.metadata.create_all(part_engine)
+    with part_engine.begin() as connection:
+        checkpoint = connection.execute(
+            select(IndexCheckpoint).where(
+                IndexCheckpoint.name == checkpoint_name,
+                IndexCheckpoint.hash_file == hash_file,
+            )
+        ).first()
+        if checkpoint is None:
+            # part of other ranges or archive
+            for table in (TagToPost, AnswerPost, QuestionPost, IndexCheckpoint):
+                connection.execute(delete(table))
+    if checkpoint and checkpoint.done:
+        part_engine.dispose()
+        return checkpoint.rows_count, False, True
+    search_writer = None
+    if search_runs_path and checkpoint is None:
+        search_writer = SearchIndexWriter(
+            search_runs_path,
+            f"part{start:015}",
+            config.settings.search_run_postings,
+        )
+
+    block_offsets = load_block_offsets(block_offsets_index_path)
+    reader = open_bzip2_file(archive_path, block_offsets)
+    positions = block_positions(block_offsets)
+
+    post_count = 0
+    global_count = checkpoint.rows_count if checkpoint else 0
+    next_offset = checkpoint.byte_offset if checkpoint else start
+    temp_list_posts, temp_list_answers, temp_tags_to_post = [], [], []
+    for cursor, line in iter_lines(reader, next_offset, end):
+        next_offset = cursor + len(line)
+        try:
+            if not collect_post_row(
+                line,
+                cursor,
+                tags_map,
+                temp_list_posts,
+                temp_list_answers,
+                temp_tags_to_post,
+                search_writer,
+            ):
+                continue
+        except RowParseError as error:
+            logger.warning(f"skip row at {cursor}: {archive_path} {error}")
+            continue
+        post_count += 1
+        if search_writer is not None and search_writer.full:
+            search_writer.flush()
+
+        if post_count >= 4096:
+            global_count += post_count
+            with part_engine.begin() as connection:
+                _insert_rows(
+                    connection, temp_list_posts, temp_list_answers, temp_tags_to_post
+                )
+                _save_checkpoint(
+                    connection,
+                    checkpoint_name,
+                    hash_file,
+                    positions,
+                    next_offset,
+                    global_count,
+                )
+            temp_list_posts, temp_list_answers, temp_tags_to_post = [], [], []
+            post_count = 0
+            if stop_path and os.path.exists(stop_path):
+                # job is paused or cancelled, range continue from checkpoint
+                part_engine.dispose()
+                reader.close()
+                return global_count, False, False
+
+    global_count += post_count
+    with part_engine.begin() as connection:
+        _insert_rows(connection, temp_list_posts, temp_list_answers, temp_tags_to_post)
+        _save_checkpoint(
+            connection,
+            checkpoint_name,
+            hash_file,
+            positions,
+            next_offset,
+            global_count,
+            True,
+        )
+    part_engine.dispose()
+    reader.close()
+    if search_writer is not None:
+        search_writer.close()
+    return global_count, search_writer is not None, True
+
+
+def merge_posts_parts(database_path: str, part_paths: List[str]):
+    """Copy posts from part databases to archive database
+
+    index stay not done until all parts merged, parts are removed
+    by caller after that, so failed merge is done again from finished parts
+    """
+    connection = sqlite3.connect(database_path)
+    try:
+        for part_path in part_paths:
+            connection.execute("ATTACH DATABASE ? AS part", (part_path,))
+            with connection:
+                for table in POSTS_TABLES:
+                    connection.execute(
+                        f"INSERT INTO {table} SELECT * FROM part.{table}"
+                    )
+            connection.execute("DETACH DATABASE part")
+    finally:
+        connection.close()
+    logger.info(f"merged {len(part_paths)} parts to {database_path}")
+
+
+class _IdCursor:
+    """Rows of query ordered by id, read forward by `take`"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.row = next(self.rows, None)
+
+    def take(self, post_id: int) -> list:
+        """Rows of `post_id`, rows of smaller ids are skipped"""
+        while self.row is not None and self.row[0] < post_id:
+            self.row = next(self.rows, None)
+        result = []
+        while self.row is not None and self.row[0] == post_id:
+            result.append(self.row)
+            self.row = next(self.rows, None)
+        return result
+
+
+class PreviousPosts:
+    """Posts of previous dump index for incremental index
+
+    Rows of new dump come in id order, so every table is read by one
+    ordered cursor, ids out of order are looked up by primary key.
+    """
+
+    QUESTIONS_SQL = "SELECT id, score, accepted_answer_id, row_hash FROM question_posts"
+    ANSWERS_SQL = "SELECT id, score, question_post_id, row_hash FROM answer_posts"
+    TAGS_SQL = "SELECT post_id, tag_id FROM post_tags"
+
+    def __init__(self, database_path: str):
+        self.connection = sqlite3.connect(
+            f"file:{database_path}?mode=ro", uri=True, check_same_thread=False
+        )
+        self.count = self.connection.execute(
+            "SELECT (SELECT count(*) FROM question_posts)"
+            " + (SELECT count(*) FROM answer_posts)"
+        ).fetchone()[0]
+        self.questions = _IdCursor(
+            self.connection.execute(f"{self.QUESTIONS_SQL} ORDER BY id")
+        )
+        self.answers = _IdCursor(
+            self.connection.execute(f"{self.ANSWERS_SQL} ORDER BY id")
+        )
+        self.tags = _IdCursor(
+            self.connection.execute(f"{self.TAGS_SQL} ORDER BY post_id, tag_id")
+        )
+        self.last_id = 0
+        self.reused = 0
+        self.parsed = 0
+
+    def _lookup(self, post_id: int) -> Optional[Tuple[int, tuple, List[int]]]:
+        question = self.connection.execute(
+            f"{self.QUESTIONS_SQL} WHERE id = ?", (post_id,)
+        ).fetchone()
+        if question:
+            tag_rows = self.connection.execute(
+                f"{self.TAGS_SQL} WHERE post_id = ?", (post_id,)
+            ).fetchall()
+            return 1, question, [tag_id for _, tag_id in tag_rows]
+        answer = self.connection.execute(
+            f"{self.ANSWERS_SQL} WHERE id = ?", (post_id,)
+        ).fetchone()
+        return (2, answer, []) if answer else None
+
+    def get(self, post_id: int) -> Optional[Tuple[int, tuple, List[int]]]:
+        """(post type, previous row, tag ids) of post, None for new post"""
+        if post_id <= self.last_id:
+            return self._lookup(post_id)
+        self.last_id = post_id
+        tag_ids = [tag_id for _, tag_id in self.tags.take(post_id)]
+        question = self.questions.take(post_id)
+        if question:
+            return 1, question[0], tag_ids
+        answer = self.answers.take(post_id)
+        if answer:
+            return 2, answer[0], []
+        return None
+
+    def close(self):
+        self.connection.close()
+
+
+def collect_incremental_batch(
+    batch: List[Tuple[int, bytes]],
+    tags_map: TagsMap,
+    tag_ids: set,
+    previous_posts: PreviousPosts,
+    question_posts: list,
+    answers_posts: list,
+    tags_to_post: list,
+    search_writer: SearchIndexWriter = None,
+):
+    """Add rows of batch to insert lists, rows of previous index are reused
+
+    Indexed attributes of every row are read. With `index_row_hash` row is
+    reused when post id is known and hash of these attributes is same, other
+    rows are collected from the new dump.
+    """
+    if search_writer is None:
+        row_scanner = post_row_scanner
+    else:
+        row_scanner = post_search_row_scanner
+    for cursor, line in batch:
+        try:
+            row = row_scanner.parse(line)
+            if not row:
+                continue
+            if not row["Id"]:
+                raise RowParseError(f"row without Id: {line[:128]!r}")
+            post_id = int(row["Id"])
+        except (RowParseError, ValueError) as error:
+            # broken row is skipped, job goes on
+            logger.warning(f"skip row at {cursor}: {error}")
+            continue
+        previous_post = line_hash = None
+        if config.settings.index_row_hash:
+            line_hash = row_hash(row)
+            previous_post = previous_posts.get(post_id)
+        if previous_post is None or previous_post[1][3] != line_hash:
+            _collect_row(
+                row,
+                line,
+                cursor,
+                tags_map,
+                question_posts,
+                answers_posts,
+                tags_to_post,
+                search_writer,
+            )
+            previous_posts.parsed += 1
+            continue
+
+        post_type, previous_row, previous_tag_ids = previous_post
+        post_template = {
+            "id": post_id,
+            "start": cursor,
+            "length": len(line),
+            "score": previous_row[1],
+            "row_hash": line_hash,
+        }
+        if post_type == 1:
+            post_template["accepted_answer_id"] = previous_row[2]
+            question_posts.append(post_template)
+            tags_to_post.extend(
+                {"tag_id": tag_id, "post_id": post_id}
+                for tag_id in previous_tag_ids
+                if tag_id in tag_ids
+            )
+        else:
+            post_template["question_post_id"] = previous_row[2]
+            answers_posts.append(post_template)
+        if search_writer is not None:
+            search_writer.add(post_id, row["Title"], row["Body"])
+        previous_posts.reused += 1
@@ -0,0 +1,278 @@
+import asyncio
+import os
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from .archive import archive_registry
+from .config import settings
+
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+DONE = "done"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+ACTIVE_STATES = (QUEUED, RUNNING, PAUSED)
+# finished jobs kept for `/indexing/jobs`
+FINISHED_JOBS_KEPT = 100
+# bulk loader page cache
+BULK_MEMORY = 512 * 1024 * 1024
+
+
+class JobCancelled(Exception):
+    """Raised in indexing loop of cancelled job"""
+
+
+class IndexJob:
+    """Indexing of one archive run in background
+
+    Indexing loop call `step` after every committed batch, pause and cancel
+    take effect there, so a stopped job continue from its checkpoint.
+    """
+
+    def __init__(self, archive_reader, parallel=False, bulk=False, incremental=False):
+        self.id = uuid.uuid4().hex
+        self.archive_reader = archive_reader
+        self.name = archive_reader.name
+        self.parallel = parallel
+        self.bulk = bulk
+        self.incremental = incremental
+        self.state = QUEUED
+        self.stage = None
+        self.error = None
+
+        # archive is opened by job run, budget is known from manifest
+        self.cpu = 1
+        if parallel and archive_reader.posts_splittable:
+            self.cpu = min(settings.count_threads, os.cpu_count())
+        self.memory = self.cpu * settings.index_job_memory
+        if bulk or incremental:
+            self.memory += BULK_MEMORY
+
+        self.bytes_total = archive_reader.posts_size
+        self.bytes_done = 0
+        self.rows_done = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        # progress of current run, resumed job start from its checkpoint
+        self._run_bytes = None
+        self._run_rows = 0
+        self._run_time = 0.0
+        self._paused_time = 0.0
+        self._cancelled = False
+        self._resume_event = asyncio.Event()
+        self._resume_event.set()
+
+    async def step(self, bytes_done: int, rows_done: int):
+        if self._run_bytes is None:
+            self._run_bytes, self._run_rows = bytes_done, rows_done
+            self._run_time = time.monotonic()
+        self.bytes_done, self.rows_done = bytes_done, rows_done
+        if bytes_done >= self.bytes_total:
+            # all rows are read, nothing left to pause
+            return
+        if not self._resume_event.is_set():
+            logger.info(f"pause index job {self.id}: {self.name}")
+            self.state = PAUSED
+            pause_start = time.monotonic()
+            await self._resume_event.wait()
+            self._paused_time += time.monotonic() - pause_start
+            self.state = RUNNING
+        if self._cancelled:
+            raise JobCancelled(self.id)
+
+    @property
+    def stop_requested(self) -> bool:
+        """Pause or cancel is waiting for next `step`"""
+        return self._cancelled or not self._resume_event.is_set()
+
+    def pause(self):
+        if self.state in (QUEUED, RUNNING):
+            self._resume_event.clear()
+
+    def resume(self):
+        self._resume_event.set()
+
+    def cancel(self):
+        self._cancelled = True
+        self._resume_event.set()
+
+    async def _run_tags_and_posts(self, archive_reader):
+        self.stage = "tags"
+        if self.bulk:
+            await archive_reader.index_tags_bulk()
+        else:
+            await archive_reader.index_tags()
+        self.stage = "posts"
+        self._run_bytes = None
+        if self.parallel:
+            await archive_reader.index_posts_parallel(self.cpu)
+        elif self.bulk:
+            await archive_reader.index_posts_bulk()
+        else:
+            await archive_reader.index_posts()
+
+    async def run(self):
+        archive_reader = self.archive_reader
+        archive_reader.job = self
+        self.state = RUNNING
+        self.started_at = time.time()
+        logger.info(f"start index job {self.id}: {self.name}")
+        try:
+            await self.step(0, 0)
+            # offsets scan or chunks build of first open run under job budget
+            self.stage = "open"
+            await archive_reader.open()
+            if self.incremental:
+                # tags are loaded with posts to new database file
+                self.stage = "posts"
+                await archive_reader.index_posts_incremental()
+            else:
+                await self._run_tags_and_posts(archive_reader)
+            self.bytes_done = self.bytes_total
+            self.state = DONE
+        except JobCancelled:
+            self.state = CANCELLED
+        except Exception as error:
+            logger.exception(f"index job {self.id} failed: {self.name}")
+            self.state = FAILED
+            self.error = repr(error)
+        finally:
+            archive_reader.job = None
+            await archive_reader.database_worker.close()
+            # finished job don't keep archive open
+            self.archive_reader = None
+            self.finished_at = time.time()
+            logger.info(f"end index job {self.id}: {self.name} {self.state}")
+
+    def progress(self) -> dict:
+        rows_per_second = bytes_per_second = 0.0
+        eta = None
+        if self._run_bytes is not None and self.state in (RUNNING, PAUSED):
+            elapsed = time.monotonic() - self._run_time - self._paused_time
+            if elapsed > 0:
+                rows_per_second = (self.rows_done - self._run_rows) / elapsed
+                bytes_per_second = (self.bytes_done - self._run_bytes) / elapsed
+            if bytes_per_second > 0:
+                eta = (self.bytes_total - self.bytes_done) / bytes_per_second
+        return {
+            "id": self.id,
+            "name": self.name,
+            "state": self.state,
+            "stage": self.stage,
+            "parallel": self.parallel,
+            "bulk": self.bulk,
+            "incremental": self.incremental,
+            "cpu": self.cpu,
+            "memory": self.memory,
+            "rows_done": self.rows_done,
+            "bytes_done": self.bytes_done,
+            "bytes_total": self.bytes_total,
+            "rows_per_second": rows_per_second,
+            "bytes_per_second": bytes_per_second,
+            "eta_seconds": eta,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class IndexScheduler:
+    """Queue of index jobs run under global cpu and memory budget
+
+    Biggest archives start first, smaller jobs fill budget left by them,
+    so whole set finish sooner than with all archives at once.
+    """
+
+    def __init__(self, cpu_budget: int, memory_budget: int):
+        self.cpu_budget = cpu_budget
+        self.memory_budget = memory_budget
+        self.cpu_used = 0
+        self.memory_used = 0
+        self.jobs: Dict[str, IndexJob] = {}
+        self.queue: List[IndexJob] = []
+        self.tasks = set()
+
+    def submit(
+        self, archive_reader, parallel=False, bulk=False, incremental=False
+    ) -> IndexJob:
+        """Queue index of archive, active job of same archive is returned"""
+        for job in self.jobs.values():
+            if job.name == archive_reader.name and job.state in ACTIVE_STATES:
+                return job
+        job = IndexJob(archive_reader, parallel, bulk, incremental)
+        self._prune()
+        # reader of job is not evicted and opened again while job is queued
+        archive_registry.pin(archive_reader)
+        self.jobs[job.id] = job
+        self.queue.append(job)
+        self.queue.sort(key=lambda queued_job: queued_job.bytes_total, reverse=True)
+        self._schedule()
+        return job
+
+    def _prune(self):
+        """Drop oldest finished jobs over `FINISHED_JOBS_KEPT`"""
+        finished = [job for job in self.jobs.values() if job.state not in ACTIVE_STATES]
+        finished.sort(key=lambda job: job.finished_at or job.created_at)
+        for job in finished[: max(len(finished) - FINISHED_JOBS_KEPT, 0)]:
+            del self.jobs[job.id]
+
+    def get(self, job_id: str) -> Optional[IndexJob]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job: IndexJob):
+        job.cancel()
+        if job in self.queue:
+            self.queue.remove(job)
+            archive_registry.unpin(job.archive_reader)
+            job.state = CANCELLED
+            job.archive_reader = None
+            job.finished_at = time.time()
+
+    def _job_budget(self, job: IndexJob) -> tuple:
+        # job bigger than budget run alone
+        return min(job.cpu, self.cpu_budget), min(job.memory, self.memory_budget)
+
+    def _schedule(self):
+        for job in list(self.queue):
+            cpu, memory = self._job_budget(job)
+            if (
+                self.cpu_used + cpu > self.cpu_budget
+                or self.memory_used + memory > self.memory_budget
+            ):
+                continue
+            self.queue.remove(job)
+            self.cpu_used += cpu
+            self.memory_used += memory
+            task = asyncio.create_task(self._run(job, cpu, memory))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, job: IndexJob, cpu: int, memory: int):
+        archive_reader = job.archive_reader
+        try:
+            await job.run()
+        finally:
+            archive_registry.unpin(archive_reader)
+            self.cpu_used -= cpu
+            self.memory_used -= memory
+            self._schedule()
+
+    def stats(self) -> dict:
+        return {
+            "cpu_budget": self.cpu_budget,
+            "cpu_used": self.cpu_used,
+            "memory_budget": self.memory_budget,
+            "memory_used": self.memory_used,
+            "queued": len(self.queue),
+        }
+
+
+index_scheduler = IndexScheduler(settings.count_threads, settings.index_memory_budget)
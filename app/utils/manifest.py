@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable
+
+from loguru import logger
+from py7zr import SevenZipFile, is_7zfile
+
+from .archive_reader import file_md5
+from .config import settings
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+class ArchiveManifest:
+    """Metadata of archives in folder saved to `manifest.json`
+
+    Entry is used while size and mtime of archive are same, so known
+    archive is loaded with one `os.stat` and without opening 7z header.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = str(folder)
+        self.path = f"{folder}/{MANIFEST_FILENAME}"
+        self.archives: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as manifest_file:
+                data = json.load(manifest_file)
+        except (OSError, ValueError) as error:
+            logger.warning(f"manifest not loaded: {self.path} {error}")
+            return
+        if data.get("version") == MANIFEST_VERSION:
+            self.archives = data["archives"]
+
+    @staticmethod
+    def _scan(path: str, stat: os.stat_result) -> dict:
+        if not is_7zfile(path):
+            raise ValueError(f"Not a archvie: {path}")
+        with SevenZipFile(path, "r") as archive:
+            entries = {info.filename: info.uncompressed for info in archive.list()}
+        return {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "md5": file_md5(path),
+            "entries": entries,
+        }
+
+    def get(self, path: str) -> dict:
+        """Metadata of archive: size, mtime_ns, md5, entries (name -> size)"""
+        name = Path(path).name
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.archives.get(name)
+            if (
+                entry
+                and entry["size"] == stat.st_size
+                and entry["mtime_ns"] == stat.st_mtime_ns
+            ):
+                self.hits += 1
+                return entry
+
+        entry = self._scan(path, stat)
+        with self.lock:
+            self.archives[name] = entry
+            self.misses += 1
+        self.save()
+        return entry
+
+    def prune(self, names: Iterable[str]):
+        """Forget archives not in `names`"""
+        names = set(names)
+        with self.lock:
+            removed = [name for name in self.archives if name not in names]
+            for name in removed:
+                del self.archives[name]
+        if removed:
+            self.save()
+
+    def save(self):
+        with self.save_lock:
+            with self.lock:
+                data = {"version": MANIFEST_VERSION, "archives": dict(self.archives)}
+            # server worker processes share manifest file
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(temp_path, "w", encoding="utf-8") as manifest_file:
+                    json.dump(data, manifest_file)
+                os.replace(temp_path, self.path)
+            except OSError as error:
+                logger.warning(f"manifest not saved: {self.path} {error}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "archives": len(self.archives),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+archive_manifest = ArchiveManifest(settings.archive_folder)
@@ -0,0 +1,111 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import orjson
+
+from app.utils import config
+from .row_parser import POST_CONTENT_ATTRIBUTES, RowScanner
+
+# parse rows and build responses out of event loop
+response_pools = ProcessPoolExecutor(max_workers=config.settings.response_workers)
+
+content_row_scanner = RowScanner(POST_CONTENT_ATTRIBUTES)
+
+
+def _dump(result, as_json: bool):
+    if as_json:
+        return orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS)
+    return result
+
+
+def _answer(row: dict) -> dict:
+    return {
+        "creation_date": row.get("CreationDate"),
+        "score": row.get("Score"),
+        "last_activity_date": row.get("LastActivityDate"),
+        "body": row.get("Body"),
+    }
+
+
+def build_post(
+    question_text: bytes,
+    answer_texts: List[bytes],
+    tag_names: List[str],
+    accepted_answer_id: Optional[int],
+    as_json=False,
+):
+    """Post with answers from row lines, JSON bytes if `as_json`"""
+    question_row = content_row_scanner.parse(question_text)
+    answer_rows = [
+        content_row_scanner.parse(answer_text) for answer_text in answer_texts
+    ]
+
+    fetched_post = {
+        "id": question_row.get("Id"),
+        "creation_date": question_row.get("CreationDate"),
+        "last_edit_date": question_row.get("LastEditDate"),
+        "last_activity_date": question_row.get("LastActivityDate"),
+        "title": question_row.get("Title"),
+        "body": question_row.get("Body"),
+        "tags": tag_names,
+        "score": question_row.get("Score"),
+        "answers": {int(row.get("Id")): _answer(row) for row in answer_rows},
+    }
+
+    if accepted_answer_id:
+        answer = fetched_post["answers"].pop(accepted_answer_id)
+        fetched_post.update({"accepted_answer": answer})
+    return _dump(fetched_post, as_json)
+
+
+def build_posts(
+    line_texts: List[bytes],
+    post_tags: Dict[int, List[str]],
+    accepted_answer_ids: Dict[int, Optional[int]],
+    as_json=False,
+):
+    """Posts of page from question and answer row lines
+
+    `post_tags` give order of posts in result.
+    """
+    fetched_posts = {
+        post_id: {"tags": tag_names, "answers": {}}
+        for post_id, tag_names in post_tags.items()
+    }
+    for line_text in line_texts:
+        row = content_row_scanner.parse(line_text)
+        type_id = int(row.get("PostTypeId"))
+        if type_id == 1:
+            fetched_posts[int(row.get("Id"))].update(
+                {
+                    "creation_date": row.get("CreationDate"),
+                    "last_edit_date": row.get("LastEditDate"),
+                    "last_activity_date": row.get("LastActivityDate"),
+                    "title": row.get("Title"),
+                    "body": row.get("Body"),
+                    "score": row.get("Score"),
+                }
+            )
+        elif type_id == 2:
+            fetched_posts[int(row.get("ParentId"))]["answers"].update(
+                {int(row.get("Id")): _answer(row)}
+            )
+
+    for post_id, accepted_answer_id in accepted_answer_ids.items():
+        if accepted_answer_id:
+            answer = fetched_posts[post_id]["answers"].pop(accepted_answer_id)
+            fetched_posts[post_id].update({"accepted_answer": answer})
+    return _dump(fetched_posts, as_json)
+
+
+def build_post_lines(
+    line_texts: List[bytes],
+    post_tags: Dict[int, List[str]],
+    accepted_answer_ids: Dict[int, Optional[int]],
+) -> bytes:
+    """NDJSON of `build_posts`, one question with answers and `id` per line"""
+    posts = build_posts(line_texts, post_tags, accepted_answer_ids)
+    return b"".join(
+        orjson.dumps({"id": post_id, **post}, option=orjson.OPT_NON_STR_KEYS) + b"\n"
+        for post_id, post in posts.items()
+    )
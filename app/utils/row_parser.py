@@ -0,0 +1,87 @@
+import re
+from typing import Dict, Iterable, Optional
+
+POST_INDEX_ATTRIBUTES = (
+    "Id",
+    "PostTypeId",
+    "ParentId",
+    "Score",
+    "Tags",
+    "AcceptedAnswerId",
+)
+POST_CONTENT_ATTRIBUTES = (
+    "Id",
+    "PostTypeId",
+    "ParentId",
+    "Score",
+    "CreationDate",
+    "LastEditDate",
+    "LastActivityDate",
+    "Title",
+    "Body",
+)
+TAG_ATTRIBUTES = ("Id", "TagName", "Count")
+
+XML_ENTITIES = {"lt": "<", "gt": ">", "amp": "&", "quot": '"', "apos": "'"}
+XML_ENTITY_REGEX = re.compile(r"&(#[xX][0-9a-fA-F]+|#[0-9]+|lt|gt|amp|quot|apos);")
+ATTRIBUTE_WHITESPACE = str.maketrans("\r\n\t", "   ")
+
+
+class RowParseError(ValueError):
+    """Broken `<row .../>` line"""
+
+
+def _replace_entity(match: re.Match) -> str:
+    entity = match.group(1)
+    if entity[0] != "#":
+        return XML_ENTITIES[entity]
+    if entity[1] in "xX":
+        return chr(int(entity[2:], 16))
+    return chr(int(entity[1:]))
+
+
+def unescape_attribute(value: str) -> str:
+    """Attribute value as XML parser return it"""
+    if "\r" in value or "\n" in value or "\t" in value:
+        # literal line breaks is normalized to spaces, `&#xA;` kept
+        value = value.replace("\r\n", " ").translate(ATTRIBUTE_WHITESPACE)
+    if "&" not in value:
+        return value
+    return XML_ENTITY_REGEX.sub(_replace_entity, value)
+
+
+class RowScanner:
+    """Read selected attributes from `<row .../>` lines without XML tree
+
+    Dump rows always quote values with `"` and escape it inside values,
+    so ` Name="` can be found by plain substring search.
+    """
+
+    def __init__(self, attributes: Iterable[str]):
+        self.attributes = tuple(attributes)
+        self.needles = tuple((name, f' {name}="'.encode()) for name in self.attributes)
+
+    def parse(self, line: bytes) -> Optional[Dict[str, Optional[str]]]:
+        """Return attributes of row line (None if not set), None for other lines"""
+        row_start = line.find(b"<row ", 0, 64)
+        if row_start == -1:
+            return None
+
+        find = line.find
+        values = {}
+        for name, needle in self.needles:
+            value_start = find(needle, row_start)
+            if value_start == -1:
+                values[name] = None
+                continue
+            value_start += len(needle)
+            value_end = find(b'"', value_start)
+            if value_end == -1:
+                raise RowParseError(f"{name} value not closed: {line[:128]!r}")
+            value = line[value_start:value_end].decode("utf-8")
+            if "&" in value or "\n" in value or "\r" in value or "\t" in value:
+                value = unescape_attribute(value)
+            values[name] = value
+        return values
+
+    __call__ = parse
@@ -0,0 +1,198 @@
+import asyncio
+import bisect
+import random
+from array import array
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from .archive_reader import thread_pools
+from .custom_types import DataArchiveReader
+from .post_builder import build_post_lines, response_pools
+from ..database.post_index import ANSWER_TYPE, QUESTION_TYPE, PostRecord
+
+# questions read by one `get_many`, rows are grouped by block inside it
+SAMPLE_BATCH = 500
+
+
+def draw_sample(
+    strata: List[Sequence[int]], count: int, rng: random.Random
+) -> List[int]:
+    """Ids drawn without replacement, `count` is shared equally by strata
+
+    Strata smaller than their share give all ids, rest of share goes to
+    bigger strata. Id of several strata is taken once.
+    """
+    chosen = set()
+    sample = []
+    order = sorted(range(len(strata)), key=lambda number: (len(strata[number]), number))
+    for left, number in zip(range(len(order), 0, -1), order):
+        stratum = strata[number]
+        share = -(-(count - len(sample)) // left)
+        # extra ids replace ids taken by previous strata
+        draw = rng.sample(stratum, min(len(stratum), share + len(chosen)))
+        taken = 0
+        for post_id in draw:
+            if taken >= share:
+                break
+            if post_id in chosen:
+                continue
+            chosen.add(post_id)
+            sample.append(post_id)
+            taken += 1
+    return sample
+
+
+def score_strata(rows: Iterable[Tuple[int, int]], score_bins: List[int]) -> List[array]:
+    """Split (id, score) rows by `score_bins`, bins are [bound, next bound)"""
+    bounds = sorted(set(score_bins))
+    strata = [array("i") for _ in range(len(bounds) + 1)]
+    for post_id, score in rows:
+        strata[bisect.bisect_right(bounds, score)].append(post_id)
+    return strata
+
+
+class PostSampler:
+    """Random questions with answers, reproducible by seed
+
+    Ids are drawn from index, optionally stratified by tags (one stratum per
+    tag) or by score bins. Sampled posts are read in offset order in
+    batches, so every block is decompressed once per batch.
+    """
+
+    def __init__(
+        self,
+        archive_reader: DataArchiveReader,
+        count: int,
+        tags: List[str] = (),
+        strata_tags: List[str] = (),
+        score_bins: List[int] = (),
+        seed: int = None,
+        batch_size: int = SAMPLE_BATCH,
+    ):
+        if strata_tags and score_bins:
+            raise ValueError("strata_tags and score_bins can't be used together")
+        if count < 0:
+            raise ValueError("count can't be negative")
+        self.archive_reader = archive_reader
+        self.count = count
+        self.tags = list(tags)
+        self.strata_tags = list(strata_tags)
+        self.score_bins = list(score_bins)
+        self.seed = seed if seed is not None else random.randrange(1 << 32)
+        self.batch_size = max(batch_size, 1)
+
+    def _index_strata(self) -> List[Sequence[int]]:
+        """Strata of question ids from post index, run in thread pool"""
+        post_index = self.archive_reader.post_index
+        if self.strata_tags:
+            return [
+                post_index.question_ids(self.tags + [tag]) for tag in self.strata_tags
+            ]
+        post_ids = post_index.question_ids(self.tags)
+        if not self.score_bins:
+            return [post_ids]
+        scores = map(post_index.columns["score"].__getitem__, post_ids)
+        return score_strata(zip(post_ids, scores), self.score_bins)
+
+    async def _database_strata(self) -> List[Sequence[int]]:
+        """Strata of question ids from database, scores are read only for bins"""
+        loop = asyncio.get_running_loop()
+        async with self.archive_reader.read_session() as database_reader:
+            if self.strata_tags:
+                return [
+                    await database_reader.get_tag_question_ids(self.tags + [tag])
+                    for tag in self.strata_tags
+                ]
+            if not self.score_bins:
+                return [await database_reader.get_tag_question_ids(self.tags)]
+            rows = await database_reader.get_question_scores(self.tags)
+        return await loop.run_in_executor(
+            thread_pools, score_strata, rows, self.score_bins
+        )
+
+    def _draw(self, strata: List[Sequence[int]]) -> List[int]:
+        return sorted(draw_sample(strata, self.count, random.Random(self.seed)))
+
+    async def sample_ids(self) -> List[int]:
+        """Sampled question ids in id order"""
+        loop = asyncio.get_running_loop()
+        await self.archive_reader.open()
+        if self.archive_reader.post_index:
+            strata = await loop.run_in_executor(thread_pools, self._index_strata)
+        else:
+            strata = await self._database_strata()
+        return await loop.run_in_executor(thread_pools, self._draw, strata)
+
+    async def _read_batch(
+        self, question_ids: List[int]
+    ) -> Tuple[List[bytes], Dict[int, List[str]], Dict[int, Optional[int]]]:
+        """Rows of questions and their answers, tags and accepted answers"""
+        post_index = self.archive_reader.post_index
+        if post_index:
+            post_items = [post_index.get(post_id) for post_id in question_ids]
+            answers_items = [
+                post_index.get(answer_id)
+                for post_item in post_items
+                for answer_id in post_index.get_answer_ids(post_item.id)
+            ]
+            post_tags = {
+                post_item.id: post_index.get_tag_names(post_item.id)
+                for post_item in post_items
+            }
+        else:
+            async with self.archive_reader.read_session() as database_reader:
+                question_rows = await database_reader.get_question_ranges(question_ids)
+                answer_rows = await database_reader.get_answer_ranges(question_ids)
+                tag_rows = await database_reader.get_tag_names(question_ids)
+            post_items = [
+                PostRecord(
+                    post_id, start, length, 0, QUESTION_TYPE, accepted_answer_id, None
+                )
+                for post_id, start, length, accepted_answer_id in sorted(question_rows)
+            ]
+            answers_items = [
+                PostRecord(answer_id, start, length, 0, ANSWER_TYPE, None, question_id)
+                for question_id, answer_id, start, length in answer_rows
+            ]
+            post_tags = {post_item.id: [] for post_item in post_items}
+            for post_id, tag_name in tag_rows:
+                post_tags[post_id].append(tag_name)
+
+        queue_list = sorted(post_items + answers_items, key=lambda item: item.start)
+        line_texts = await self.archive_reader.post_archive_reader.get_many(
+            [(item.start, item.length) for item in queue_list]
+        )
+        accepted_answer_ids = {
+            post_item.id: post_item.accepted_answer_id for post_item in post_items
+        }
+        return line_texts, post_tags, accepted_answer_ids
+
+    async def lines(self) -> AsyncIterator[bytes]:
+        """NDJSON chunks, one chunk per batch, next batch is read ahead"""
+        loop = asyncio.get_running_loop()
+        sample = await self.sample_ids()
+        batches = [
+            sample[number : number + self.batch_size]
+            for number in range(0, len(sample), self.batch_size)
+        ]
+        next_read = None
+        try:
+            if batches:
+                next_read = asyncio.ensure_future(self._read_batch(batches[0]))
+            for number in range(len(batches)):
+                batch = await next_read
+                next_read = None
+                if number + 1 < len(batches):
+                    next_read = asyncio.ensure_future(
+                        self._read_batch(batches[number + 1])
+                    )
+                yield await loop.run_in_executor(
+                    response_pools, build_post_lines, *batch
+                )
+        finally:
+            if next_read is not None:
+                next_read.cancel()
+        logger.info(
+            f"sampled {len(sample)} posts: {self.archive_reader.name} seed {self.seed}"
+        )
@@ -0,0 +1,38 @@
+import sys
+from typing import Iterable, List, Tuple
+
+
+class TagsMap:
+    """Frozen tag name -> id map for indexing hot loop
+
+    Built once after tags indexing, names interned to share memory
+    with parsed rows.
+    """
+
+    __slots__ = ("_ids",)
+
+    def __init__(self, items: Iterable[Tuple[str, int]] = ()):
+        self._ids = {sys.intern(str(name)): int(tag_id) for name, tag_id in items}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, name: str):
+        return name in self._ids
+
+    def __getitem__(self, name: str) -> int:
+        return self._ids[name]
+
+    def __reduce__(self):
+        # send to worker processes as plain items
+        return TagsMap, (list(self._ids.items()),)
+
+    def get(self, name: str, default=None):
+        return self._ids.get(name, default)
+
+    def get_ids(self, tags_string: str) -> List[int]:
+        """Tags attribute value `<python><c++>` to known tag ids"""
+        if not tags_string:
+            return []
+        names = tags_string[1:-1].split("><")
+        return [tag_id for tag_id in map(self._ids.get, names) if tag_id is not None]
@@ -0,0 +1,46 @@
+"""Requests/sec of read path with concurrent clients
+
+usage: python -m benchmarks.concurrency <archive name> [seconds]
+archive must be indexed, runs get_post and query_posts like the API does
+"""
+
+import asyncio
+import random
+import sys
+import time
+
+from app.utils.archive import get_archive_reader
+
+
+async def client(archive_reader, post_ids, deadline, counter):
+    while time.perf_counter() < deadline:
+        if random.random() < 0.8:
+            await archive_reader.get_post(random.choice(post_ids))
+        else:
+            await archive_reader.query_posts(random.randint(0, 1000), 10)
+        counter[0] += 1
+
+
+async def main():
+    name = sys.argv[1]
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    archive_reader = get_archive_reader(name)
+    posts = await archive_reader.query_posts(0, 1000)
+    post_ids = list(posts or {})
+    if not post_ids:
+        raise ValueError(f"{name} is not indexed")
+
+    for clients in (1, 8, 64):
+        counter = [0]
+        deadline = time.perf_counter() + seconds
+        await asyncio.gather(
+            *[
+                client(archive_reader, post_ids, deadline, counter)
+                for _ in range(clients)
+            ]
+        )
+        print(f"{clients:>3} clients: {counter[0] / seconds:10.1f} requests/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""Latency of small get/post requests while big page requests run
+
+usage: python -m benchmarks.latency <archive name> [seconds]
+archive must be indexed, `inline` row is building responses on event loop
+like before response workers
+"""
+
+import asyncio
+import random
+import sys
+import time
+from concurrent.futures import Executor, Future
+
+from app.utils import custom_types
+from app.utils.archive import get_archive_reader
+
+SMALL_CLIENTS = 8
+BIG_CLIENTS = 2
+
+
+class InlineExecutor(Executor):
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+async def small_client(archive_reader, post_ids, deadline, latencies):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        await archive_reader.get_post(random.choice(post_ids), as_json=True)
+        latencies.append(time.perf_counter() - start)
+
+
+async def big_client(archive_reader, deadline, counter):
+    while time.perf_counter() < deadline:
+        await archive_reader.query_posts(random.randint(0, 1000), 100, as_json=True)
+        counter[0] += 1
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def run(archive_reader, post_ids, seconds):
+    latencies, counter = [], [0]
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(
+        *[
+            small_client(archive_reader, post_ids, deadline, latencies)
+            for _ in range(SMALL_CLIENTS)
+        ],
+        *[big_client(archive_reader, deadline, counter) for _ in range(BIG_CLIENTS)],
+    )
+    return latencies, counter[0]
+
+
+async def main():
+    name = sys.argv[1]
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    archive_reader = get_archive_reader(name)
+    posts = await archive_reader.query_posts(0, 1000)
+    post_ids = list(posts or {})
+    if not post_ids:
+        raise ValueError(f"{name} is not indexed")
+
+    response_pools = custom_types.response_pools
+    for mode, executor in (("inline", InlineExecutor()), ("workers", response_pools)):
+        custom_types.response_pools = executor
+        # warm up worker processes and block cache
+        await run(archive_reader, post_ids, 0.5)
+        latencies, big_count = await run(archive_reader, post_ids, seconds)
+        print(
+            f"{mode:>8}: get/post p50 {percentile(latencies, 0.5) * 1000:7.2f} ms"
+            f" p99 {percentile(latencies, 0.99) * 1000:7.2f} ms"
+            f" ({len(latencies) / seconds:7.1f} req/s),"
+            f" get/posts?limit=100 {big_count / seconds:5.1f} req/s"
+        )
+    custom_types.response_pools = response_pools
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
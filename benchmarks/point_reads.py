@@ -0,0 +1,53 @@
+"""Latency and CPU of uncached point reads of post rows
+
+usage: python -m benchmarks.point_reads <archive name> [reads]
+archive must be indexed, run before and after `python optimize.py <archive name>`
+to compare bzip2 blocks with seekable zstd frames
+"""
+
+import asyncio
+import random
+import sqlite3
+import statistics
+import sys
+import time
+
+from app.utils.archive import get_archive_reader
+from app.utils.block_cache import block_cache
+
+
+async def main():
+    name = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    archive_reader = get_archive_reader(name)
+    await archive_reader.open()
+    connection = sqlite3.connect(archive_reader.database_worker.database_path)
+    ranges = connection.execute(
+        "SELECT start, length FROM question_posts"
+        " UNION ALL SELECT start, length FROM answer_posts"
+    ).fetchall()
+    connection.close()
+    if not ranges:
+        raise ValueError(f"{name} is not indexed")
+
+    post_archive_reader = archive_reader.post_archive_reader
+    source = "seekable zstd" if post_archive_reader.zstd_path else "archive blocks"
+    latencies = []
+    cpu_start = time.process_time()
+    for start, length in random.sample(ranges, min(count, len(ranges))):
+        block_cache.clear()
+        begin = time.perf_counter()
+        await post_archive_reader.get(start, length)
+        latencies.append(time.perf_counter() - begin)
+    cpu = time.process_time() - cpu_start
+
+    latencies.sort()
+    print(f"{source}: {len(latencies)} reads")
+    print(f"  mean {statistics.mean(latencies) * 1000:8.3f} ms")
+    print(f"  p50  {latencies[len(latencies) // 2] * 1000:8.3f} ms")
+    print(f"  p99  {latencies[int(len(latencies) * 0.99)] * 1000:8.3f} ms")
+    print(f"  cpu  {cpu / len(latencies) * 1000:8.3f} ms per read")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
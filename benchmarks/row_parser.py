@@ -0,0 +1,50 @@
+"""Compare RowScanner with ElementTree on Posts.xml rows
+
+usage: python -m benchmarks.row_parser path/to/Posts.xml [rows]
+"""
+
+import sys
+import time
+import xml.etree.ElementTree as XmlElementTree
+from itertools import islice
+
+from app.utils.row_parser import POST_INDEX_ATTRIBUTES, RowScanner
+
+
+def element_tree_parse(line: bytes):
+    try:
+        xml_tag = XmlElementTree.fromstring(line)
+    except Exception:
+        return None
+    if xml_tag.tag != "row":
+        return None
+    return {name: xml_tag.attrib.get(name) for name in POST_INDEX_ATTRIBUTES}
+
+
+def run(name, parse, lines):
+    start = time.perf_counter()
+    for line in lines:
+        parse(line)
+    elapsed = time.perf_counter() - start
+    size = sum(map(len, lines)) / 1024 / 1024
+    print(f"{name:>12}: {len(lines) / elapsed:12.0f} rows/s {size / elapsed:8.1f} MB/s")
+    return elapsed
+
+
+def main():
+    path = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200_000
+    with open(path, "rb") as file:
+        lines = list(islice(file, count))
+
+    scanner = RowScanner(POST_INDEX_ATTRIBUTES)
+    for line in lines:
+        assert scanner.parse(line) == element_tree_parse(line), line[:128]
+
+    element_tree_time = run("ElementTree", element_tree_parse, lines)
+    scanner_time = run("RowScanner", scanner.parse, lines)
+    print(f"{'speedup':>12}: {element_tree_time / scanner_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
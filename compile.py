@@ -0,0 +1,46 @@
+"""Compile indexed archives to static files served without database
+
+usage: python compile.py <archive name> [<archive name> ...]
+       python compile.py --all
+
+post index is saved to `<archive>.index` folder, then set
+`index_backend = "static"` to serve compiled archives
+"""
+
+import argparse
+import asyncio
+from typing import List
+
+from loguru import logger
+
+from app.utils.archive import archive_names, get_archive_reader
+
+
+async def compile_archives(names: List[str]) -> int:
+    """Compile archives one by one, return count of not compiled"""
+    failed = 0
+    for name in names:
+        try:
+            await get_archive_reader(name).compile()
+        except ValueError as error:
+            logger.error(f"not compiled: {name} {error}")
+            failed += 1
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="compile indexed archives for static index backend"
+    )
+    parser.add_argument("names", nargs="*", help="archive names in archive folder")
+    parser.add_argument("--all", action="store_true", help="all archives in folder")
+    args = parser.parse_args()
+    names = archive_names() if args.all else args.names
+    if not names:
+        parser.error("set archive names or --all")
+    if asyncio.run(compile_archives(names)):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
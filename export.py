@@ -0,0 +1,68 @@
+"""Stream posts of archive as NDJSON, one question with answers per line
+
+usage: python export.py <archive name> [-o file] [--tag name] [--min-score N] [--zstd]
+       python export.py <archive name> -o <dataset folder> --format parquet|arrow
+
+parquet and arrow write every post row to `<dataset folder>/site=<site>/`,
+need pyarrow installed
+"""
+
+import argparse
+import asyncio
+import sys
+from typing import List
+
+from loguru import logger
+
+from app.utils.archive import get_archive_reader
+from app.utils.columnar import export_columnar
+from app.utils.export import PostExporter
+
+
+async def export_to_file(
+    name: str, output, tags: List[str], min_score: int, compress: bool
+):
+    exporter = PostExporter(get_archive_reader(name), tags, min_score)
+    async for chunk in exporter.stream(compress):
+        output.write(chunk)
+
+
+async def export_to_folder(name: str, folder: str, file_format: str):
+    result = await export_columnar(get_archive_reader(name), folder, file_format)
+    print(f"{result['rows']} rows in {result['parts']} parts: {result['path']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="export archive posts as NDJSON")
+    parser.add_argument("name", help="archive name in archive folder")
+    parser.add_argument("-o", "--output", help="output file, stdout if not set")
+    parser.add_argument("--tag", action="append", default=[], help="required tag")
+    parser.add_argument("--min-score", type=int, default=None)
+    parser.add_argument("--zstd", action="store_true", help="zstd compressed output")
+    parser.add_argument(
+        "--format", choices=("ndjson", "parquet", "arrow"), default="ndjson"
+    )
+    args = parser.parse_args()
+
+    if args.format != "ndjson":
+        if not args.output:
+            parser.error(f"--format {args.format} require -o dataset folder")
+        asyncio.run(export_to_folder(args.name, args.output, args.format))
+        return
+
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        asyncio.run(
+            export_to_file(args.name, output, args.tag, args.min_score, args.zstd)
+        )
+    except ValueError as error:
+        logger.error(f"not exported: {args.name} {error}")
+        raise SystemExit(1)
+    finally:
+        output.flush()
+        if args.output:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,18 @@
 from app import app
 from app.utils.config import settings
+from loguru import logger
 import uvicorn
 
 if __name__ == "__main__":
-    uvicorn.run(app, host=f"{settings.host}", port=settings.port)
+    if settings.server_workers > 1 and settings.index_backend == "static":
+        # workers share page cache of memory mapped files
+        uvicorn.run(
+            "app:app",
+            host=f"{settings.host}",
+            port=settings.port,
+            workers=settings.server_workers,
+        )
+    else:
+        if settings.server_workers > 1:
+            logger.warning("server_workers is used only with static index backend")
+        uvicorn.run(app, host=f"{settings.host}", port=settings.port)
@@ -0,0 +1,36 @@
+"""Transcode posts of archives to seekable zstd files for fast random reads
+
+usage: python optimize.py <archive name> [<archive name> ...]
+       python optimize.py --all
+
+`<archive>-Posts.xml-<md5>.zst` is saved next to archive and used by reader
+instead of bzip2 blocks, remove it to read archive again
+"""
+
+import argparse
+import asyncio
+from typing import List
+
+from app.utils.archive import archive_names, get_archive_reader
+
+
+async def optimize_archives(names: List[str]):
+    for name in names:
+        await get_archive_reader(name).optimize()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="transcode archive posts to seekable zstd"
+    )
+    parser.add_argument("names", nargs="*", help="archive names in archive folder")
+    parser.add_argument("--all", action="store_true", help="all archives in folder")
+    args = parser.parse_args()
+    names = archive_names() if args.all else args.names
+    if not names:
+        parser.error("set archive names or --all")
+    asyncio.run(optimize_archives(names))
+
+
+if __name__ == "__main__":
+    main()
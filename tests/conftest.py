@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# settings without env_config, app modules read them at import
+os.environ.setdefault("COUNT_THREADS", "2")
+os.environ.setdefault("ARCHIVE_FOLDER", tempfile.gettempdir())
+os.environ.setdefault("DATABASE_FOLDER", tempfile.gettempdir())
+os.environ.setdefault("HOST", "127.0.0.1")
+os.environ.setdefault("PORT", "8000")
@@ -0,0 +1,82 @@
+import random
+import sqlite3
+
+import pytest
+
+from app.database import post_index
+from app.database.post_index import build_post_index, open_post_index
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    """Post index of questions and answers with gaps in ids"""
+    folder = tmp_path_factory.mktemp("post_index")
+    database_path = f"{folder}/posts.db"
+    connection = sqlite3.connect(database_path)
+    connection.executescript(
+        "CREATE TABLE question_posts (id INTEGER PRIMARY KEY, start INTEGER,"
+        " length INTEGER, score INTEGER, accepted_answer_id INTEGER);"
+        "CREATE TABLE answer_posts (id INTEGER PRIMARY KEY, start INTEGER,"
+        " length INTEGER, score INTEGER, question_post_id INTEGER);"
+        "CREATE TABLE post_tags (post_id INTEGER, tag_id INTEGER);"
+        "CREATE TABLE tags (id INTEGER PRIMARY KEY, name TEXT, count_usage INTEGER);"
+    )
+    rng = random.Random(7)
+    question_id = None
+    for post_id in range(1, 300):
+        kind = rng.random()
+        if kind < 0.2:
+            continue
+        if kind < 0.6 or question_id is None:
+            question_id = post_id
+            connection.execute(
+                "INSERT INTO question_posts VALUES (?, ?, 10, ?, NULL)",
+                (post_id, post_id * 10, rng.randint(-3, 3)),
+            )
+        else:
+            connection.execute(
+                "INSERT INTO answer_posts VALUES (?, ?, 10, 0, ?)",
+                (post_id, post_id * 10, question_id),
+            )
+    connection.commit()
+    connection.close()
+
+    build_post_index(database_path, f"{folder}/posts.index")
+    post_index_obj = open_post_index(f"{folder}/posts.index")
+    yield post_index_obj
+    post_index_obj.close()
+
+
+def question_ids(index) -> list:
+    return [
+        post_id
+        for post_id in range(1, index.max_id + 1)
+        if index.columns["type"][post_id] == post_index.QUESTION_TYPE
+    ]
+
+
+@pytest.mark.parametrize("type_chunk", [1, 3, 7, 64, 1 << 20])
+def test_query_question_ids_offset_across_chunks(index, monkeypatch, type_chunk):
+    monkeypatch.setattr(post_index, "TYPE_CHUNK", type_chunk)
+    expected = question_ids(index)
+    for offset in [0, 1, 2, 5, 17, 50, len(expected) - 1, len(expected), 500]:
+        for limit in [1, 4, 25, 1000]:
+            assert index.query_question_ids(offset, limit, []) == (
+                expected[offset : offset + limit]
+            )
+
+
+@pytest.mark.parametrize("type_chunk", [1, 5, 1 << 20])
+def test_query_question_ids_after_id(index, monkeypatch, type_chunk):
+    monkeypatch.setattr(post_index, "TYPE_CHUNK", type_chunk)
+    expected = question_ids(index)
+    for after_id in [0, 1, expected[10], expected[10] + 1, index.max_id]:
+        # offset is ignored with keyset page
+        assert (
+            index.query_question_ids(9, 12, [], after_id)
+            == [post_id for post_id in expected if post_id > after_id][:12]
+        )
+
+
+def test_query_question_ids_empty_limit(index):
+    assert index.query_question_ids(0, 0, []) == []
@@ -0,0 +1,76 @@
+import random
+from array import array
+
+import pytest
+
+from app.utils.sampling import draw_sample, score_strata
+
+
+def check_sample(sample, strata, count):
+    assert len(sample) == len(set(sample))
+    assert len(sample) <= count
+    ids = set().union(*map(set, strata)) if strata else set()
+    assert set(sample) <= ids
+
+
+@pytest.mark.parametrize("count", [0, 1, 7, 30, 100, 1000])
+def test_disjoint_strata_shared_equally(count):
+    strata = [range(0, 100), range(100, 200), range(200, 300)]
+    sample = draw_sample(strata, count, random.Random(1))
+    check_sample(sample, strata, count)
+    assert len(sample) == min(count, 300)
+    taken = [sum(post_id in stratum for post_id in sample) for stratum in strata]
+    assert max(taken) - min(taken) <= 1
+
+
+def test_small_stratum_gives_all_ids():
+    strata = [range(0, 3), range(100, 200), range(200, 300)]
+    sample = draw_sample(strata, 30, random.Random(2))
+    check_sample(sample, strata, 30)
+    assert len(sample) == 30
+    assert set(range(0, 3)) <= set(sample)
+    # rest of small stratum share goes to bigger ones
+    assert sorted(sum(post_id in s for post_id in sample) for s in strata) == [
+        3,
+        13,
+        14,
+    ]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_overlapping_strata_take_id_once(seed):
+    rng = random.Random(seed)
+    strata = [
+        sorted(rng.sample(range(60), rng.randint(0, 40)))
+        for _ in range(rng.randint(1, 5))
+    ]
+    count = rng.randint(0, 70)
+    sample = draw_sample(strata, count, random.Random(seed))
+    check_sample(sample, strata, count)
+    union = set().union(*map(set, strata))
+    if len(strata) == 1 or count >= len(union):
+        assert len(sample) == min(count, len(union))
+
+
+def test_same_stratum_twice():
+    stratum = list(range(10))
+    sample = draw_sample([stratum, stratum], 10, random.Random(3))
+    assert sorted(sample) == stratum
+
+
+def test_same_seed_same_sample():
+    strata = [array("i", range(0, 500)), array("i", range(250, 900))]
+    first = draw_sample(strata, 100, random.Random(42))
+    assert draw_sample(strata, 100, random.Random(42)) == first
+    assert draw_sample(strata, 100, random.Random(43)) != first
+
+
+def test_empty_strata():
+    assert draw_sample([], 10, random.Random(0)) == []
+    assert draw_sample([[], []], 10, random.Random(0)) == []
+
+
+def test_score_strata_bounds():
+    rows = [(1, -5), (2, -1), (3, 0), (4, 9), (5, 10), (6, 50)]
+    strata = score_strata(rows, [10, -1, 10])
+    assert [list(stratum) for stratum in strata] == [[1], [2, 3, 4], [5, 6]]
@@ -0,0 +1,116 @@
+import io
+import random
+
+import pytest
+
+from app.utils.archive_reader import (
+    SeekableZstdReader,
+    build_seekable_zstd,
+    read_seek_table,
+)
+
+
+def make_rows(count: int, seed=3) -> bytes:
+    rng = random.Random(seed)
+    rows = []
+    for row_id in range(count):
+        body = "x" * rng.choice([5, 40, 300, 5000])
+        rows.append(f'  <row Id="{row_id}" Body="{body}" />\n')
+    return "".join(rows).encode()
+
+
+@pytest.fixture
+def data() -> bytes:
+    return make_rows(400)
+
+
+@pytest.fixture
+def zstd_path(tmp_path, data) -> str:
+    path = str(tmp_path / "posts.zst")
+    build_seekable_zstd(io.BytesIO(data), path, frame_size=1024, level=1)
+    return path
+
+
+def test_frames_end_on_lines(zstd_path, data):
+    with open(zstd_path, "rb") as file:
+        frame_offsets, frame_starts = read_seek_table(file)
+    assert frame_starts[-1] == len(data)
+    assert len(frame_offsets) == len(frame_starts)
+    for start in frame_starts[1:-1]:
+        assert data[start - 1 : start] == b"\n"
+
+
+def test_row_longer_than_frame_is_own_frame(tmp_path):
+    data = b"short\n" + b"y" * 5000 + b"\n" + b"tail"
+    path = str(tmp_path / "long.zst")
+    count = build_seekable_zstd(io.BytesIO(data), path, frame_size=1024, level=1)
+    with open(path, "rb") as file:
+        _, frame_starts = read_seek_table(file)
+    assert count == len(frame_starts) - 1
+    assert frame_starts == [0, 6, 5007, len(data)]
+
+
+def test_empty_stream(tmp_path):
+    path = str(tmp_path / "empty.zst")
+    assert build_seekable_zstd(io.BytesIO(b""), path) == 0
+    reader = SeekableZstdReader(path)
+    assert reader.size() == 0
+    assert reader.read() == b""
+    reader.close()
+
+
+def test_reads_cross_frame_borders(zstd_path, data):
+    reader = SeekableZstdReader(zstd_path)
+    rng = random.Random(5)
+    try:
+        assert reader.read() == data
+        for _ in range(200):
+            start = rng.randrange(len(data))
+            length = rng.randrange(1, 6000)
+            reader.seek(start)
+            assert reader.read(length) == data[start : start + length]
+        reader.seek(-10, 2)
+        assert reader.read(100) == data[-10:]
+    finally:
+        reader.close()
+
+
+@pytest.mark.parametrize("cut", [1, 4, 9, 200])
+def test_truncated_file(tmp_path, zstd_path, cut):
+    with open(zstd_path, "rb") as file:
+        content = file.read()
+    path = tmp_path / "truncated.zst"
+    path.write_bytes(content[:-cut])
+    with pytest.raises(ValueError):
+        SeekableZstdReader(str(path))
+
+
+def test_cut_frame_data(tmp_path, zstd_path):
+    with open(zstd_path, "rb") as file:
+        frame_offsets, _ = read_seek_table(file)
+        file.seek(0)
+        content = file.read()
+    # one byte less in first frame, table is whole
+    path = tmp_path / "cut.zst"
+    path.write_bytes(content[:10] + content[11:])
+    with open(path, "rb") as file, pytest.raises(ValueError):
+        read_seek_table(file)
+
+
+def test_tiny_and_foreign_files(tmp_path):
+    for content in (b"", b"\x00" * 8, b"not a seekable zstd file at all"):
+        path = tmp_path / "other.zst"
+        path.write_bytes(content)
+        with open(path, "rb") as file, pytest.raises(ValueError):
+            read_seek_table(file)
+
+
+def test_table_bigger_than_file(tmp_path, zstd_path):
+    with open(zstd_path, "rb") as file:
+        content = bytearray(file.read())
+    # frame count in footer far above entries in file
+    content[-9:-5] = (10**6).to_bytes(4, "little")
+    path = tmp_path / "count.zst"
+    path.write_bytes(bytes(content))
+    with open(path, "rb") as file, pytest.raises(ValueError):
+        read_seek_table(file)